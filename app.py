@@ -1,19 +1,97 @@
 import os
 import json
+import math
 import uuid
+import gzip
+import time
 import bcrypt
-from datetime import datetime, timedelta
+import hashlib
+import threading
+from collections import OrderedDict
+from datetime import date, datetime, timedelta
 
 from flask import (
-    Flask, render_template_string, request, redirect, url_for,
-    flash, jsonify
+    Flask, request, redirect, url_for,
+    flash, jsonify, Response, render_template, g, send_file, abort
 )
+from jinja2 import DictLoader
+from markupsafe import Markup
+from werkzeug.utils import secure_filename
+
+import usage
+import backup
+import expiry
+import artifacts
+import storage
+import replica
+import ratelimit
+import revocations
+import license_token
+from metrics import REGISTRY as metrics
 
 # ========= CONFIG ==============
 SECRET_KEY = os.environ.get('SECRET_KEY', 'change-this-secret')
-LICENSES_FILE = 'data/licenses.json'
-TOOLS_FILE = 'data/tools.json'
-os.makedirs('data', exist_ok=True)
+DATA_DIR = os.environ.get('DATA_DIR', 'data')
+STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'json')  # 'json' or 'sqlite'
+STORE_OPTIONS = {}
+if STORAGE_BACKEND == 'json':
+    STORE_OPTIONS = {
+        'compact_bytes': int(os.environ.get('JOURNAL_COMPACT_BYTES', 8 * 1024 * 1024)),
+        'fsync': os.environ.get('JOURNAL_FSYNC', '1') == '1',
+        'snapshot': os.environ.get('LICENSE_SNAPSHOT', '0') == '1',
+    }
+store = storage.open_store(STORAGE_BACKEND, DATA_DIR, **STORE_OPTIONS)
+# Clients verify tokens with this key, so it is handed out; it must never
+# be SECRET_KEY, which signs the admin session. Unset: no tokens.
+TOKEN_SECRET = os.environ.get('TOKEN_SECRET') or None
+if TOKEN_SECRET == SECRET_KEY:
+    TOKEN_SECRET = None
+TOKEN_TTL = int(os.environ.get('TOKEN_TTL', 3600))  # seconds
+SLOW_REQUEST_MS = float(os.environ.get('SLOW_REQUEST_MS', 0))  # 0 disables the slow request log
+# Where the worker processes pool their metrics for /metrics (see
+# metrics.py); '' leaves each process reporting only its own.
+METRICS_DIR = os.environ.get('METRICS_DIR', os.path.join(DATA_DIR, 'metrics'))
+if METRICS_DIR:
+    metrics.share(METRICS_DIR)
+TOOLS_MAX_AGE = int(os.environ.get('TOOLS_MAX_AGE', 60))  # Cache-Control max-age for the tool API
+TOOLS_GZIP = os.environ.get('TOOLS_GZIP', '1') == '1'
+GENERATE_BULK_MAX = int(os.environ.get('GENERATE_BULK_MAX', 10000))
+CHECK_BATCH_MAX = int(os.environ.get('CHECK_BATCH_MAX', 1000))
+CHECK_BATCH_STREAM_MIN = int(os.environ.get('CHECK_BATCH_STREAM_MIN', 200))  # stream responses above this size
+HISTORY_PAGE_MAX = 500
+USAGE_FLUSH_SECONDS = float(os.environ.get('USAGE_FLUSH_SECONDS', 5))
+usage_tracker = usage.UsageTracker(os.path.join(DATA_DIR, 'usage.db'), USAGE_FLUSH_SECONDS)
+CHANGES_WAIT_MAX = 30  # seconds a /api/changes long poll may be held open
+CHANGES_LIMIT_MAX = 5000
+# Token buckets for /api/license/*, "<requests>/<seconds>" ("0" disables).
+# Requests naming a key and/or device are charged to those; the rest (and
+# batches, one token per item) to the client address.
+RATE_LIMIT_KEY = ratelimit.parse_rate(os.environ.get('RATE_LIMIT_KEY', '60/60'))
+RATE_LIMIT_DEVICE = ratelimit.parse_rate(os.environ.get('RATE_LIMIT_DEVICE', '120/60'))
+RATE_LIMIT_CLIENT = ratelimit.parse_rate(os.environ.get('RATE_LIMIT_CLIENT', '1200/60'))
+# License API requests allowed in flight across all workers; beyond that
+# they get a 503 so API_RESERVED_THREADS worker threads stay free for the
+# admin pages. Unless set, it follows the server's worker and thread count
+# (see set_worker_counts). 0 disables.
+API_CONCURRENCY_MAX_ENV = os.environ.get('API_CONCURRENCY_MAX')
+API_RESERVED_THREADS_ENV = os.environ.get('API_RESERVED_THREADS')
+API_MAX_QUEUE_MS = float(os.environ.get('API_MAX_QUEUE_MS', 0))  # shed API requests that waited longer than this
+limiter = ratelimit.SharedLimiter(os.path.join(DATA_DIR, 'ratelimit.bin'))
+# Tool files uploaded on /tools, served from /downloads/<sha256>/<filename>.
+ARTIFACT_MAX_BYTES = int(os.environ.get('ARTIFACT_MAX_BYTES', 1024 ** 3))
+# Base of the download URLs handed out by the tool API (default: the host
+# the upload came in on).
+ARTIFACT_BASE_URL = os.environ.get('ARTIFACT_BASE_URL', '').rstrip('/')
+ARTIFACT_CACHE_SECONDS = 365 * 24 * 3600
+artifact_store = artifacts.ArtifactStore(os.path.join(DATA_DIR, 'artifacts'), ARTIFACT_MAX_BYTES)
+REPLICA_OF = os.environ.get('REPLICA_OF', '').rstrip('/')  # primary's base URL; makes this node a read-only replica
+revocation_list = revocations.RevocationList(store)
+# How often the expiry sweeper runs (it also runs just after midnight); 0
+# turns it off. Never runs on a replica.
+EXPIRY_SWEEP_SECONDS = int(os.environ.get('EXPIRY_SWEEP_SECONDS', 3600))
+follower = None
+if REPLICA_OF:
+    follower = replica.Follower(REPLICA_OF, store, DATA_DIR)
 
 # ===== Flask Setup =====
 app = Flask(__name__)
@@ -103,56 +181,18 @@ BASE_TEMPLATE = """
 </html>
 """
 
-# ====== Utility Functions ======
-def load_json(path):
-    if not os.path.exists(path):
-        return []
-    with open(path, 'r') as f:
-        return json.load(f)
-
-def save_json(path, data):
-    with open(path, 'w') as f:
-        json.dump(data, f, indent=2)
-
-def status_of(lic):
-    today = datetime.now().date()
-    expiry = datetime.strptime(lic['expiry'], "%Y-%m-%d").date()
-    if not lic.get('active', True):
-        return "Disabled"
-    elif expiry < today:
-        return "Expired"
-    else:
-        return "Active"
-
-def days_left(lic):
-    expiry = datetime.strptime(lic['expiry'], "%Y-%m-%d").date()
-    today = datetime.now().date()
-    return (expiry - today).days
-
-# ========== DASHBOARD ==========
-@app.route('/')
-def dashboard():
-    licenses = load_json(LICENSES_FILE)
-    tools = load_json(TOOLS_FILE)
-    total = len(licenses)
-    active = sum(1 for l in licenses if status_of(l) == "Active")
-    expired = sum(1 for l in licenses if status_of(l) == "Expired")
-    disabled = sum(1 for l in licenses if status_of(l) == "Disabled")
-    tool_total = len(tools)
-    soon_expiry = [
-        lic for lic in licenses
-        if lic.get('active', True) and status_of(lic) == "Active" and datetime.strptime(lic['expiry'], "%Y-%m-%d") < datetime.now() + timedelta(days=7)
-    ]
-    dashboard_html = f"""
+DASHBOARD_TEMPLATE = """
+{% extends "base.html" %}
+{% block content %}
     <h2>Dashboard</h2>
     <div style="display:flex; gap:2em; flex-wrap:wrap; align-items:flex-end;">
     <div>
         <h3>License Stats</h3>
         <ul>
-            <li>Total Licenses: <b>{total}</b></li>
-            <li>Active: <b>{active}</b></li>
-            <li>Expired: <b>{expired}</b></li>
-            <li>Disabled: <b>{disabled}</b></li>
+            <li>Total Licenses: <b>{{ total }}</b></li>
+            <li>Active: <b>{{ active }}</b></li>
+            <li>Expired: <b>{{ expired }}</b></li>
+            <li>Disabled: <b>{{ disabled }}</b></li>
         </ul>
         <div class="chart-container">
             <canvas id="licenseChart"></canvas>
@@ -161,97 +201,100 @@ def dashboard():
     <div>
         <h3>Tool Stats</h3>
         <ul>
-            <li>Total Tools: <b>{tool_total}</b></li>
+            <li>Total Tools: <b>{{ tool_labels|length }}</b></li>
         </ul>
         <div class="chart-container">
             <canvas id="toolChart"></canvas>
         </div>
     </div>
     </div>
+    <div>
+        <h3>Usage</h3>
+        <ul>
+            <li>Licenses seen (24 hours): <b>{{ seen_day }}</b></li>
+            <li>Licenses seen (7 days): <b>{{ seen_week }}</b></li>
+            <li>Active devices by day: {% for day, n in daily_devices %}<b>{{ n }}</b>{% if not loop.last %} &middot; {% endif %}{% endfor %}</li>
+            {% if usage_versions %}
+            <li>Checks by version (7 days): {% for version, n in usage_versions %}{{ version or "(none)" }} <b>{{ n }}</b>{% if not loop.last %} &middot; {% endif %}{% endfor %}</li>
+            {% endif %}
+        </ul>
+        <div style="max-width:900px;">
+            <canvas id="usageChart"></canvas>
+        </div>
+    </div>
     <script>
-    window.addEventListener('DOMContentLoaded', function() {{
+    window.addEventListener('DOMContentLoaded', function() {
+        var usageCtx = document.getElementById('usageChart').getContext('2d');
+        new Chart(usageCtx, {
+            type: 'line',
+            data: {
+                labels: {{ usage_labels|tojson }},
+                datasets: [{
+                    label: 'Active devices per hour',
+                    data: {{ usage_devices|tojson }},
+                    borderColor: '#1976d2',
+                    pointRadius: 0
+                }, {
+                    label: 'Checks per hour',
+                    data: {{ usage_checks|tojson }},
+                    borderColor: '#3ec96b',
+                    pointRadius: 0,
+                    yAxisID: 'checks'
+                }]
+            },
+            options: {
+                responsive: true,
+                scales: { checks: { position: 'right', grid: { display: false } } },
+                plugins: { legend: { position: 'bottom' } }
+            }
+        });
         var ctx = document.getElementById('licenseChart').getContext('2d');
-        new Chart(ctx, {{
+        new Chart(ctx, {
             type: 'doughnut',
-            data: {{
+            data: {
                 labels: ['Active', 'Expired', 'Disabled'],
-                datasets: [{{
-                    data: [{active}, {expired}, {disabled}],
+                datasets: [{
+                    data: [{{ active }}, {{ expired }}, {{ disabled }}],
                     backgroundColor: ['#3ec96b', '#f35a5a', '#cccccc']
-                }}]
-            }},
-            options: {{
+                }]
+            },
+            options: {
                 responsive: true,
-                plugins: {{ legend: {{ position: 'bottom' }} }}
-            }}
-        }});
+                plugins: { legend: { position: 'bottom' } }
+            }
+        });
         var toolCtx = document.getElementById('toolChart').getContext('2d');
-        new Chart(toolCtx, {{
+        new Chart(toolCtx, {
             type: 'bar',
-            data: {{
-                labels: [{','.join([f"'{t['name']} v{t['version']}'" for t in tools])}],
-                datasets: [{{
+            data: {
+                labels: {{ tool_labels|tojson }},
+                datasets: [{
                     label: 'Tools',
-                    data: [{','.join(['1' for _ in tools])}],
+                    data: {{ tool_counts|tojson }},
                     backgroundColor: '#1976d2'
-                }}]
-            }},
-            options: {{
+                }]
+            },
+            options: {
                 responsive: true,
-                plugins: {{ legend: {{ display: false }} }}
-            }}
-        }});
-    }});
+                plugins: { legend: { display: false } }
+            }
+        });
+    });
     </script>
-    """
-    if soon_expiry:
-        dashboard_html += f"""
+    {% if soon_expiry %}
         <div class="msg danger">
             <b>Expiring soon:</b>
             <ul>
-            {''.join([f"<li>{lic['key']} (expires: {lic['expiry']})</li>" for lic in soon_expiry])}
+            {% for lic in soon_expiry %}<li>{{ lic.key }} (expires: {{ lic.expiry }})</li>{% endfor %}
             </ul>
         </div>
-        """
-    return render_template_string(BASE_TEMPLATE, content=dashboard_html)
+    {% endif %}
+{% endblock %}
+"""
 
-# ========== LICENSE MANAGEMENT ==========
-@app.route('/licenses', methods=['GET', 'POST'])
-def license_admin():
-    licenses = load_json(LICENSES_FILE)
-    # Generate License
-    if request.method == "POST" and "generate" in request.form:
-        device_id = request.form['device_id']
-        version = request.form['version']
-        expiry = request.form['expiry']
-        key = str(uuid.uuid4()).replace('-', '').upper()[:20]
-        licenses.append({
-            "key": key,
-            "device_id": device_id,
-            "version": version,
-            "expiry": expiry,
-            "active": True,
-            "created": datetime.now().strftime("%Y-%m-%d"),
-            "history": [{"event": "Created", "date": datetime.now().strftime("%Y-%m-%d")}]
-        })
-        save_json(LICENSES_FILE, licenses)
-        flash(f'License {key} created', 'success')
-        return redirect(url_for('license_admin'))
-    # Search/filter
-    q = request.args.get('q', '').lower()
-    status_filter = request.args.get('status', '')
-    filtered = licenses
-    if q:
-        filtered = [lic for lic in filtered if q in lic['device_id'].lower() or q in lic['key'].lower()]
-    if status_filter:
-        filtered = [lic for lic in filtered if status_of(lic).lower() == status_filter.lower()]
-    # Pagination
-    page = int(request.args.get('page', 1))
-    per_page = 15
-    total_pages = max(1, (len(filtered) + per_page - 1) // per_page)
-    paginated = filtered[(page-1)*per_page: page*per_page]
-    # HTML
-    html = f"""
+LICENSES_TEMPLATE = """
+{% extends "base.html" %}
+{% block content %}
     <h2>License Management</h2>
     <form method="POST" style="margin-bottom:1.5em; background:#f3f9ff; border-radius:6px; padding:1em 1.5em;">
         <div class="form-row">
@@ -268,203 +311,112 @@ def license_admin():
         </div>
         <input type="submit" name="generate" value="Generate License">
     </form>
+    <details style="margin-bottom:1.5em;">
+        <summary>Bulk revoke / extend</summary>
+        <form method="POST" style="background:#fff8ec; border-radius:6px; padding:1em 1.5em; margin-top:0.5em;"
+              onsubmit="return confirm('Apply to every matching license?');">
+            <div class="form-row">
+                <label>Keys (one per line; leave empty to use the filter only):</label><br>
+                <textarea name="keys" rows="4" cols="40"></textarea>
+            </div>
+            <div class="form-row">
+                <label>Version:</label> <input name="version" type="text">
+                <label>Status:</label>
+                <select name="status">
+                    <option value="">Any</option>
+                    {% for st in ['Active', 'Expired', 'Disabled'] %}<option value="{{ st }}">{{ st }}</option>{% endfor %}
+                </select>
+                <label>Device prefix:</label> <input name="device_prefix" type="text">
+            </div>
+            <div class="form-row">
+                <label>Expiring from</label> <input name="expiry_from" type="date">
+                <label>to</label> <input name="expiry_to" type="date">
+            </div>
+            <div class="form-row">
+                <input type="submit" name="bulk" value="Revoke">
+                &nbsp; or extend to <input name="new_expiry" type="date">
+                <input type="submit" name="bulk" value="Extend">
+            </div>
+        </form>
+    </details>
     <form method="GET" style="margin-bottom:1em;">
-        <input name="q" placeholder="Search device or key" value="{q}">
+        <input name="q" placeholder="Search device or key" value="{{ q }}">
         <select name="status">
-            <option value="" {"selected" if not status_filter else ""}>All</option>
-            <option value="Active" {"selected" if status_filter=='Active' else ""}>Active</option>
-            <option value="Expired" {"selected" if status_filter=='Expired' else ""}>Expired</option>
-            <option value="Disabled" {"selected" if status_filter=='Disabled' else ""}>Disabled</option>
+            <option value="" {{ "selected" if not status_filter }}>All</option>
+            {% for st in ['Active', 'Expired', 'Disabled'] %}
+            <option value="{{ st }}" {{ "selected" if status_filter == st }}>{{ st }}</option>
+            {% endfor %}
         </select>
         <input type="submit" value="Search">
     </form>
+    {{ table }}
+{% endblock %}
+"""
+
+LICENSE_TABLE_TEMPLATE = """
     <table>
         <tr>
             <th>Key</th><th>Device ID</th><th>Version</th><th>Expiry</th><th>Status</th><th>Days</th><th>Action</th>
         </tr>
-    """
-    for lic in paginated:
-        st = status_of(lic)
-        html += f"""
-        <tr class="{st.lower()}">
-            <td>{lic['key']}</td>
-            <td>{lic['device_id']}</td>
-            <td>{lic['version']}</td>
-            <td>{lic['expiry']}</td>
-            <td>{st}</td>
-            <td>{days_left(lic) if st=='Active' else 'Expired' if st=='Expired' else 'N/A'}</td>
+        {% for lic, st, days in rows %}
+        <tr class="{{ st|lower }}">
+            <td><a href="{{ url_for('license_history_view', key=lic.key) }}">{{ lic.key }}</a></td>
+            <td>{{ lic.device_id }}</td>
+            <td>{{ lic.version }}</td>
+            <td>{{ lic.expiry }}</td>
+            <td>{{ st }}</td>
+            <td>{{ days if st == 'Active' else 'Expired' if st == 'Expired' else 'N/A' }}</td>
             <td>
-                {'<form method="POST" action="'+url_for('license_revoke', key=lic['key'])+'" style="display:inline"><button type="submit">Revoke</button></form>' if lic.get('active', True) else ''}
-                <form method="POST" action="{url_for('license_extend', key=lic['key'])}" style="display:inline">
+                {% if lic.active %}<form method="POST" action="{{ url_for('license_revoke', key=lic.key) }}" style="display:inline"><button type="submit">Revoke</button></form>{% endif %}
+                <form method="POST" action="{{ url_for('license_extend', key=lic.key) }}" style="display:inline">
                     <input type="date" name="expiry" required>
                     <button type="submit">Extend</button>
                 </form>
             </td>
         </tr>
-        """
-    html += "</table>"
-    html += f"""
+        {% endfor %}
+    </table>
     <div class="pagination">
-    {''.join([
-        f'<span class="current">{p}</span>' if p == page else f'<a href="{url_for("license_admin")}?q={q}&status={status_filter}&page={p}">{p}</a>'
-        for p in range(1, total_pages+1)
-    ])}
+    {% if has_prev %}
+        <a href="{{ url_for('license_admin', q=q, status=status_filter) }}">&laquo; First</a>
+        <a href="{{ url_for('license_admin', q=q, status=status_filter, before=rows[0][0].key) }}">&lsaquo; Prev</a>
+    {% endif %}
+    {% if has_next %}
+        <a href="{{ url_for('license_admin', q=q, status=status_filter, after=rows[-1][0].key) }}">Next &rsaquo;</a>
+    {% endif %}
     </div>
-    """
-    return render_template_string(BASE_TEMPLATE, content=html)
-
-@app.route('/licenses/revoke/<key>', methods=['POST'])
-def license_revoke(key):
-    licenses = load_json(LICENSES_FILE)
-    for lic in licenses:
-        if lic['key'] == key:
-            lic['active'] = False
-            lic.setdefault('history',[]).append({"event":"Revoked","date":datetime.now().strftime("%Y-%m-%d")})
-    save_json(LICENSES_FILE, licenses)
-    flash('License revoked', 'info')
-    return redirect(url_for('license_admin'))
-
-@app.route('/licenses/extend/<key>', methods=['POST'])
-def license_extend(key):
-    new_expiry = request.form['expiry']
-    licenses = load_json(LICENSES_FILE)
-    for lic in licenses:
-        if lic['key'] == key:
-            lic['expiry'] = new_expiry
-            lic.setdefault('history',[]).append({"event":f"Extended to {new_expiry}","date":datetime.now().strftime("%Y-%m-%d")})
-    save_json(LICENSES_FILE, licenses)
-    flash('License extended', 'success')
-    return redirect(url_for('license_admin'))
-
-# ========== LICENSE API ==========
-@app.route('/api/license/generate', methods=['POST'])
-def api_generate_license():
-    data = request.get_json(force=True)
-    device_id = data.get('device_id')
-    version = data.get('version')
-    expiry = data.get('expiry')
-    if not (device_id and version and expiry):
-        return jsonify({'error': 'Missing fields'}), 400
-    licenses = load_json(LICENSES_FILE)
-    key = str(uuid.uuid4()).replace('-', '').upper()[:20]
-    licenses.append({
-        "key": key,
-        "device_id": device_id,
-        "version": version,
-        "expiry": expiry,
-        "active": True,
-        "created": datetime.now().strftime("%Y-%m-%d"),
-        "history": [{"event": "Created", "date": datetime.now().strftime("%Y-%m-%d")}]
-    })
-    save_json(LICENSES_FILE, licenses)
-    return jsonify({'key': key})
-
-@app.route('/api/license/check', methods=['POST'])
-def api_check_license():
-    data = request.get_json(force=True)
-    key = data.get('key')
-    device_id = data.get('device_id')
-    version = data.get('version')
-    licenses = load_json(LICENSES_FILE)
-    lic = next((l for l in licenses if l['key'] == key), None)
-    if not lic:
-        return jsonify({'status': 'not_found'}), 404
-    if not lic.get('active', True):
-        return jsonify({'status': 'revoked'}), 403
-    if lic['device_id'] != device_id:
-        return jsonify({'status': 'device_mismatch'}), 403
-    if lic['version'] != version:
-        return jsonify({'status': 'version_mismatch'}), 426
-    expiry = datetime.strptime(lic['expiry'], "%Y-%m-%d")
-    if expiry < datetime.now():
-        return jsonify({'status': 'expired'}), 403
-    days_left_val = (expiry - datetime.now()).days
-    return jsonify({'status': 'valid', 'days_left': days_left_val, 'expiry': lic['expiry']})
-
-@app.route('/api/license/revoke', methods=['POST'])
-def api_revoke_license():
-    data = request.get_json(force=True)
-    key = data.get('key')
-    licenses = load_json(LICENSES_FILE)
-    for lic in licenses:
-        if lic['key'] == key:
-            lic['active'] = False
-            lic.setdefault('history',[]).append({"event":"Revoked by API","date":datetime.now().strftime("%Y-%m-%d")})
-    save_json(LICENSES_FILE, licenses)
-    return jsonify({'status': 'revoked'})
-
-@app.route('/api/license/extend', methods=['POST'])
-def api_extend_license():
-    data = request.get_json(force=True)
-    key = data.get('key')
-    new_expiry = data.get('expiry')
-    licenses = load_json(LICENSES_FILE)
-    for lic in licenses:
-        if lic['key'] == key:
-            lic['expiry'] = new_expiry
-            lic.setdefault('history',[]).append({"event":f"Extended by API to {new_expiry}","date":datetime.now().strftime("%Y-%m-%d")})
-    save_json(LICENSES_FILE, licenses)
-    return jsonify({'status': 'extended'})
-
-# ========== TOOL MANAGEMENT ==========
-@app.route('/tools', methods=['GET', 'POST'])
-def tools_admin():
-    tools = load_json(TOOLS_FILE)
-
-    if request.method == "POST":
-        if "add_tool" in request.form:
-            name = request.form["name"].strip()
-            version = request.form["version"].strip()
-            url = request.form["download_url"].strip()
-            update_required = bool(request.form.get("update_required"))
-            if any(t["name"].lower() == name.lower() for t in tools):
-                flash("Tool already exists", "danger")
-            else:
-                tools.append({
-                    "name": name,
-                    "version": version,
-                    "download_url": url,
-                    "update_required": update_required
-                })
-                save_json(TOOLS_FILE, tools)
-                flash("Tool added", "success")
-            return redirect(url_for('tools_admin'))
-
-        elif "edit_tool" in request.form:
-            old_name = request.form["original_name"]
-            for tool in tools:
-                if tool["name"] == old_name:
-                    tool["name"] = request.form["name"].strip()
-                    tool["version"] = request.form["version"].strip()
-                    tool["download_url"] = request.form["download_url"].strip()
-                    tool["update_required"] = bool(request.form.get("update_required"))
-                    flash("Tool updated", "success")
-                    break
-            save_json(TOOLS_FILE, tools)
-            return redirect(url_for('tools_admin'))
-
-        elif "delete_tool" in request.form:
-            del_name = request.form["delete_tool"]
-            tools = [t for t in tools if t["name"] != del_name]
-            save_json(TOOLS_FILE, tools)
-            flash("Tool deleted", "info")
-            return redirect(url_for('tools_admin'))
-
-    # Filter/search
-    filter_val = request.args.get("filter", "").strip().lower()
-    filtered_tools = tools
-    if filter_val:
-        filtered_tools = [t for t in tools if filter_val in t['name'].lower() or filter_val in t['version'].lower()]
+"""
 
-    # Pagination
-    page = int(request.args.get("page", 1))
-    per_page = 10
-    total_pages = max(1, (len(filtered_tools) + per_page - 1) // per_page)
-    paginated_tools = filtered_tools[(page-1)*per_page : page*per_page]
+LICENSE_HISTORY_TEMPLATE = """
+{% extends "base.html" %}
+{% block content %}
+    <h2>License {{ lic.key }}</h2>
+    <p>Device: <b>{{ lic.device_id or '(unassigned)' }}</b> &middot; Version: <b>{{ lic.version }}</b> &middot; Expiry: <b>{{ lic.expiry }}</b> &middot; Status: <b>{{ status }}</b></p>
+    <p>Last seen: <b>{{ last_seen or 'never' }}</b> &middot; Checks: <b>{{ checks }}</b></p>
+    <h3>History ({{ total }} events)</h3>
+    <table>
+        <tr><th>#</th><th>Date</th><th>Event</th></tr>
+        {% for event in events %}
+        <tr><td>{{ offset + loop.index }}</td><td>{{ event.date }}</td><td>{{ event.event }}</td></tr>
+        {% endfor %}
+    </table>
+    <div class="pagination">
+    {% if offset > 0 %}
+        <a href="{{ url_for('license_history_view', key=lic.key, offset=[offset - limit, 0]|max) }}">&lsaquo; Prev</a>
+    {% endif %}
+    {% if offset + limit < total %}
+        <a href="{{ url_for('license_history_view', key=lic.key, offset=offset + limit) }}">Next &rsaquo;</a>
+    {% endif %}
+    </div>
+    <p><a href="{{ url_for('license_admin') }}">&laquo; Back to licenses</a></p>
+{% endblock %}
+"""
 
-    html = f"""
+TOOLS_TEMPLATE = """
+{% extends "base.html" %}
+{% block content %}
     <h2>Tool Management</h2>
-    <form method="POST" style="margin-bottom:2em; background:#f3f9ff; border-radius:6px; padding:1em 1.5em;">
+    <form method="POST" enctype="multipart/form-data" style="margin-bottom:2em; background:#f3f9ff; border-radius:6px; padding:1em 1.5em;">
         <div class="form-row">
             <label>Tool Name:</label><br>
             <input name="name" type="text" required>
@@ -475,68 +427,71 @@ def tools_admin():
         </div>
         <div class="form-row">
             <label>Download URL:</label><br>
-            <input name="download_url" type="text" required>
+            <input name="download_url" type="text" placeholder="or upload the file below">
+        </div>
+        <div class="form-row">
+            <label>File:</label><br>
+            <input name="artifact" type="file">
         </div>
         <label><input type="checkbox" name="update_required"> Update Required?</label>
         <br>
         <input type="submit" name="add_tool" value="Add Tool">
     </form>
     <form method="GET" style="margin-bottom:1em;">
-        <input type="text" name="filter" value="{filter_val}" placeholder="Tool Name or Version">
+        <input type="text" name="filter" value="{{ filter_val }}" placeholder="Tool Name or Version">
         <input type="submit" value="Search">
     </form>
+    {{ table }}
+{% endblock %}
+"""
+
+TOOL_TABLE_TEMPLATE = """
     <table>
         <tr>
-            <th>Name</th><th>Version</th><th>Download URL</th><th>Update Required</th><th>Action</th>
+            <th>Name</th><th>Version</th><th>Download URL</th><th>File</th><th>Update Required</th><th>Action</th>
         </tr>
-    """
-    for tool in paginated_tools:
-        html += f"""
+        {% for tool in tools %}
         <tr>
-            <form method="POST" style="display:inline;">
-                <input type="hidden" name="original_name" value="{tool['name']}">
-                <td><input name="name" value="{tool['name']}" style="width:120px" required></td>
-                <td><input name="version" value="{tool['version']}" style="width:90px" required></td>
-                <td><input name="download_url" value="{tool['download_url']}" style="width:210px" required></td>
+            <form method="POST" enctype="multipart/form-data" style="display:inline;">
+                <input type="hidden" name="original_name" value="{{ tool.name }}">
+                <td><input name="name" value="{{ tool.name }}" style="width:120px" required></td>
+                <td><input name="version" value="{{ tool.version }}" style="width:90px" required></td>
+                <td><input name="download_url" value="{{ tool.download_url }}" style="width:210px" required></td>
+                <td>
+                    {% if tool.sha256 %}<span title="sha256 {{ tool.sha256 }}">{{ tool.filename }} ({{ tool.size | filesizeformat }})</span><br>{% endif %}
+                    <input name="artifact" type="file" style="width:180px">
+                </td>
                 <td style="text-align:center;">
-                    <input type="checkbox" name="update_required" {"checked" if tool.get("update_required") else ""}>
+                    <input type="checkbox" name="update_required" {{ "checked" if tool.get("update_required") }}>
                 </td>
                 <td>
                     <button type="submit" name="edit_tool" value="1">Save</button>
-                    <button type="submit" name="delete_tool" value="{tool['name']}" onclick="return confirm('Delete this tool?')">Delete</button>
+                    <button type="submit" name="delete_tool" value="{{ tool.name }}" onclick="return confirm('Delete this tool?')">Delete</button>
                 </td>
             </form>
         </tr>
-        """
-    html += "</table>"
-    html += f"""
+        {% endfor %}
+    </table>
     <div class="pagination">
-    {''.join([
-        f'<span class="current">{p}</span>' if p == page else f'<a href="{url_for("tools_admin")}?filter={filter_val}&page={p}">{p}</a>'
-        for p in range(1, total_pages+1)
-    ])}
+    {% if page > 1 %}<a href="{{ url_for('tools_admin', filter=filter_val, page=page - 1) }}">&lsaquo; Prev</a>{% endif %}
+    {% if window[0] > 1 %}
+        <a href="{{ url_for('tools_admin', filter=filter_val, page=1) }}">1</a>
+        {% if window[0] > 2 %}<span>&hellip;</span>{% endif %}
+    {% endif %}
+    {% for p in window %}
+        {% if p == page %}<span class="current">{{ p }}</span>{% else %}<a href="{{ url_for('tools_admin', filter=filter_val, page=p) }}">{{ p }}</a>{% endif %}
+    {% endfor %}
+    {% if window[-1] < total_pages %}
+        {% if window[-1] < total_pages - 1 %}<span>&hellip;</span>{% endif %}
+        <a href="{{ url_for('tools_admin', filter=filter_val, page=total_pages) }}">{{ total_pages }}</a>
+    {% endif %}
+    {% if page < total_pages %}<a href="{{ url_for('tools_admin', filter=filter_val, page=page + 1) }}">Next &rsaquo;</a>{% endif %}
     </div>
-    """
-    return render_template_string(BASE_TEMPLATE, content=html)
-
-# ========== TOOL API ==========
-@app.route('/api/tools', methods=['GET'])
-def api_get_tools():
-    tools = load_json(TOOLS_FILE)
-    return jsonify({'tools': tools})
-
-@app.route('/api/tool/<name>', methods=['GET'])
-def api_get_tool_by_name(name):
-    tools = load_json(TOOLS_FILE)
-    for tool in tools:
-        if tool['name'].lower() == name.lower():
-            return jsonify(tool)
-    return jsonify({'error': 'Tool not found'}), 404
+"""
 
-# ========== API DOCS ==========
-@app.route('/docs')
-def docs():
-    docs_html = """
+DOCS_TEMPLATE = """
+{% extends "base.html" %}
+{% block content %}
     <h2>API Documentation</h2>
     <ul>
         <li><b>POST /api/license/generate</b><br>
@@ -550,6 +505,18 @@ def docs():
             <pre>{
     "key": "LICENSEKEY1234567890"
 }</pre>
+        </li>
+        <li><b>POST /api/license/generate-bulk</b><br>
+            <i>Generates many licenses in one write. Pass either <code>device_ids</code> (one license each) or <code>count</code> (unassigned licenses that bind to the first device that checks them).</i><br>
+            <b>Request:</b>
+            <pre>{
+    "device_ids": ["device-123", "device-456"],
+    "version": "1.0.0",
+    "expiry": "2025-12-31"
+}</pre>
+            <b>Response</b> (<code>application/x-ndjson</code>, one line per license):
+            <pre>{"key": "LICENSEKEY1234567890", "device_id": "device-123"}
+{"key": "LICENSEKEY0987654321", "device_id": "device-456"}</pre>
         </li>
         <li><b>POST /api/license/check</b><br>
             <b>Request:</b>
@@ -571,6 +538,40 @@ def docs():
             <b>Response (device mismatch):</b>
             <pre>{
     "status": "device_mismatch"
+}</pre>
+        </li>
+        <li><b>POST /api/license/check-batch</b><br>
+            <i>Checks many licenses in one request (up to the configured maximum batch size).</i><br>
+            <b>Request:</b>
+            <pre>[
+    {"key": "LICENSEKEY1234567890", "device_id": "device-123", "version": "1.0.0"},
+    {"key": "OTHERKEY123456789012", "device_id": "device-123", "version": "2.0.0"}
+]</pre>
+            <b>Response:</b> one result per item, in request order, with the same statuses as <code>/api/license/check</code>
+            <pre>{
+    "results": [
+        {"key": "LICENSEKEY1234567890", "status": "valid", "days_left": 90, "expiry": "2025-12-31"},
+        {"key": "OTHERKEY123456789012", "status": "not_found"}
+    ]
+}</pre>
+        </li>
+        <li><b>POST /api/license/token</b><br>
+            <i>Same request and statuses as <code>/api/license/check</code>. A valid check also returns a signed token the client can verify offline with <code>license_token.verify()</code> until <code>token_expires</code>.
+            Answers 404 unless the server has its own <code>TOKEN_SECRET</code>.</i><br>
+            <b>Response (valid):</b>
+            <pre>{
+    "status": "valid",
+    "days_left": 90,
+    "expiry": "2025-12-31",
+    "token": "eyJrIjoiTElDRU5TRUtFWTEyMzQ1Njc4OTAiLC4uLn0.c2lnbmF0dXJl",
+    "token_expires": 1735689600
+}</pre>
+        </li>
+        <li><b>GET /api/license/revoked</b><br>
+            <i>Keys of all revoked licenses, for clients that check cached tokens against revocations.</i><br>
+            <b>Response:</b>
+            <pre>{
+    "keys": ["LICENSEKEY1234567890"]
 }</pre>
         </li>
         <li><b>POST /api/license/revoke</b><br>
@@ -581,6 +582,48 @@ def docs():
             <b>Response:</b>
             <pre>{
     "status": "revoked"
+}</pre>
+        </li>
+        <li><b>GET /api/license/revocations</b><br>
+            <i>The revoked keys, sorted and front-coded (zlib, base64; <code>revocations.decode()</code> reads it), with a version. Send the version back as <code>since</code> to get only the keys revoked or reinstated after it. Versions are per server.</i><br>
+            <b>Example:</b> <code>/api/license/revocations?since=42</code><br>
+            <b>Response (no or unknown <code>since</code>):</b>
+            <pre>{
+    "version": 42,
+    "full": true,
+    "count": 1234,
+    "keys": "eNoBZQCa/w..."
+}</pre>
+            <b>Response (delta):</b>
+            <pre>{
+    "version": 45,
+    "full": false,
+    "added": ["LICENSEKEY1234567890"],
+    "removed": []
+}</pre>
+        </li>
+        <li><b>GET /api/license/expiring</b><br>
+            <i>Queued expiry notices (at 30, 7 and 1 days before expiry) for licenses expiring within <code>within</code>
+            days (default and maximum 30). Add <code>pending=1</code> to leave out notices already marked sent.
+            Filled by the background expiry sweeper, which also writes an "Expired" history event when a license expires.</i><br>
+            <b>Example:</b> <code>/api/license/expiring?within=7&amp;pending=1</code><br>
+            <b>Response:</b>
+            <pre>{
+    "within": 7,
+    "notices": [
+        {"id": 17, "key": "LICENSEKEY1234567890", "device_id": "device-123", "expiry": "2025-12-31",
+         "days_left": 6, "notice": 7, "queued": 1735084800, "sent": null}
+    ]
+}</pre>
+        </li>
+        <li><b>POST /api/license/expiring/sent</b><br>
+            <b>Request:</b>
+            <pre>{
+    "ids": [17]
+}</pre>
+            <b>Response:</b>
+            <pre>{
+    "marked": 1
 }</pre>
         </li>
         <li><b>POST /api/license/extend</b><br>
@@ -592,6 +635,61 @@ def docs():
             <b>Response:</b>
             <pre>{
     "status": "extended"
+}</pre>
+        </li>
+        <li><b>POST /api/license/revoke-bulk</b>, <b>POST /api/license/extend-bulk</b><br>
+            <i>Revoke or extend every license in <code>keys</code> and/or matching <code>filter</code> (any of <code>version</code>, <code>status</code>, <code>device_prefix</code>, <code>expiry_from</code>, <code>expiry_to</code>; all given must match) in one commit. Extend also takes the new <code>expiry</code>.</i><br>
+            <b>Request:</b>
+            <pre>{
+    "filter": {"version": "1.0", "status": "Active", "device_prefix": "ACME-"},
+    "expiry": "2026-12-31"
+}</pre>
+            <b>Response:</b>
+            <pre>{
+    "status": "extended",
+    "count": 312
+}</pre>
+        </li>
+        <li><b>GET /api/license/&lt;key&gt;/history</b><br>
+            <i>A license's events, oldest first. Paginate with <code>offset</code> and <code>limit</code> (default 50, max 500).</i><br>
+            <b>Example:</b> <code>/api/license/LICENSEKEY1234567890/history?offset=0&amp;limit=50</code><br>
+            <b>Response:</b>
+            <pre>{
+    "key": "LICENSEKEY1234567890",
+    "events": [
+        {"event": "Created", "date": "2025-01-01"},
+        {"event": "Extended to 2026-12-31", "date": "2025-12-01"}
+    ],
+    "offset": 0,
+    "limit": 50,
+    "total": 2
+}</pre>
+        </li>
+        <li><b>GET /api/changes</b><br>
+            <i>Every license and tool change after <code>since</code>, oldest first, each with the full new state. With <code>wait</code> (seconds, max 30) the request is held until there is something to return. Pass the returned <code>seq</code> as the next <code>since</code>; <code>more</code> means the page was full. <code>reset</code> means the changes since then are no longer available: load <code>/api/changes/snapshot</code> (NDJSON: a <code>{"seq": N}</code> line, then one change per line) and continue from its <code>seq</code>.</i><br>
+            <b>Example:</b> <code>/api/changes?since=41&amp;wait=25&amp;limit=1000</code><br>
+            <b>Response:</b>
+            <pre>{
+    "changes": [
+        {"seq": 42, "type": "license", "license": {"key": "LICENSEKEY1234567890", "device_id": "abc", "version": "1.0", "expiry": "2026-12-31", "active": false, "created": "2025-01-01"}},
+        {"seq": 43, "type": "tools", "tools": [...]}
+    ],
+    "seq": 43,
+    "reset": false,
+    "more": false
+}</pre>
+        </li>
+        <li><b>GET /api/export</b>, <b>POST /api/import</b><br>
+            <i>Streams every tool and license (and with <code>?history=1</code> every history event) as NDJSON, one record per line; import takes the same format (upserting, 10k records per commit) and reports counts, skipped lines and throughput. Status 207 means some lines were skipped.</i><br>
+            <b>Export lines:</b>
+            <pre>{"type":"export","seq":42,"exported":"2025-06-01T12:00:00","history":true}
+{"type":"tool","tool":{"name":"ToolA","version":"1.0.0","download_url":"https://example.com/ToolA.zip","update_required":false}}
+{"type":"license","license":{"key":"LICENSEKEY1234567890","device_id":"abc","version":"1.0","expiry":"2026-12-31","active":true,"created":"2025-01-01"}}
+{"type":"event","key":"LICENSEKEY1234567890","event":"Created","date":"2025-01-01"}</pre>
+            <b>Import response:</b>
+            <pre>{
+    "licenses": 100000, "tools": 50, "events": 180000, "skipped": 0, "errors": [],
+    "bytes": 41000000, "seconds": 4.2, "records_per_second": 66667, "mb_per_second": 9.76
 }</pre>
         </li>
         <li><b>GET /api/tools</b><br>
@@ -603,9 +701,20 @@ def docs():
             "version": "1.0.0",
             "download_url": "https://example.com/ToolA.zip",
             "update_required": false
+        },
+        {
+            "name": "ToolB",
+            "version": "2.1.0",
+            "download_url": "https://licenses.example.com/downloads/9f86d0...0a08/ToolB.zip",
+            "update_required": false,
+            "sha256": "9f86d081884c7d659a2feaa0c55ad015a3bf4f1b2b0b822cd15d6c15b0f00a08",
+            "size": 18234112,
+            "filename": "ToolB.zip"
         }
     ]
 }</pre>
+            <i>Tools whose file was uploaded on the Tools page also carry <code>sha256</code>, <code>size</code>
+            and <code>filename</code>; verify the download against <code>sha256</code>.</i>
         </li>
         <li><b>GET /api/tool/&lt;name&gt;</b><br>
             <i>Returns a single tool by name (case-insensitive)</i><br>
@@ -622,11 +731,845 @@ def docs():
     "error": "Tool not found"
 }</pre>
         </li>
+        <li><b>GET /downloads/&lt;sha256&gt;/&lt;filename&gt;</b><br>
+            <i>An uploaded tool file (the <code>download_url</code> above). Supports <code>Range</code> requests for
+            resuming, answers <code>If-None-Match</code> with 304 (the ETag is the sha256) and may be cached
+            indefinitely.</i>
+        </li>
     </ul>
     <p>All APIs use JSON. Always set <code>Content-Type: application/json</code> in your requests.</p>
-    """
-    return render_template_string(BASE_TEMPLATE, content=docs_html)
+{% endblock %}
+"""
+
+TEMPLATE_SOURCES = {
+    'base.html': BASE_TEMPLATE,
+    'dashboard.html': DASHBOARD_TEMPLATE,
+    'licenses.html': LICENSES_TEMPLATE,
+    'license_table.html': LICENSE_TABLE_TEMPLATE,
+    'license_history.html': LICENSE_HISTORY_TEMPLATE,
+    'tools.html': TOOLS_TEMPLATE,
+    'tool_table.html': TOOL_TABLE_TEMPLATE,
+    'docs.html': DOCS_TEMPLATE,
+}
+app.jinja_loader = DictLoader(TEMPLATE_SOURCES)
+# Compiled once at startup; views render these Template objects directly.
+TEMPLATES = {name: app.jinja_env.get_template(name) for name in TEMPLATE_SOURCES}
+
+# ====== Metrics ======
+@app.before_request
+def start_timer():
+    start_background_threads()
+    g.request_start = time.perf_counter()
+    # Set by nginx & co as "t=<epoch seconds or microseconds>"; tells us how
+    # long the request waited for a free worker.
+    queued = request.headers.get('X-Request-Start', '').lstrip('t=')
+    try:
+        started = float(queued)
+    except ValueError:
+        return
+    if started > 1e11:
+        started /= 1e6
+    g.queued = max(0.0, time.time() - started)
+    metrics.observe('http_request_queue_seconds', g.queued)
+
+@app.after_request
+def record_request(response):
+    start = g.pop('request_start', None)
+    if start is not None:
+        elapsed = time.perf_counter() - start
+        endpoint = request.endpoint or 'unmatched'
+        metrics.inc('http_requests_total', endpoint=endpoint, method=request.method, status=response.status_code)
+        metrics.observe('http_request_duration_seconds', elapsed, endpoint=endpoint)
+        if SLOW_REQUEST_MS and elapsed * 1000 >= SLOW_REQUEST_MS:
+            app.logger.warning('Slow request: %s %s -> %s in %.1f ms', request.method, request.full_path,
+                               response.status_code, elapsed * 1000)
+        metrics.flush()
+    return response
+
+@app.route('/metrics')
+def metrics_endpoint():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+# ====== Admission Control ======
+def rate_limit_buckets():
+    # (bucket name, rate, cost) pairs charged for this license API request.
+    return license_buckets(request.get_json(force=True, silent=True), request.remote_addr,
+                           batch=request.endpoint == 'api_check_license_batch',
+                           key=(request.view_args or {}).get('key'))
+
+def license_buckets(data, remote_addr, batch=False, key=None):
+    # The same for a request with JSON body `data`, outside Flask too
+    # (async_server.py).
+    if batch:
+        items = data.get('items') if isinstance(data, dict) else data
+        return [('client:' + (remote_addr or ''), RATE_LIMIT_CLIENT, len(items) if isinstance(items, list) else 1)]
+    data = data if isinstance(data, dict) else {}
+    key = data.get('key') or key
+    device_id = data.get('device_id')
+    buckets = []
+    if isinstance(key, str) and key:
+        buckets.append(('key:' + key, RATE_LIMIT_KEY, 1))
+    if isinstance(device_id, str) and device_id:
+        buckets.append(('device:' + device_id, RATE_LIMIT_DEVICE, 1))
+    return buckets or [('client:' + (remote_addr or ''), RATE_LIMIT_CLIENT, 1)]
+
+def api_error(message, code, retry_after, reason):
+    metrics.inc('api_rejected_total', reason=reason, endpoint=request.endpoint or 'unmatched')
+    response = jsonify({'error': message, 'retry_after': retry_after})
+    response.status_code = code
+    response.headers['Retry-After'] = str(retry_after)
+    return response
+
+@app.before_request
+def admit_api_request():
+    if not request.path.startswith('/api/license/'):
+        return None
+    if API_MAX_QUEUE_MS and g.get('queued', 0) * 1000 > API_MAX_QUEUE_MS:
+        return api_error('Server overloaded', 503, 1, 'queue')
+    for name, rate, cost in rate_limit_buckets():
+        if rate:
+            wait = limiter.take(name, rate, cost)
+            if wait:
+                return api_error('Rate limit exceeded', 429, math.ceil(wait), 'rate_limit')
+    if not limiter.enter(API_CONCURRENCY_MAX):
+        return api_error('Server overloaded', 503, 1, 'concurrency')
+    g.api_in_flight = True
+    return None
+
+@app.teardown_request
+def release_api_request(exc):
+    if g.pop('api_in_flight', False):
+        limiter.leave()
+
+def set_worker_counts(workers, threads):
+    # Derives API_CONCURRENCY_MAX from the number of request threads across
+    # all workers, reserving a quarter (at least one) for the admin pages.
+    # gunicorn.conf.py calls this after each fork with gunicorn's real
+    # settings; until then WEB_CONCURRENCY x WEB_THREADS stands in.
+    global API_CONCURRENCY_MAX
+    if API_CONCURRENCY_MAX_ENV is not None:
+        API_CONCURRENCY_MAX = int(API_CONCURRENCY_MAX_ENV)
+        return
+    slots = workers * threads
+    reserved = int(API_RESERVED_THREADS_ENV) if API_RESERVED_THREADS_ENV is not None else max(1, slots // 4)
+    API_CONCURRENCY_MAX = max(slots - reserved, 0)
+
+set_worker_counts(int(os.environ.get('WEB_CONCURRENCY', 1)), int(os.environ.get('WEB_THREADS', 8)))
+
+# ====== Replica ======
+# POST endpoints a replica still serves: checks only read (claims are
+# forwarded, see claim_unassigned).
+REPLICA_POST_ENDPOINTS = {'api_check_license', 'api_check_license_batch', 'api_license_token'}
+
+@app.before_request
+def replica_read_only():
+    if not REPLICA_OF or request.method != 'POST' or request.endpoint in REPLICA_POST_ENDPOINTS:
+        return None
+    if request.path.startswith('/api/'):
+        return jsonify({'error': 'Read-only replica', 'primary': REPLICA_OF}), 403
+    flash(f'This is a read-only replica; make changes on {REPLICA_OF}', 'danger')
+    return redirect(request.referrer or url_for('dashboard'))
+
+# ====== Utility Functions ======
+class FragmentCache:
+    # Small LRU of rendered HTML fragments. Keys include the store's data
+    # generation, so any write makes the old entries unreachable.
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_render(self, key, render):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+        html = render()
+        with self._lock:
+            self._entries[key] = html
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return html
+
+fragment_cache = FragmentCache()
+
+class Clock:
+    # The app's one source of "now"; tests move time by replacing `now`.
+    # Today's date is worked out once per local day (until the next
+    # midnight), so status checks on every row or every license check are
+    # a float compare plus integer compares on the pre-parsed expiry.
+    def __init__(self, now=time.time):
+        self.now = now
+        self._day = (None, 0, 0.0, 0.0)  # (date, ordinal, start, end) in local time
+
+    def _today(self):
+        t = self.now()
+        day = self._day
+        if not day[2] <= t < day[3]:
+            d = date.fromtimestamp(t)
+            day = self._day = (d, d.toordinal(), self.day_start(d.toordinal()), self.day_start(d.toordinal() + 1))
+        return day
+
+    def time(self):
+        return self.now()
+
+    def today(self):
+        return self._today()[0]
+
+    def today_ord(self):
+        return self._today()[1]
+
+    def today_iso(self):
+        return self._today()[0].isoformat()
+
+    @staticmethod
+    def day_start(ordinal):
+        # Unix time of local midnight starting day `ordinal`.
+        return time.mktime(date.fromordinal(ordinal).timetuple())
+
+clock = Clock()
+
+expiry_sweeper = expiry.ExpirySweeper(store, DATA_DIR, clock, EXPIRY_SWEEP_SECONDS or 3600)
+
+def start_background_threads():
+    # Not at import: under gunicorn --preload the import runs in the master,
+    # and a worker forked while one of these threads held a store lock
+    # would inherit it held and hang on its first write. gunicorn.conf.py
+    # calls this after each worker forks; other servers start them on the
+    # first request.
+    if follower:
+        follower.start()
+    elif EXPIRY_SWEEP_SECONDS:
+        expiry_sweeper.start()
+
+def status_of(lic):
+    return storage.license_status(lic, clock.today_ord())
+
+def days_left(lic):
+    return lic.expiry_ord - clock.today_ord()
+
+def history_page_args():
+    # (offset, limit) from the query string, clamped.
+    offset = max(request.args.get('offset', 0, type=int), 0)
+    limit = min(max(request.args.get('limit', 50, type=int), 1), HISTORY_PAGE_MAX)
+    return offset, limit
+
+def valid_date(value):
+    try:
+        datetime.strptime(value, "%Y-%m-%d")
+        return True
+    except (TypeError, ValueError):
+        return False
+
+def generate_keys(n):
+    # Fresh keys checked against the store's key index (and each other)
+    # instead of trusting a truncated uuid4 to be unique.
+    keys = set()
+    while len(keys) < n:
+        candidates = {str(uuid.uuid4()).replace('-', '').upper()[:20] for _ in range(n - len(keys))} - keys
+        keys |= candidates - set(store.get_licenses(candidates))
+    return list(keys)
+
+def new_license(key, device_id, version, expiry):
+    today = clock.today_iso()
+    return {
+        "key": key,
+        "device_id": device_id,
+        "version": version,
+        "expiry": expiry,
+        "active": True,
+        "created": today,
+        "history": [{"event": "Created", "date": today}]
+    }
+
+def create_license(device_id, version, expiry):
+    key, = generate_keys(1)
+    store.add_license(new_license(key, device_id, version, expiry))
+    return key
+
+# ========== DASHBOARD ==========
+@app.route('/')
+def dashboard():
+    tools = store.tools()
+    today = clock.today()
+    counts = store.status_counts(today)
+    active, expired, disabled = counts['Active'], counts['Expired'], counts['Disabled']
+    total = active + expired + disabled
+    tool_total = len(tools)
+    if expiry_sweeper.current():
+        soon_expiry = expiry_sweeper.licenses(7)
+    else:
+        # No recent sweep (sweeper off, replica, first start): ask the index.
+        soon_expiry = store.expiring(today + timedelta(days=1), today + timedelta(days=7))
+    # Hourly aggregates from usage.db; no raw check events are kept.
+    now = clock.time()
+    hourly = usage_tracker.hourly(now)
+    return render_template(
+        TEMPLATES['dashboard.html'], total=total, active=active, expired=expired, disabled=disabled,
+        tool_labels=[f"{t['name']} v{t['version']}" for t in tools], tool_counts=[1] * tool_total,
+        soon_expiry=soon_expiry,
+        usage_labels=[datetime.fromtimestamp(h['hour'] * 3600).strftime('%a %H:00') for h in hourly],
+        usage_devices=[h['devices'] for h in hourly], usage_checks=[h['checks'] for h in hourly],
+        daily_devices=usage_tracker.daily_devices(now=now), seen_day=usage_tracker.seen_since(now - 86400),
+        seen_week=usage_tracker.seen_since(now - 7 * 86400), usage_versions=usage_tracker.versions(now)[:10])
+
+# ========== LICENSE MANAGEMENT ==========
+@app.route('/licenses', methods=['GET', 'POST'])
+def license_admin():
+    # Generate License
+    if request.method == "POST" and "generate" in request.form:
+        device_id = request.form['device_id']
+        version = request.form['version']
+        expiry = request.form['expiry']
+        if not valid_date(expiry):
+            flash('Invalid expiry date', 'danger')
+            return redirect(url_for('license_admin'))
+        key = create_license(device_id, version, expiry)
+        flash(f'License {key} created', 'success')
+        return redirect(url_for('license_admin'))
+    if request.method == "POST" and "bulk" in request.form:
+        keys = request.form.get('keys', '').replace(',', ' ').split()
+        selection, error = bulk_selection(keys, request.form)
+        if error:
+            flash(error, 'danger')
+        elif request.form['bulk'] == 'Revoke':
+            count = bulk_revoke(selection, "Revoked (bulk)")
+            flash(f'{count} licenses revoked', 'info')
+        elif valid_date(request.form.get('new_expiry')):
+            count = bulk_extend(selection, request.form['new_expiry'], "Extended to {} (bulk)")
+            flash(f'{count} licenses extended', 'success')
+        else:
+            flash('Pick the new expiry date', 'danger')
+        return redirect(url_for('license_admin'))
+    # Search/filter
+    q = request.args.get('q', '').lower()
+    status_filter = request.args.get('status', '')
+    # Keyset pagination: after/before hold the last/first key of the
+    # neighbouring page.
+    after = request.args.get('after') or None
+    before = request.args.get('before') or None
+    today = clock.today()
+    cache_key = ('licenses', store.generation('licenses'), today, q, status_filter, after, before)
+    table = fragment_cache.get_or_render(cache_key, lambda: render_license_table(q, status_filter, after, before))
+    return render_template(TEMPLATES['licenses.html'], q=q, status_filter=status_filter, table=Markup(table))
+
+def render_license_table(q, status_filter, after, before):
+    per_page = 15
+    page, has_prev, has_next = store.search_licenses(
+        q, status_filter.capitalize(), clock.today(), after=after, before=before, limit=per_page)
+    rows = [(lic, status_of(lic), days_left(lic)) for lic in page]
+    return render_template(TEMPLATES['license_table.html'], rows=rows, q=q, status_filter=status_filter,
+                           has_prev=has_prev, has_next=has_next)
+
+def bulk_selection(keys, filters):
+    # Validated argument for store.update_licenses from a key list and/or
+    # filter fields: (selection, error message).
+    selection = {}
+    if keys:
+        if not isinstance(keys, list) or not all(isinstance(k, str) for k in keys):
+            return None, 'keys must be a list of strings'
+        selection['keys'] = keys
+    if filters is not None and not hasattr(filters, 'get'):
+        return None, 'filter must be an object'
+    for name in storage.BULK_FILTERS:
+        value = filters.get(name) if filters is not None else None
+        if value is None or value == '':
+            continue
+        if not isinstance(value, str):
+            return None, f'{name} must be a string'
+        selection[name] = value
+    if 'status' in selection:
+        selection['status'] = selection['status'].capitalize()
+        if selection['status'] not in ('Active', 'Expired', 'Disabled'):
+            return None, 'status must be Active, Expired or Disabled'
+    for name in ('expiry_from', 'expiry_to'):
+        if name in selection and not valid_date(selection[name]):
+            return None, f'Invalid {name} date'
+    if not selection:
+        return None, 'Give a list of keys or at least one filter'
+    return selection, None
+
+def bulk_revoke(selection, event):
+    today = clock.today()
+    count = store.update_licenses(selection, {'active': False}, {"event": event, "date": today.isoformat()}, today)
+    revocation_list.refresh()
+    return count
+
+def bulk_extend(selection, new_expiry, event):
+    today = clock.today()
+    return store.update_licenses(selection, {'expiry': new_expiry},
+                                 {"event": event.format(new_expiry), "date": today.isoformat()}, today)
+
+@app.route('/licenses/revoke/<key>', methods=['POST'])
+def license_revoke(key):
+    store.update_license(key, {'active': False}, {"event":"Revoked","date":clock.today_iso()})
+    revocation_list.refresh()
+    flash('License revoked', 'info')
+    return redirect(url_for('license_admin'))
+
+@app.route('/licenses/extend/<key>', methods=['POST'])
+def license_extend(key):
+    new_expiry = request.form.get('expiry')
+    if not valid_date(new_expiry):
+        flash('Invalid expiry date', 'danger')
+        return redirect(url_for('license_admin'))
+    store.update_license(key, {'expiry': new_expiry}, {"event":f"Extended to {new_expiry}","date":clock.today_iso()})
+    flash('License extended', 'success')
+    return redirect(url_for('license_admin'))
+
+@app.route('/licenses/<key>/history')
+def license_history_view(key):
+    lic = store.get_license(key)
+    if not lic:
+        flash('License not found', 'danger')
+        return redirect(url_for('license_admin'))
+    offset, limit = history_page_args()
+    events, total = store.license_history(key, offset, limit)
+    seen = usage_tracker.license_usage(key)
+    last_seen = datetime.fromtimestamp(seen[0]).strftime('%Y-%m-%d %H:%M') if seen else None
+    return render_template(TEMPLATES['license_history.html'], lic=lic, status=status_of(lic),
+                           events=events, total=total, offset=offset, limit=limit,
+                           last_seen=last_seen, checks=seen[1] if seen else 0)
+
+# ========== LICENSE API ==========
+def claim_unassigned(lic, device_id):
+    # Licenses generated without a device bind to the first device that
+    # checks them.
+    if lic and lic.device_id == '' and device_id and lic.active:
+        if follower:
+            return follower.claim(lic, device_id)
+        # Only binds if nobody else has in the meantime; the check then
+        # goes by whatever the store holds.
+        lic = store.claim_license(lic.key, device_id,
+                                  {"event": f"Bound to {device_id}", "date": clock.today_iso()}) or lic
+    return lic
+
+def check_license(lic, device_id, version):
+    # Shared by the single and batch check endpoints: (body, http status).
+    result, code = _check_license(lic, device_id, version)
+    metrics.inc('license_checks_total', outcome=result['status'])
+    if lic:
+        usage_tracker.record(lic.key, device_id, version, clock.time())
+    return result, code
+
+def _check_license(lic, device_id, version):
+    if not lic:
+        return {'status': 'not_found'}, 404
+    if not lic.active:
+        return {'status': 'revoked'}, 403
+    if lic.device_id != device_id:
+        return {'status': 'device_mismatch'}, 403
+    if lic.version != version:
+        return {'status': 'version_mismatch'}, 426
+    # A license runs out at the start of its expiry day; days_left counts
+    # whole days remaining.
+    today = clock.today_ord()
+    if lic.expiry_ord <= today:
+        return {'status': 'expired'}, 403
+    return {'status': 'valid', 'days_left': lic.expiry_ord - today - 1, 'expiry': lic.expiry}, 200
+
+@app.route('/api/license/generate', methods=['POST'])
+def api_generate_license():
+    data = request.get_json(force=True)
+    device_id = data.get('device_id')
+    version = data.get('version')
+    expiry = data.get('expiry')
+    if not (device_id and version and expiry):
+        return jsonify({'error': 'Missing fields'}), 400
+    if not valid_date(expiry):
+        return jsonify({'error': 'Invalid expiry date'}), 400
+    key = create_license(device_id, version, expiry)
+    return jsonify({'key': key})
+
+@app.route('/api/license/generate-bulk', methods=['POST'])
+def api_generate_licenses_bulk():
+    # Either one license per entry of device_ids, or `count` unassigned
+    # licenses (empty device_id, bound by their first check).
+    data = request.get_json(force=True)
+    version = data.get('version')
+    expiry = data.get('expiry')
+    device_ids = data.get('device_ids')
+    if device_ids is None:
+        count = data.get('count')
+        if not isinstance(count, int) or count < 1:
+            return jsonify({'error': 'Provide device_ids or a positive count'}), 400
+        device_ids = [''] * count
+    elif not (isinstance(device_ids, list) and device_ids and all(isinstance(d, str) and d for d in device_ids)):
+        return jsonify({'error': 'device_ids must be a list of non-empty strings'}), 400
+    if not (version and expiry):
+        return jsonify({'error': 'Missing fields'}), 400
+    if not valid_date(expiry):
+        return jsonify({'error': 'Invalid expiry date'}), 400
+    if len(device_ids) > GENERATE_BULK_MAX:
+        return jsonify({'error': f'Too many licenses (max {GENERATE_BULK_MAX})'}), 413
+    licenses = [new_license(key, device_id, version, expiry)
+                for key, device_id in zip(generate_keys(len(device_ids)), device_ids)]
+    store.add_licenses(licenses)
+
+    def stream():
+        for lic in licenses:
+            yield json.dumps({'key': lic['key'], 'device_id': lic['device_id']}) + '\n'
+    return Response(stream(), mimetype='application/x-ndjson')
+
+@app.route('/api/license/check', methods=['POST'])
+def api_check_license():
+    data = request.get_json(force=True)
+    lic = claim_unassigned(store.get_license(data.get('key')), data.get('device_id'))
+    result, code = check_license(lic, data.get('device_id'), data.get('version'))
+    return jsonify(result), code
+
+@app.route('/api/license/check-batch', methods=['POST'])
+def api_check_license_batch():
+    data = request.get_json(force=True)
+    items = data.get('items') if isinstance(data, dict) else data
+    if not isinstance(items, list) or not all(isinstance(i, dict) for i in items):
+        return jsonify({'error': 'Expected a list of {key, device_id, version}'}), 400
+    if len(items) > CHECK_BATCH_MAX:
+        return jsonify({'error': f'Batch too large (max {CHECK_BATCH_MAX})'}), 413
+    licenses = store.get_licenses([i.get('key') for i in items])
+
+    def results():
+        for item in items:
+            lic = licenses.get(item.get('key'))
+            claimed = claim_unassigned(lic, item.get('device_id'))
+            if claimed is not lic:
+                # Later items for the same key must see the binding.
+                licenses[claimed.key] = claimed
+            lic = claimed
+            result, _ = check_license(lic, item.get('device_id'), item.get('version'))
+            yield dict(result, key=item.get('key'))
+
+    if len(items) <= CHECK_BATCH_STREAM_MIN:
+        return jsonify({'results': list(results())})
+
+    def stream():
+        yield '{"results":['
+        for i, result in enumerate(results()):
+            yield (',' if i else '') + json.dumps(result)
+        yield ']}'
+    return Response(stream(), mimetype='application/json')
+
+@app.route('/api/license/token', methods=['POST'])
+def api_license_token():
+    if not TOKEN_SECRET:
+        return jsonify({'error': 'Offline tokens are not enabled on this server'}), 404
+    data = request.get_json(force=True)
+    lic = claim_unassigned(store.get_license(data.get('key')), data.get('device_id'))
+    result, code = check_license(lic, data.get('device_id'), data.get('version'))
+    if result['status'] == 'valid':
+        result['token'], result['token_expires'] = license_token.issue(
+            TOKEN_SECRET, lic.key, lic.device_id, lic.version, lic.expiry, TOKEN_TTL, clock.time(),
+            license_end=int(clock.day_start(lic.expiry_ord)))
+    return jsonify(result), code
+
+@app.route('/api/license/revoked', methods=['GET'])
+def api_revoked_licenses():
+    return jsonify({'keys': revocation_list.keys()})
+
+@app.route('/api/license/revocations', methods=['GET'])
+def api_revocations():
+    return jsonify(revocation_list.since(request.args.get('since', type=int)))
+
+@app.route('/api/license/expiring', methods=['GET'])
+def api_expiring_licenses():
+    # Queued notices for licenses expiring in the next `within` days (at
+    # most the longest notice period); ?pending=1 leaves out sent ones.
+    within = min(max(request.args.get('within', 30, type=int), 0), max(expiry.NOTICE_DAYS))
+    notices = expiry_sweeper.notices(within, unsent_only=request.args.get('pending') == '1')
+    return jsonify({'within': within, 'notices': notices})
+
+@app.route('/api/license/expiring/sent', methods=['POST'])
+def api_expiring_sent():
+    ids = request.get_json(force=True).get('ids')
+    if not isinstance(ids, list) or not all(isinstance(i, int) for i in ids):
+        return jsonify({'error': 'Expected {"ids": [notice id, ...]}'}), 400
+    return jsonify({'marked': expiry_sweeper.mark_sent(ids)})
+
+@app.route('/api/license/revoke', methods=['POST'])
+def api_revoke_license():
+    data = request.get_json(force=True)
+    key = data.get('key')
+    store.update_license(key, {'active': False}, {"event":"Revoked by API","date":clock.today_iso()})
+    revocation_list.refresh()
+    return jsonify({'status': 'revoked'})
+
+@app.route('/api/license/extend', methods=['POST'])
+def api_extend_license():
+    data = request.get_json(force=True)
+    key = data.get('key')
+    new_expiry = data.get('expiry')
+    if not valid_date(new_expiry):
+        return jsonify({'error': 'Invalid expiry date'}), 400
+    store.update_license(key, {'expiry': new_expiry}, {"event":f"Extended by API to {new_expiry}","date":clock.today_iso()})
+    return jsonify({'status': 'extended'})
+
+@app.route('/api/license/revoke-bulk', methods=['POST'])
+def api_revoke_licenses_bulk():
+    data = request.get_json(force=True)
+    if not isinstance(data, dict):
+        return jsonify({'error': 'Expected {"keys": [...]} and/or {"filter": {...}}'}), 400
+    selection, error = bulk_selection(data.get('keys'), data.get('filter'))
+    if error:
+        return jsonify({'error': error}), 400
+    return jsonify({'status': 'revoked', 'count': bulk_revoke(selection, "Revoked by API (bulk)")})
+
+@app.route('/api/license/extend-bulk', methods=['POST'])
+def api_extend_licenses_bulk():
+    data = request.get_json(force=True)
+    if not isinstance(data, dict):
+        return jsonify({'error': 'Expected {"keys": [...]} and/or {"filter": {...}}'}), 400
+    if not valid_date(data.get('expiry')):
+        return jsonify({'error': 'Invalid expiry date'}), 400
+    selection, error = bulk_selection(data.get('keys'), data.get('filter'))
+    if error:
+        return jsonify({'error': error}), 400
+    count = bulk_extend(selection, data['expiry'], "Extended by API to {} (bulk)")
+    return jsonify({'status': 'extended', 'count': count})
+
+@app.route('/api/license/<key>/history', methods=['GET'])
+def api_license_history(key):
+    if not store.get_license(key):
+        return jsonify({'error': 'License not found'}), 404
+    offset, limit = history_page_args()
+    events, total = store.license_history(key, offset, limit)
+    return jsonify({'key': key, 'events': events, 'offset': offset, 'limit': limit, 'total': total})
+
+# ========== CHANGE FEED ==========
+@app.route('/api/changes', methods=['GET'])
+def api_changes():
+    # Long poll: waits up to `wait` seconds for something after `since`.
+    # That holds the worker thread, hence --threads in the procifile. No
+    # `since` means no state yet, so a reset.
+    since = request.args.get('since', -1, type=int)
+    wait = min(max(request.args.get('wait', 0, type=float), 0), CHANGES_WAIT_MAX)
+    limit = min(max(request.args.get('limit', 1000, type=int), 1), CHANGES_LIMIT_MAX)
+    deadline = time.monotonic() + wait
+    while True:
+        changes, seq, reset = store.changes(since, limit)
+        if changes or reset or time.monotonic() >= deadline:
+            break
+        time.sleep(0.2)
+    return jsonify({'changes': changes, 'seq': seq, 'reset': reset, 'more': len(changes) == limit})
+
+@app.route('/api/changes/snapshot', methods=['GET'])
+def api_changes_snapshot():
+    # Everything as of one change, for replicas starting over: a {"seq"}
+    # line, then the tools and every license in /api/changes' format.
+    seq, licenses, tools = store.state()
+
+    def stream():
+        yield json.dumps({'seq': seq}) + '\n'
+        yield json.dumps({'type': 'tools', 'tools': tools}) + '\n'
+        for lic in licenses:
+            yield json.dumps({'type': 'license', 'license': lic.to_dict()}) + '\n'
+    return Response(stream(), mimetype='application/x-ndjson')
+
+# ========== EXPORT / IMPORT ==========
+@app.route('/api/export', methods=['GET'])
+def api_export():
+    # NDJSON, see backup.py. ?history=1 adds every license's events.
+    history = request.args.get('history') == '1'
+    filename = f"licenses-{clock.today_iso()}.ndjson"
+    return Response(backup.export_lines(store, history=history, now=clock.time()), mimetype='application/x-ndjson',
+                    headers={'Content-Disposition': f'attachment; filename="{filename}"'})
+
+@app.route('/api/import', methods=['POST'])
+def api_import():
+    # Reads the body line by line as it arrives; commits every 10k records.
+    stats = backup.import_lines(store, request.stream)
+    revocation_list.refresh()
+    return jsonify(stats), 200 if not stats['skipped'] else 207
+
+# ========== TOOL MANAGEMENT ==========
+@app.route('/tools', methods=['GET', 'POST'])
+def tools_admin():
+    if request.method == "POST":
+        if "add_tool" in request.form:
+            name = request.form["name"].strip()
+            version = request.form["version"].strip()
+            url = request.form["download_url"].strip()
+            update_required = bool(request.form.get("update_required"))
+            try:
+                artifact = save_artifact()
+            except artifacts.TooLarge:
+                flash(f"File is larger than {ARTIFACT_MAX_BYTES} bytes", "danger")
+                return redirect(url_for('tools_admin'))
+            if not url and not artifact:
+                flash("Give a download URL or upload the file", "danger")
+                return redirect(url_for('tools_admin'))
+            added = store.add_tool({
+                "name": name,
+                "version": version,
+                "download_url": url,
+                "update_required": update_required,
+                **(artifact or {})
+            })
+            if added:
+                flash("Tool added", "success")
+            else:
+                flash("Tool already exists", "danger")
+            prune_artifacts()
+            return redirect(url_for('tools_admin'))
+
+        elif "edit_tool" in request.form:
+            old_name = request.form["original_name"]
+            changes = {
+                "name": request.form["name"].strip(),
+                "version": request.form["version"].strip(),
+                "download_url": request.form["download_url"].strip(),
+                "update_required": bool(request.form.get("update_required"))
+            }
+            try:
+                artifact = save_artifact()
+            except artifacts.TooLarge:
+                flash(f"File is larger than {ARTIFACT_MAX_BYTES} bytes", "danger")
+                return redirect(url_for('tools_admin'))
+            current = store.get_tool(old_name)
+            if artifact:
+                changes.update(artifact)
+            elif current and current.get("sha256") and changes["download_url"] != current["download_url"]:
+                # Pointed somewhere else: the hosted file no longer describes it.
+                changes.update(dict.fromkeys(storage.ARTIFACT_FIELDS))
+            updated = store.update_tool(old_name, changes)
+            if updated:
+                flash("Tool updated", "success")
+            prune_artifacts()
+            return redirect(url_for('tools_admin'))
+
+        elif "delete_tool" in request.form:
+            del_name = request.form["delete_tool"]
+            store.delete_tool(del_name)
+            flash("Tool deleted", "info")
+            prune_artifacts()
+            return redirect(url_for('tools_admin'))
+
+    # Filter/search
+    filter_val = request.args.get("filter", "").strip().lower()
+    page = request.args.get("page", 1, type=int)
+    cache_key = ('tools', store.generation('tools'), filter_val, page)
+    table = fragment_cache.get_or_render(cache_key, lambda: render_tool_table(filter_val, page))
+    return render_template(TEMPLATES['tools.html'], filter_val=filter_val, table=Markup(table))
+
+def save_artifact():
+    # Stores the uploaded "artifact" file, if any; returns the tool fields
+    # pointing at it.
+    upload = request.files.get("artifact")
+    if not upload or not upload.filename:
+        return None
+    sha256, size = artifact_store.save(upload.stream)
+    filename = secure_filename(upload.filename) or sha256
+    path = url_for('download_artifact', sha256=sha256, filename=filename)
+    return {
+        "download_url": (ARTIFACT_BASE_URL or request.host_url.rstrip('/')) + path,
+        "sha256": sha256,
+        "size": size,
+        "filename": filename,
+    }
+
+def prune_artifacts():
+    artifact_store.prune({tool["sha256"] for tool in store.tools() if tool.get("sha256")})
+
+@app.route('/downloads/<sha256>/<path:filename>')
+def download_artifact(sha256, filename):
+    # The URL names the content, so the hash is a strong ETag and the
+    # response never goes stale. send_file handles Range, If-Range and
+    # If-None-Match, and hands the file to the server's wsgi.file_wrapper
+    # (sendfile(2) under gunicorn) instead of reading it into Python.
+    path = artifact_store.path(sha256)
+    if path is None:
+        abort(404)
+    resp = send_file(path, mimetype='application/octet-stream', as_attachment=True, download_name=filename,
+                     conditional=True, etag=sha256, max_age=ARTIFACT_CACHE_SECONDS)
+    resp.cache_control.public = True
+    resp.cache_control.immutable = True
+    return resp
+
+def render_tool_table(filter_val, page):
+    filtered_tools = store.search_tools(filter_val)
+
+    # Pagination
+    per_page = 10
+    total_pages = max(1, (len(filtered_tools) + per_page - 1) // per_page)
+    page = min(max(page, 1), total_pages)
+    paginated_tools = filtered_tools[(page-1)*per_page : page*per_page]
+    # Prev/next, the first and last page, and two pages either side of this one.
+    window = range(max(1, page - 2), min(total_pages, page + 2) + 1)
+    return render_template(TEMPLATES['tool_table.html'], tools=paginated_tools, filter_val=filter_val,
+                           page=page, total_pages=total_pages, window=window)
+
+# ========== TOOL API ==========
+class CachedBody:
+    # A serialized JSON body with its strong ETag (a content hash, so every
+    # worker agrees on it) and a lazily gzipped copy.
+    def __init__(self, obj):
+        # Compact, like jsonify() outside debug mode and async_server._json.
+        self.body = (app.json.dumps(obj, separators=(',', ':')) + '\n').encode()
+        self.etag = hashlib.sha256(self.body).hexdigest()[:32]
+        self._gzipped = None
+
+    @property
+    def gzipped(self):
+        if self._gzipped is None:
+            self._gzipped = gzip.compress(self.body, mtime=0)
+        return self._gzipped
+
+    def response(self):
+        use_gzip = TOOLS_GZIP and 'gzip' in request.headers.get('Accept-Encoding', '')
+        # The gzipped bytes are a different representation, so a different strong ETag.
+        etag = self.etag + '-gz' if use_gzip else self.etag
+        if request.if_none_match.contains_weak(etag):
+            resp = Response(status=304)
+        else:
+            resp = Response(self.gzipped if use_gzip else self.body, mimetype='application/json')
+            if use_gzip:
+                resp.headers['Content-Encoding'] = 'gzip'
+        resp.set_etag(etag)
+        resp.headers['Cache-Control'] = f'public, max-age={TOOLS_MAX_AGE}'
+        resp.headers['Vary'] = 'Accept-Encoding'
+        return resp
+
+class ToolCatalog:
+    # /api/tools and per-tool bodies, serialized once per tools generation,
+    # plus a lower-cased name -> body dict for /api/tool/<name>.
+    def __init__(self):
+        self._generation = None
+        self._lock = threading.Lock()
+        self.catalog = None
+        self.by_name = {}
+
+    def current(self):
+        generation = store.generation('tools')
+        if generation != self._generation:
+            with self._lock:
+                if generation != self._generation:
+                    tools = store.tools()
+                    by_name = {}
+                    for tool in tools:
+                        # First match wins, as with the old linear scan.
+                        by_name.setdefault(tool['name'].lower(), CachedBody(tool))
+                    self.catalog, self.by_name = CachedBody({'tools': tools}), by_name
+                    self._generation = generation
+        return self
+
+tool_catalog = ToolCatalog()
+
+@app.route('/api/tools', methods=['GET'])
+def api_get_tools():
+    return tool_catalog.current().catalog.response()
+
+@app.route('/api/tool/<name>', methods=['GET'])
+def api_get_tool_by_name(name):
+    body = tool_catalog.current().by_name.get(name.lower())
+    if body:
+        return body.response()
+    return jsonify({'error': 'Tool not found'}), 404
+
+# ========== API DOCS ==========
+@app.route('/docs')
+def docs():
+    return render_template(TEMPLATES['docs.html'])
 
 # ========== MAIN ==========
 if __name__ == "__main__":
+    start_background_threads()
     app.run(host="0.0.0.0", port=int(os.environ.get("PORT", 5000)), debug=True)
@@ -0,0 +1,70 @@
+# Tool artifacts hosted by this server, under DATA_DIR/artifacts.
+#
+# Files are stored by content: the name is the SHA-256 of the bytes,
+# computed once while the upload streams in. Download URLs contain it, so
+# a URL's content never changes: the hash doubles as a strong ETag and the
+# responses can be cached for good. Uploading the same file twice stores
+# it once.
+import os
+import time
+import hashlib
+import tempfile
+
+CHUNK = 1024 * 1024
+
+
+class TooLarge(Exception):
+    pass
+
+
+class ArtifactStore:
+    def __init__(self, root, max_bytes=None):
+        self.root = root
+        self.max_bytes = max_bytes
+        os.makedirs(root, exist_ok=True)
+
+    def path(self, sha256):
+        # None unless `sha256` names a stored artifact.
+        if len(sha256) != 64 or not all(c in '0123456789abcdef' for c in sha256):
+            return None
+        path = os.path.join(self.root, sha256)
+        return path if os.path.isfile(path) else None
+
+    def save(self, stream):
+        # Copies the file-like `stream` in; returns (sha256, size).
+        digest, size = hashlib.sha256(), 0
+        fd, tmp = tempfile.mkstemp(dir=self.root, prefix='.upload-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                while True:
+                    chunk = stream.read(CHUNK)
+                    if not chunk:
+                        break
+                    size += len(chunk)
+                    if self.max_bytes and size > self.max_bytes:
+                        raise TooLarge(size)
+                    digest.update(chunk)
+                    f.write(chunk)
+                f.flush()
+                os.fsync(f.fileno())
+            sha256 = digest.hexdigest()
+            os.replace(tmp, os.path.join(self.root, sha256))
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        return sha256, size
+
+    def prune(self, keep, min_age=3600):
+        # Removes artifacts not in `keep` (hashes still referenced by a
+        # tool). Young files are left alone: one may belong to an upload
+        # whose tool hasn't been saved yet.
+        cutoff = time.time() - min_age
+        removed = 0
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            if name in keep or os.path.getmtime(path) > cutoff:
+                continue
+            os.remove(path)
+            removed += 1
+        return removed
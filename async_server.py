@@ -0,0 +1,219 @@
+# Asyncio HTTP server for the hot read-only endpoints:
+#
+#   POST /api/license/check, GET /api/tools, GET /api/tool/<name>
+#
+# Same JSON, status codes, rate limits, metrics and data as the Flask app:
+# it imports app.py for the store, check_license and the tool catalog, so
+# the only thing missing is the WSGI stack. One process holds thousands of
+# keep-alive connections instead of one per sync gunicorn worker. Put it
+# next to gunicorn and route those three paths here (see the procifile):
+#
+#   python async_server.py [--host 0.0.0.0] [--port 8001]
+#
+# The listening socket uses SO_REUSEPORT, so several copies can share a
+# port. Anything that can block goes to the loop's thread pool: a check
+# takes fcntl locks on the rate-limit file, may refresh the store (a flock
+# on the JSON journal, a query on SQLite) and may bind a license, and the
+# tool catalog checks the store for changes. Only parsing and writing
+# responses run on the event loop, so a slow disk never stalls the other
+# connections.
+import os
+import sys
+import json
+import math
+import time
+import asyncio
+import argparse
+import logging
+from email.utils import formatdate
+from http import HTTPStatus
+from urllib.parse import unquote
+
+import app as core
+from metrics import REGISTRY as metrics
+
+log = logging.getLogger('async_server')
+
+MAX_HEADER_BYTES = 16 * 1024
+MAX_BODY_BYTES = 64 * 1024
+KEEPALIVE_SECONDS = 75
+
+
+def _json(obj):
+    # Byte for byte what jsonify() sends.
+    return (json.dumps(obj, sort_keys=True, separators=(',', ':')) + '\n').encode()
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        self.status = status
+        self.message = message
+
+
+class Server:
+    def __init__(self):
+        self.connections = 0
+        self._date = (0, '')
+
+    def date(self):
+        now = int(time.time())
+        if self._date[0] != now:
+            self._date = (now, formatdate(now, usegmt=True))
+        return self._date[1]
+
+    async def handle(self, reader, writer):
+        self.connections += 1
+        peer = writer.get_extra_info('peername')
+        remote = peer[0] if peer else ''
+        try:
+            while True:
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), KEEPALIVE_SECONDS)
+                except asyncio.LimitOverrunError:
+                    await self.send(writer, 431, _json({'error': 'Request headers too large'}), close=True)
+                    return
+                except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+                    return
+                try:
+                    method, target, version, headers = self.parse(head)
+                    length = int(headers.get('content-length') or 0)
+                    if length < 0:
+                        raise ValueError('negative Content-Length')
+                    if 'chunked' in headers.get('transfer-encoding', ''):
+                        raise HTTPError(411, 'Content-Length required')
+                    if length > MAX_BODY_BYTES:
+                        raise HTTPError(413, 'Request body too large')
+                except ValueError:
+                    await self.send(writer, 400, _json({'error': 'Bad request'}), close=True)
+                    return
+                except HTTPError as e:
+                    await self.send(writer, e.status, _json({'error': e.message}), close=True)
+                    return
+                body = await reader.readexactly(length) if length else b''
+                connection = headers.get('connection', '').lower()
+                close = connection == 'close' or (version == 'HTTP/1.0' and connection != 'keep-alive')
+                start = time.perf_counter()
+                endpoint, status, payload, extra = await self.dispatch(method, target, headers, body, remote)
+                await self.send(writer, status, payload, extra, close=close, head_only=method == 'HEAD')
+                metrics.inc('http_requests_total', endpoint=endpoint, method=method, status=status)
+                metrics.observe('http_request_duration_seconds', time.perf_counter() - start, endpoint=endpoint)
+                metrics.flush()
+                if close:
+                    return
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self.connections -= 1
+            writer.close()
+
+    @staticmethod
+    def parse(head):
+        lines = head.decode('latin-1').split('\r\n')
+        method, target, version = lines[0].split(' ')
+        headers = {}
+        for line in lines[1:]:
+            if line:
+                name, _, value = line.partition(':')
+                headers[name.strip().lower()] = value.strip()
+        return method, target, version, headers
+
+    async def send(self, writer, status, payload, extra=(), close=False, head_only=False):
+        lines = ['HTTP/1.1 %d %s' % (status, HTTPStatus(status).phrase), 'Date: ' + self.date(),
+                 'Content-Length: %d' % len(payload)]
+        if payload and not any(name == 'Content-Type' for name, _ in extra):
+            lines.append('Content-Type: application/json')
+        lines += ['%s: %s' % header for header in extra]
+        lines.append('Connection: close' if close else 'Connection: keep-alive')
+        writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1'))
+        if payload and not head_only:
+            writer.write(payload)
+        await writer.drain()
+
+    # --- endpoints ---
+    async def dispatch(self, method, target, headers, body, remote):
+        # (endpoint name, status, body bytes, extra headers)
+        path = target.partition('?')[0]
+        if path == '/api/license/check':
+            if method != 'POST':
+                return 'api_check_license', 405, _json({'error': 'Method not allowed'}), [('Allow', 'POST')]
+            return ('api_check_license',) + await self.check(body, remote)
+        if path == '/api/tools' or path.startswith('/api/tool/'):
+            endpoint = 'api_get_tools' if path == '/api/tools' else 'api_get_tool_by_name'
+            if method not in ('GET', 'HEAD'):
+                return endpoint, 405, _json({'error': 'Method not allowed'}), [('Allow', 'GET, HEAD')]
+            catalog = await asyncio.get_running_loop().run_in_executor(None, core.tool_catalog.current)
+            if endpoint == 'api_get_tools':
+                cached = catalog.catalog
+            else:
+                cached = catalog.by_name.get(unquote(path[len('/api/tool/'):]).lower())
+                if cached is None:
+                    return endpoint, 404, _json({'error': 'Tool not found'}), []
+            return (endpoint,) + self.cached(cached, headers)
+        return 'unmatched', 404, _json({'error': 'Not found'}), []
+
+    async def check(self, body, remote):
+        try:
+            data = json.loads(body)
+        except ValueError:
+            data = None
+        if not isinstance(data, dict):
+            return 400, _json({'error': 'Expected a JSON object'}), []
+        return await asyncio.get_running_loop().run_in_executor(None, self.check_blocking, data, remote)
+
+    @staticmethod
+    def check_blocking(data, remote):
+        # The rate limit, lookup, claim and check, on a pool thread.
+        for name, rate, cost in core.license_buckets(data, remote):
+            if rate:
+                wait = core.limiter.take(name, rate, cost)
+                if wait:
+                    retry_after = math.ceil(wait)
+                    metrics.inc('api_rejected_total', reason='rate_limit', endpoint='api_check_license')
+                    return 429, _json({'error': 'Rate limit exceeded', 'retry_after': retry_after}), \
+                        [('Retry-After', str(retry_after))]
+        device_id = data.get('device_id')
+        lic = core.claim_unassigned(core.store.get_license(data.get('key')), device_id)
+        result, code = core.check_license(lic, device_id, data.get('version'))
+        return code, _json(result), []
+
+    @staticmethod
+    def cached(cached, headers):
+        # CachedBody.response() without Flask.
+        use_gzip = core.TOOLS_GZIP and 'gzip' in headers.get('accept-encoding', '')
+        etag = cached.etag + '-gz' if use_gzip else cached.etag
+        extra = [('ETag', '"%s"' % etag), ('Cache-Control', 'public, max-age=%d' % core.TOOLS_MAX_AGE),
+                 ('Vary', 'Accept-Encoding')]
+        tags = {t.strip().removeprefix('W/').strip('"') for t in headers.get('if-none-match', '').split(',')}
+        if etag in tags or '*' in tags:
+            return 304, b'', extra
+        if use_gzip:
+            extra.append(('Content-Encoding', 'gzip'))
+            return 200, cached.gzipped, extra
+        return 200, cached.body, extra
+
+
+async def serve(host, port):
+    core.start_background_threads()
+    server = Server()
+    listener = await asyncio.start_server(server.handle, host, port, limit=MAX_HEADER_BYTES, reuse_port=True,
+                                          backlog=4096)
+    log.info('Serving license checks and tools on %s:%d', host, port)
+    async with listener:
+        await listener.serve_forever()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='asyncio server for license checks and the tool catalog')
+    parser.add_argument('--host', default=os.environ.get('ASYNC_HOST', '0.0.0.0'))
+    parser.add_argument('--port', type=int, default=int(os.environ.get('ASYNC_PORT', 8001)))
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(name)s %(message)s')
+    try:
+        asyncio.run(serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,200 @@
+# Streaming NDJSON export/import of licenses, tools and history.
+#
+# One JSON object per line:
+#   {"type": "export", "seq": N, "exported": "<ISO time>", "history": true}
+#   {"type": "tool", "tool": {...}}
+#   {"type": "license", "license": {...}}      (licenses.json shape)
+#   {"type": "event", "key": "...", "event": "...", "date": "YYYY-MM-DD"}
+#
+# Export is a generator over the store, import reads lines as they come
+# and commits every `chunk` records, so neither holds the dataset in
+# memory. Used by GET /api/export, POST /api/import and the CLI:
+#
+#   python backup.py export [--history] [--out FILE]
+#   python backup.py import FILE|-
+#
+# (DATA_DIR and STORAGE_BACKEND as for the app.)
+import os
+import sys
+import json
+import time
+import argparse
+from datetime import date, datetime
+
+import storage
+
+CHUNK = 10000
+MAX_ERRORS = 100
+
+
+def export_lines(store, history=False, now=None):
+    # `now`: unix time to stamp the export with (the app passes its clock's).
+    seq, licenses, tools = store.state()
+    exported = datetime.fromtimestamp(time.time() if now is None else now).isoformat(timespec='seconds')
+    yield _line({'type': 'export', 'seq': seq, 'exported': exported, 'history': history})
+    for tool in tools:
+        yield _line({'type': 'tool', 'tool': tool})
+    for lic in licenses:
+        yield _line({'type': 'license', 'license': lic.to_dict()})
+    if history:
+        for entry in store.history_entries():
+            yield _line({'type': 'event', 'key': entry['key'], 'event': entry['event'], 'date': entry['date']})
+
+
+def _line(record):
+    return json.dumps(record, separators=(',', ':')) + '\n'
+
+
+def _valid_date(value):
+    try:
+        date.fromisoformat(value)
+        return True
+    except (TypeError, ValueError):
+        return False
+
+
+def validate_license(lic):
+    # Error message, or None if `lic` can be stored.
+    if not isinstance(lic, dict):
+        return 'license must be an object'
+    for field in ('key', 'device_id', 'version'):
+        if not isinstance(lic.get(field), str):
+            return f'license {field} must be a string'
+    if not lic['key']:
+        return 'license key is empty'
+    if not _valid_date(lic.get('expiry')):
+        return 'license expiry must be YYYY-MM-DD'
+    if not isinstance(lic.get('active', True), bool):
+        return 'license active must be true or false'
+    if 'history' in lic:
+        return 'history belongs in "event" lines'
+    return None
+
+
+def validate_tool(tool):
+    if not isinstance(tool, dict):
+        return 'tool must be an object'
+    for field in ('name', 'version', 'download_url'):
+        if not isinstance(tool.get(field), str) or not tool[field]:
+            return f'tool {field} must be a non-empty string'
+    if tool.get('size') is not None and not isinstance(tool['size'], int):
+        return 'tool size must be an integer'
+    return None
+
+
+def validate_event(entry):
+    if not all(isinstance(entry.get(f), str) for f in ('key', 'event', 'date')):
+        return 'event needs key, event and date strings'
+    return None
+
+
+def import_lines(store, lines, chunk=CHUNK):
+    # Upserts what `lines` (an iterable of NDJSON lines, str or bytes)
+    # holds, `chunk` licenses or events per commit. Invalid lines are
+    # skipped and reported. Tools are matched by name.
+    stats = {'licenses': 0, 'tools': 0, 'events': 0, 'skipped': 0, 'errors': [], 'bytes': 0}
+    licenses, events = [], []
+    start = time.perf_counter()
+
+    def skip(lineno, message):
+        stats['skipped'] += 1
+        if len(stats['errors']) < MAX_ERRORS:
+            stats['errors'].append({'line': lineno, 'error': message})
+
+    for lineno, line in enumerate(lines, 1):
+        stats['bytes'] += len(line)
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            skip(lineno, f'invalid JSON: {e}')
+            continue
+        kind = record.get('type') if isinstance(record, dict) else None
+        if kind == 'license':
+            error = validate_license(record.get('license'))
+            if error:
+                skip(lineno, error)
+                continue
+            licenses.append(record['license'])
+            if len(licenses) >= chunk:
+                store.add_licenses(licenses)
+                stats['licenses'] += len(licenses)
+                licenses = []
+        elif kind == 'event':
+            error = validate_event(record)
+            if error:
+                skip(lineno, error)
+                continue
+            events.append({'key': record['key'], 'event': record['event'], 'date': record['date']})
+            if len(events) >= chunk:
+                store.add_history(events)
+                stats['events'] += len(events)
+                events = []
+        elif kind == 'tool':
+            error = validate_tool(record.get('tool'))
+            if error:
+                skip(lineno, error)
+                continue
+            tool = record['tool']
+            tool = {'name': tool['name'], 'version': tool['version'], 'download_url': tool['download_url'],
+                    'update_required': bool(tool.get('update_required')),
+                    **{f: tool.get(f) for f in storage.ARTIFACT_FIELDS}}
+            if not store.add_tool({k: v for k, v in tool.items() if v is not None}):
+                store.update_tool(store.get_tool(tool['name'])['name'], tool)
+            stats['tools'] += 1
+        elif kind != 'export':
+            skip(lineno, 'unknown record type')
+    if licenses:
+        store.add_licenses(licenses)
+        stats['licenses'] += len(licenses)
+    if events:
+        store.add_history(events)
+        stats['events'] += len(events)
+    stats.update(_throughput(stats['licenses'] + stats['tools'] + stats['events'], stats['bytes'],
+                             time.perf_counter() - start))
+    return stats
+
+
+def _throughput(records, size, elapsed):
+    return {
+        'seconds': round(elapsed, 3),
+        'records_per_second': round(records / elapsed) if elapsed else None,
+        'mb_per_second': round(size / elapsed / 1e6, 2) if elapsed else None,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='NDJSON export/import of licenses, tools and history')
+    sub = parser.add_subparsers(dest='command', required=True)
+    exp = sub.add_parser('export')
+    exp.add_argument('--history', action='store_true', help='include license history events')
+    exp.add_argument('--out', help='file to write (default: stdout)')
+    imp = sub.add_parser('import')
+    imp.add_argument('file', help="NDJSON file, or - for stdin")
+    imp.add_argument('--chunk', type=int, default=CHUNK, help='records per commit')
+    args = parser.parse_args(argv)
+
+    store = storage.open_store(os.environ.get('STORAGE_BACKEND', 'json'), os.environ.get('DATA_DIR', 'data'))
+    if args.command == 'export':
+        out = open(args.out, 'w') if args.out else sys.stdout
+        start, lines, size = time.perf_counter(), 0, 0
+        try:
+            for line in export_lines(store, history=args.history):
+                out.write(line)
+                lines += 1
+                size += len(line)
+        finally:
+            if args.out:
+                out.close()
+        report = dict(lines=lines, bytes=size, **_throughput(lines, size, time.perf_counter() - start))
+    else:
+        f = sys.stdin.buffer if args.file == '-' else open(args.file, 'rb')
+        with f:
+            report = import_lines(store, f, args.chunk)
+    print(json.dumps(report), file=sys.stderr)
+    return 1 if report.get('skipped') else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,35 @@
+# Side-by-side view of two bench.run result files.
+#
+#   python -m bench.compare results/before.json results/after.json
+import sys
+import json
+
+
+def change(old, new):
+    if not old or new is None:
+        return ''
+    return '%+.1f%%' % ((new - old) / old * 100)
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if len(argv) != 2:
+        sys.exit('usage: python -m bench.compare <old.json> <new.json>')
+    with open(argv[0]) as f:
+        old = json.load(f)
+    with open(argv[1]) as f:
+        new = json.load(f)
+    print(f"{old['meta'].get('commit')} -> {new['meta'].get('commit')}  "
+          f"({new['meta']['licenses']} licenses, {new['meta']['backend']})")
+    for field in ('startup_seconds', 'rss_after_load_kb', 'peak_rss_kb'):
+        print(f"{field:24s} {old.get(field):>12} {new.get(field):>12} {change(old.get(field), new.get(field)):>9}")
+    print()
+    print(f"{'scenario':24s} {'old rps':>10} {'new rps':>10} {'':>9} {'old p99':>9} {'new p99':>9}")
+    for name, result in new['scenarios'].items():
+        before = old['scenarios'].get(name, {})
+        print(f"{name:24s} {before.get('rps', ''):>10} {result['rps']:>10} {change(before.get('rps'), result['rps']):>9}"
+              f" {before.get('p99_ms', ''):>9} {result['p99_ms']:>9}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+# Synthetic licenses.json / tools.json for benchmarking.
+#
+#   python -m bench.datasets 100k bench-data/100k
+#
+# Same seed, same files: runs on different commits see identical data.
+import os
+import sys
+import json
+import random
+from datetime import date, timedelta
+
+SIZES = {'1k': 1_000, '10k': 10_000, '100k': 100_000, '1m': 1_000_000}
+
+# Dates are laid out around this day, not the real today, so a dataset
+# (and its mix of active and expired licenses) is the same whenever it's
+# generated; bench.run pins the app's clock to it.
+REFERENCE_DATE = date(2025, 1, 15)
+
+VERSIONS = ['1.0', '1.1', '1.2', '2.0', '2.1', '3.0']
+VERSION_WEIGHTS = [2, 3, 5, 10, 20, 30]
+
+
+def parse_size(size):
+    size = str(size).lower()
+    if size in SIZES:
+        return SIZES[size]
+    return int(size)
+
+
+def make_license(rng, today):
+    created = today - timedelta(days=rng.randint(0, 3 * 365))
+    # Mostly yearly terms; a third already ran out, a few expire this month.
+    roll = rng.random()
+    if roll < 0.33:
+        expiry = today - timedelta(days=rng.randint(1, 2 * 365))
+    elif roll < 0.38:
+        expiry = today + timedelta(days=rng.randint(0, 30))
+    else:
+        expiry = today + timedelta(days=rng.randint(31, 3 * 365))
+    active = rng.random() >= 0.05
+    # 2% were sold in bulk and never checked, so they have no device yet.
+    device_id = '' if rng.random() < 0.02 else 'DEV-%08X' % rng.getrandbits(32)
+    history = [{'event': 'Created', 'date': created.isoformat()}]
+    # Long tail of events: most licenses have a few, some have dozens.
+    for _ in range(min(int(rng.paretovariate(1.5)) - 1, 50)):
+        when = created + timedelta(days=rng.randint(0, max(0, (today - created).days)))
+        history.append({'event': f'Extended to {expiry.isoformat()}', 'date': when.isoformat()})
+    if device_id and rng.random() < 0.5:
+        history.append({'event': f'Bound to {device_id}', 'date': created.isoformat()})
+    if not active:
+        history.append({'event': 'Revoked', 'date': today.isoformat()})
+    return {
+        'key': '%020X' % (rng.getrandbits(80)),
+        'device_id': device_id,
+        'version': rng.choices(VERSIONS, VERSION_WEIGHTS)[0],
+        'expiry': expiry.isoformat(),
+        'active': active,
+        'created': created.isoformat(),
+        'history': history,
+    }
+
+
+def make_tool(rng, n):
+    return {
+        'name': f'tool-{n:03d}',
+        'version': '%d.%d.%d' % (rng.randint(0, 5), rng.randint(0, 20), rng.randint(0, 50)),
+        'download_url': f'https://downloads.example.com/tool-{n:03d}.zip',
+        'update_required': rng.random() < 0.1,
+    }
+
+
+def generate(data_dir, licenses, tools=50, seed=0, today=None):
+    # Writes the two snapshot files into data_dir; returns
+    # (key, device_id, version) for every license, for building requests.
+    rng = random.Random(seed)
+    today = today or REFERENCE_DATE
+    os.makedirs(data_dir, exist_ok=True)
+    licenses_out = []
+    with open(os.path.join(data_dir, 'licenses.json'), 'w') as f:
+        # Streamed out so the 1M set doesn't need a second copy in memory.
+        f.write('[')
+        for n in range(licenses):
+            lic = make_license(rng, today)
+            licenses_out.append((lic['key'], lic['device_id'], lic['version']))
+            f.write((',\n' if n else '\n') + json.dumps(lic))
+        f.write('\n]')
+    with open(os.path.join(data_dir, 'tools.json'), 'w') as f:
+        json.dump([make_tool(rng, n) for n in range(tools)], f, indent=2)
+    return licenses_out
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        sys.exit('usage: python -m bench.datasets <size: 1k|100k|1m|N> <data_dir>')
+    n = parse_size(sys.argv[1])
+    generate(sys.argv[2], n)
+    print(f'Wrote {n} licenses to {sys.argv[2]}')
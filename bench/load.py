@@ -0,0 +1,198 @@
+# HTTP load test of /api/license/check and /api/tools over real sockets:
+# gunicorn (the Flask app, sync workers) against async_server.py, on
+# localhost, reading the same generated data.
+#
+#   python -m bench.load --size 100k --connections 200 --seconds 10
+#
+# Each load process keeps `connections / processes` keep-alive connections
+# busy for `seconds` and reports requests per second and latency
+# percentiles. With 1 CPU the load generator shares it with the server, so
+# compare the two servers with each other rather than with production.
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import socket
+import asyncio
+import argparse
+import tempfile
+import subprocess
+import multiprocessing
+from datetime import date
+
+from bench import datasets
+from bench.run import percentile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_for(port, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f'nothing listening on port {port}')
+
+
+def check_request(licenses, rng):
+    key, device_id, version = licenses[rng.randrange(len(licenses))]
+    body = json.dumps({'key': key, 'device_id': device_id, 'version': version}).encode()
+    return (b'POST /api/license/check HTTP/1.1\r\nHost: localhost\r\nContent-Type: application/json\r\n'
+            b'Content-Length: %d\r\n\r\n' % len(body)) + body
+
+
+TOOLS_REQUEST = b'GET /api/tools HTTP/1.1\r\nHost: localhost\r\n\r\n'
+
+
+async def connection(port, make_request, deadline, latencies, errors):
+    reader = writer = None
+    while time.monotonic() < deadline:
+        try:
+            if writer is None:
+                reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            t0 = time.perf_counter()
+            writer.write(make_request())
+            head = await reader.readuntil(b'\r\n\r\n')
+            status = int(head[9:12])
+            length = close = 0
+            for line in head.split(b'\r\n')[1:]:
+                name, _, value = line.partition(b':')
+                name = name.strip().lower()
+                if name == b'content-length':
+                    length = int(value)
+                elif name == b'connection' and value.strip().lower() == b'close':
+                    close = 1
+            await reader.readexactly(length)
+            latencies.append(time.perf_counter() - t0)
+            # 403/404 are check outcomes, not failures.
+            if status >= 500 or status == 429:
+                errors.append(status)
+            if close:
+                writer.close()
+                writer = None
+        except (OSError, asyncio.IncompleteReadError, ValueError):
+            errors.append(0)
+            if writer is not None:
+                writer.close()
+            writer = None
+            await asyncio.sleep(0.01)
+    if writer is not None:
+        writer.close()
+
+
+def load_process(port, scenario, licenses, connections, seconds, seed, queue):
+    rng = random.Random(seed)
+    if scenario == 'check':
+        make_request = lambda: check_request(licenses, rng)
+    else:
+        make_request = lambda: TOOLS_REQUEST
+    latencies, errors = [], []
+
+    async def run():
+        deadline = time.monotonic() + seconds
+        await asyncio.gather(*(connection(port, make_request, deadline, latencies, errors)
+                               for _ in range(connections)))
+    asyncio.run(run())
+    queue.put((latencies, errors))
+
+
+def run_load(port, scenario, licenses, connections, seconds, processes):
+    queue = multiprocessing.Queue()
+    per_process = max(1, connections // processes)
+    workers = [multiprocessing.Process(target=load_process,
+                                       args=(port, scenario, licenses, per_process, seconds, i, queue))
+               for i in range(processes)]
+    start = time.perf_counter()
+    for w in workers:
+        w.start()
+    latencies, errors = [], []
+    for _ in workers:
+        lat, err = queue.get()
+        latencies += lat
+        errors += err
+    for w in workers:
+        w.join()
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        'requests': len(latencies),
+        'errors': len(errors),
+        'rps': round(len(latencies) / elapsed, 1),
+        'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+        'max_ms': round(latencies[-1] * 1000, 3) if latencies else 0.0,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='gunicorn vs async_server load test')
+    parser.add_argument('--size', default='100k', help='1k, 10k, 100k, 1m or a number of licenses')
+    parser.add_argument('--backend', default='json', choices=['json', 'sqlite'])
+    parser.add_argument('--connections', type=int, default=200, help='concurrent keep-alive connections')
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--processes', type=int, default=max(1, (os.cpu_count() or 2) // 2),
+                        help='load generator processes')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='gunicorn workers')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', help='write results JSON here (default: stdout)')
+    args = parser.parse_args(argv)
+
+    size = datasets.parse_size(args.size)
+    data_dir = tempfile.mkdtemp(prefix='license-load-')
+    env = dict(os.environ, DATA_DIR=data_dir, STORAGE_BACKEND=args.backend, LICENSE_SNAPSHOT='1',
+               PYTHONPATH=ROOT, USAGE_FLUSH_SECONDS='5')
+    for name in ('RATE_LIMIT_KEY', 'RATE_LIMIT_DEVICE', 'RATE_LIMIT_CLIENT'):
+        env.setdefault(name, '1000000000/1')
+    # Don't let admission control shed the load we're measuring.
+    env.setdefault('API_CONCURRENCY_MAX', '0')
+    servers = []
+    results = {}
+    try:
+        # Around the real today: the servers run on the real clock.
+        licenses = datasets.generate(data_dir, size, seed=args.seed, today=date.today())
+        flask_port, async_port = free_port(), free_port()
+        servers.append(subprocess.Popen(
+            ['gunicorn', '--preload', '-w', str(args.workers), '-b', f'127.0.0.1:{flask_port}',
+             '--backlog', '4096', '--log-level', 'warning', 'app:app'], cwd=ROOT, env=env))
+        wait_for(flask_port)
+        servers.append(subprocess.Popen(
+            [sys.executable, 'async_server.py', '--host', '127.0.0.1', '--port', str(async_port)], cwd=ROOT, env=env))
+        wait_for(async_port)
+        for scenario in ('check', 'tools'):
+            for server, port in (('gunicorn', flask_port), ('async', async_port)):
+                name = f'{scenario}:{server}'
+                results[name] = run_load(port, scenario, licenses, args.connections, args.seconds, args.processes)
+                print(f"{name:16s} {results[name]['rps']:>10} req/s  p50 {results[name]['p50_ms']} ms  "
+                      f"p99 {results[name]['p99_ms']} ms  errors {results[name]['errors']}", file=sys.stderr)
+    finally:
+        for proc in servers:
+            proc.terminate()
+            proc.wait()
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+    report = {
+        'meta': {'licenses': size, 'backend': args.backend, 'connections': args.connections,
+                 'seconds': args.seconds, 'gunicorn_workers': args.workers, 'load_processes': args.processes},
+        'scenarios': results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
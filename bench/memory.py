@@ -0,0 +1,53 @@
+# Bytes per license held by the JSON backend's in-memory index.
+#
+#   python -m bench.memory [size]      (default 1m)
+#
+# Loads a synthetic licenses.json the way JsonStore does and reports the
+# memory the index keeps alive (tracemalloc), per license, next to the
+# baseline of keeping the parsed dicts by key as the index used to.
+import sys
+import json
+import shutil
+import tempfile
+import tracemalloc
+
+from bench import datasets
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    size = datasets.parse_size(argv[0] if argv else '1m')
+    data_dir = tempfile.mkdtemp(prefix='license-mem-')
+    try:
+        datasets.generate(data_dir, size)
+        # Without history: that lives in its own log, not in the index.
+        import storage
+        store = storage.JsonStore(data_dir)
+        path = store.licenses_file
+        del store
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        baseline = {lic['key']: lic for lic in storage.load_json(path)}
+        dict_bytes = tracemalloc.get_traced_memory()[0] - before
+        del baseline
+        before = tracemalloc.get_traced_memory()[0]
+        index = storage.LicenseIndex()
+        index.load(storage.load_json(path))
+        held = tracemalloc.get_traced_memory()[0] - before
+        tracemalloc.stop()
+        n = max(1, len(index.by_key))
+        report = {
+            'licenses': len(index.by_key),
+            'dict_bytes': dict_bytes,
+            'dict_bytes_per_license': round(dict_bytes / n, 1),
+            'index_bytes': held,
+            'bytes_per_license': round(held / n, 1),
+            'saved': round(1 - held / dict_bytes, 3) if dict_bytes else None,
+        }
+        print(json.dumps(report, indent=2))
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,192 @@
+# In-process benchmark of the hot routes through Flask's test client.
+#
+#   python -m bench.run --size 100k --backend json --out results/100k-json.json
+#
+# Generates a synthetic dataset (bench/datasets.py) into a scratch
+# DATA_DIR, imports the app against it and times each scenario. Peak RSS
+# is per process, so run one size per invocation. Compare two result
+# files with `python -m bench.compare old.json new.json`.
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import platform
+import resource
+import tempfile
+import subprocess
+from datetime import datetime, timedelta
+
+from bench import datasets
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    i = min(len(sorted_values) - 1, int(round(p / 100 * (len(sorted_values) - 1))))
+    return sorted_values[i]
+
+
+def peak_rss_kb():
+    # ru_maxrss is KiB on Linux and bytes on macOS.
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss // 1024 if sys.platform == 'darwin' else rss
+
+
+def git_commit():
+    try:
+        out = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                             cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        return out.stdout.strip() or None
+    except OSError:
+        return None
+
+
+def run_scenario(client, make_request, n, warmup):
+    # make_request(i) -> (method, url, kwargs); returns the timing summary.
+    for i in range(warmup):
+        method, url, kwargs = make_request(i)
+        client.open(url, method=method, **kwargs)
+    latencies = []
+    errors = 0
+    start = time.perf_counter()
+    for i in range(n):
+        method, url, kwargs = make_request(warmup + i)
+        t0 = time.perf_counter()
+        response = client.open(url, method=method, **kwargs)
+        response.get_data()
+        latencies.append(time.perf_counter() - t0)
+        # 403/404 are legitimate check outcomes, not failures.
+        if response.status_code >= 500:
+            errors += 1
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        'requests': n,
+        'errors': errors,
+        'seconds': round(elapsed, 4),
+        'rps': round(n / elapsed, 1) if elapsed else None,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+        'p90_ms': round(percentile(latencies, 90) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+        'max_ms': round(latencies[-1] * 1000, 3) if latencies else 0.0,
+    }
+
+
+def scenarios(licenses, seed):
+    rng = random.Random(seed)
+    sorted_keys = sorted(key for key, _, _ in licenses)
+    future = (datasets.REFERENCE_DATE + timedelta(days=365)).isoformat()
+
+    def check(i):
+        key, device_id, version = licenses[rng.randrange(len(licenses))]
+        roll = rng.random()
+        if roll < 0.1:
+            device_id = 'DEV-OTHER'
+        elif roll < 0.15:
+            key = 'NOSUCHKEY%011d' % i
+        return 'POST', '/api/license/check', {'json': {'key': key, 'device_id': device_id, 'version': version}}
+
+    def generate(i):
+        return 'POST', '/api/license/generate', {
+            'json': {'device_id': f'BENCH-{i:08d}', 'version': '3.0', 'expiry': future}}
+
+    def search(i):
+        # Fresh substrings each time, so the rendered-table cache doesn't hide the work.
+        key = sorted_keys[rng.randrange(len(sorted_keys))]
+        start = rng.randrange(len(key) - 4)
+        status = rng.choice(['', '', 'active', 'expired', 'disabled'])
+        return 'GET', '/licenses', {'query_string': {'q': key[start:start + 4].lower(), 'status': status}}
+
+    def page(i):
+        after = sorted_keys[rng.randrange(len(sorted_keys))]
+        return 'GET', '/licenses', {'query_string': {'after': after, 'status': rng.choice(['', 'active'])}}
+
+    # Read-only scenarios first; generate bumps the license generation and
+    # would otherwise skew the cached ones.
+    return [
+        ('api_check_license', check),
+        ('api_get_tools', lambda i: ('GET', '/api/tools', {})),
+        ('dashboard', lambda i: ('GET', '/', {})),
+        ('license_admin_search', search),
+        ('license_admin_page', page),
+        ('api_generate_license', generate),
+    ]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='In-process benchmark of the hot routes')
+    parser.add_argument('--size', default='1k', help='1k, 10k, 100k, 1m or a number of licenses')
+    parser.add_argument('--backend', default='json', choices=['json', 'sqlite'])
+    parser.add_argument('--requests', type=int, default=1000, help='timed requests per scenario')
+    parser.add_argument('--warmup', type=int, default=50)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--only', action='append', help='run just this scenario (repeatable)')
+    parser.add_argument('--data-dir', help='keep the generated data here instead of a temp dir')
+    parser.add_argument('--out', help='write results JSON here (default: stdout)')
+    args = parser.parse_args(argv)
+
+    size = datasets.parse_size(args.size)
+    data_dir = args.data_dir or tempfile.mkdtemp(prefix='license-bench-')
+    try:
+        t0 = time.perf_counter()
+        licenses = datasets.generate(data_dir, size, seed=args.seed)
+        generate_seconds = time.perf_counter() - t0
+
+        # app.py reads its configuration at import time.
+        os.environ['DATA_DIR'] = data_dir
+        os.environ['STORAGE_BACKEND'] = args.backend
+        # Measure the admission checks without ever tripping them.
+        for name in ('RATE_LIMIT_KEY', 'RATE_LIMIT_DEVICE', 'RATE_LIMIT_CLIENT'):
+            os.environ.setdefault(name, '1000000000/1')
+        t0 = time.perf_counter()
+        import app as app_module
+        # Midday on the dataset's reference date, so statuses match the data.
+        reference = datetime.combine(datasets.REFERENCE_DATE, datetime.min.time()).timestamp() + 12 * 3600
+        app_module.clock.now = lambda: reference
+        client = app_module.app.test_client()
+        client.get('/api/license/revoked').get_data()
+        startup_seconds = time.perf_counter() - t0
+        rss_after_load = peak_rss_kb()
+
+        results = {}
+        for name, make_request in scenarios(licenses, args.seed):
+            if args.only and name not in args.only:
+                continue
+            results[name] = run_scenario(client, make_request, args.requests, args.warmup)
+            print(f"{name:24s} {results[name]['rps']:>10} req/s  p50 {results[name]['p50_ms']} ms  "
+                  f"p99 {results[name]['p99_ms']} ms", file=sys.stderr)
+    finally:
+        if not args.data_dir:
+            shutil.rmtree(data_dir, ignore_errors=True)
+
+    report = {
+        'meta': {
+            'commit': git_commit(),
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'backend': args.backend,
+            'licenses': size,
+            'requests': args.requests,
+            'seed': args.seed,
+        },
+        'dataset_seconds': round(generate_seconds, 3),
+        'startup_seconds': round(startup_seconds, 3),
+        'rss_after_load_kb': rss_after_load,
+        'peak_rss_kb': peak_rss_kb(),
+        'scenarios': results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.out:
+        os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+        with open(args.out, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,217 @@
+# Expiry sweeper: "Expired" history events and upcoming-expiry notices.
+#
+# One process per data directory (whichever holds .expiry.lock; the others
+# stand by) sweeps on start, then every `interval` seconds and just after
+# local midnight:
+#   - each license that expired since the last sweep gets an "Expired"
+#     history event, dated its expiry day (from which /api/license/check
+#     answers "expired"), 10k per commit. The events go to the store and
+#     the progress to expiry.db, so each chunk is logged in expired_log
+#     first and marked written after: a sweep that died mid-chunk looks in
+#     the license history for that chunk instead of writing it twice;
+#   - each non-revoked license within 30, 7 or 1 days of its expiry gets a
+#     notice queued in the outbox (DATA_DIR/expiry.db), once per license,
+#     threshold and expiry date.
+# Both read date ranges of the store's expiry-ordered index, never the
+# whole license set. GET /api/license/expiring and the dashboard read the
+# outbox; whatever sends the notifications marks them with
+# POST /api/license/expiring/sent.
+import os
+import time
+import fcntl
+import sqlite3
+import logging
+import threading
+from contextlib import closing
+from datetime import date
+
+log = logging.getLogger(__name__)
+
+NOTICE_DAYS = (30, 7, 1)
+CHUNK = 10000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY,
+    key TEXT NOT NULL,
+    notice INTEGER NOT NULL,   -- days before expiry: 30, 7 or 1
+    expiry INTEGER NOT NULL,   -- date ordinal
+    queued INTEGER NOT NULL,   -- unix time
+    sent INTEGER,
+    UNIQUE (key, notice, expiry)
+);
+CREATE INDEX IF NOT EXISTS outbox_expiry ON outbox(expiry);
+-- expired_through: licenses expiring on or before this day ordinal have
+-- their "Expired" event. swept_at: unix time of the last sweep.
+CREATE TABLE IF NOT EXISTS sweep_state (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+-- "Expired" events of the sweep in progress (emptied when it finishes).
+CREATE TABLE IF NOT EXISTS expired_log (
+    key TEXT NOT NULL,
+    expiry INTEGER NOT NULL,   -- date ordinal
+    written INTEGER NOT NULL,  -- 0 until the store has taken the event
+    PRIMARY KEY (key, expiry)
+);
+"""
+
+
+class ExpirySweeper:
+    def __init__(self, store, data_dir, clock, interval=3600):
+        self.store = store
+        self.clock = clock
+        self.interval = interval
+        self.path = os.path.join(data_dir, 'expiry.db')
+        self.lock_file = os.path.join(data_dir, '.expiry.lock')
+        self._pid = None
+        self._lock_fd = None
+        self._lock = threading.Lock()
+        with closing(self._connect()) as conn:
+            conn.executescript(SCHEMA)
+        os.register_at_fork(after_in_child=self._after_fork)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        return conn
+
+    def start(self):
+        # Once per process, from a process that serves; as replica.Follower.
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+        threading.Thread(target=self._run, name='expiry-sweeper', daemon=True).start()
+
+    def _after_fork(self):
+        self._lock = threading.Lock()
+        self._lock_fd = None
+
+    def _run(self):
+        while not self._elect():
+            time.sleep(60)
+        while True:
+            try:
+                self.sweep()
+            except (sqlite3.Error, OSError) as e:
+                log.warning('Expiry sweep failed: %s', e)
+            # Wake just after midnight too, so expiries are swept that day.
+            midnight = self.clock.day_start(self.clock.today_ord() + 1) - self.clock.time()
+            time.sleep(max(1.0, min(self.interval, midnight + 1)))
+
+    def _elect(self):
+        fd = os.open(self.lock_file, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        self._lock_fd = fd
+        return True
+
+    # --- sweeping ---
+    def sweep(self):
+        today = self.clock.today_ord()
+        now = int(self.clock.time())
+        with self._lock, closing(self._connect()) as conn:
+            row = conn.execute("SELECT value FROM sweep_state WHERE name = 'expired_through'").fetchone()
+            # The first sweep starts from today rather than writing events
+            # for every license that ever expired.
+            through = row[0] if row else today - 1
+            expired = 0
+            if through < today:
+                logged = {(key, expiry): written for key, expiry, written
+                          in conn.execute('SELECT key, expiry, written FROM expired_log')}
+                chunk = []
+                for lic in self.store.expiring(date.fromordinal(through + 1), date.fromordinal(today)):
+                    written = logged.get((lic.key, lic.expiry_ord))
+                    if written or (written == 0 and self._has_expired_event(lic)):
+                        continue
+                    chunk.append(lic)
+                    if len(chunk) >= CHUNK:
+                        expired += self._write_expired(conn, chunk)
+                        chunk = []
+                if chunk:
+                    expired += self._write_expired(conn, chunk)
+
+            notices = []
+            for lic in self.store.expiring(date.fromordinal(today + 1), date.fromordinal(today + max(NOTICE_DAYS))):
+                left = lic.expiry_ord - today
+                notices += [(lic.key, days, lic.expiry_ord, now) for days in NOTICE_DAYS if left <= days]
+            conn.execute('BEGIN IMMEDIATE')
+            before = conn.total_changes
+            conn.executemany('INSERT OR IGNORE INTO outbox (key, notice, expiry, queued) VALUES (?, ?, ?, ?)', notices)
+            queued = conn.total_changes - before
+            conn.execute('DELETE FROM outbox WHERE expiry < ?', (today - max(NOTICE_DAYS),))
+            conn.executemany('INSERT OR REPLACE INTO sweep_state (name, value) VALUES (?, ?)',
+                             [('expired_through', max(through, today)), ('swept_at', now)])
+            conn.execute('DELETE FROM expired_log')
+            conn.execute('COMMIT')
+        if expired or queued:
+            log.info('Expiry sweep: %d expired, %d notices queued', expired, queued)
+        return {'expired': expired, 'queued': queued}
+
+    def _write_expired(self, conn, chunk):
+        rows = [(lic.key, lic.expiry_ord) for lic in chunk]
+        conn.execute('BEGIN IMMEDIATE')
+        conn.executemany('INSERT OR REPLACE INTO expired_log (key, expiry, written) VALUES (?, ?, 0)', rows)
+        conn.execute('COMMIT')
+        self.store.add_history([{'key': lic.key, 'event': 'Expired', 'date': lic.expiry} for lic in chunk])
+        conn.execute('BEGIN IMMEDIATE')
+        conn.executemany('UPDATE expired_log SET written = 1 WHERE key = ? AND expiry = ?', rows)
+        conn.execute('COMMIT')
+        return len(chunk)
+
+    def _has_expired_event(self, lic):
+        # Only for the chunk a failed sweep left unconfirmed.
+        offset, total = 0, 1
+        while offset < total:
+            events, total = self.store.license_history(lic.key, offset, 500)
+            if any(e['event'] == 'Expired' and e['date'] == lic.expiry for e in events):
+                return True
+            offset += 500
+        return False
+
+    # --- reads ---
+    def current(self):
+        # True if a sweep ran recently enough for the outbox to be trusted.
+        with closing(self._connect()) as conn:
+            row = conn.execute("SELECT value FROM sweep_state WHERE name = 'swept_at'").fetchone()
+        return bool(row) and self.clock.time() - row[0] < 2 * self.interval
+
+    def _pending(self, within, unsent_only=False):
+        # (outbox row, license) for notices of licenses expiring in the next
+        # `within` days, minus those revoked, extended or deleted since. A
+        # license expiring today has already run out.
+        today = self.clock.today_ord()
+        with closing(self._connect()) as conn:
+            rows = conn.execute('SELECT id, key, notice, expiry, queued, sent FROM outbox WHERE expiry BETWEEN ? AND ?'
+                                + (' AND sent IS NULL' if unsent_only else '') + ' ORDER BY expiry, key, notice DESC',
+                                (today + 1, today + within)).fetchall()
+        current = self.store.get_licenses({row[1] for row in rows})
+        for row in rows:
+            lic = current.get(row[1])
+            if lic and lic.active and lic.expiry_ord == row[3]:
+                yield row, lic
+
+    def notices(self, within, unsent_only=False):
+        today = self.clock.today_ord()
+        return [{'id': id, 'key': key, 'device_id': lic.device_id, 'expiry': lic.expiry,
+                 'days_left': expiry - today - 1, 'notice': notice, 'queued': queued, 'sent': sent}
+                for (id, key, notice, expiry, queued, sent), lic in self._pending(within, unsent_only)]
+
+    def licenses(self, within):
+        # The licenses behind notices(within), once each, soonest first.
+        found = {}
+        for row, lic in self._pending(within):
+            found.setdefault(lic.key, lic)
+        return list(found.values())
+
+    def mark_sent(self, ids):
+        with closing(self._connect()) as conn:
+            cur = conn.executemany('UPDATE outbox SET sent = ? WHERE id = ? AND sent IS NULL',
+                                   ((int(self.clock.time()), i) for i in ids))
+            return cur.rowcount
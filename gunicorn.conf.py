@@ -0,0 +1,27 @@
+# Read by gunicorn from the working directory.
+import os
+
+import metrics
+
+workers = int(os.environ.get('WEB_CONCURRENCY', 1))
+# Threads (the gthread worker) so a /api/changes long poll holds a thread,
+# not a whole worker.
+threads = int(os.environ.get('WEB_THREADS', 8))
+
+
+def on_starting(server):
+    # A new master and a new set of workers: /metrics totals start from
+    # zero instead of adding dumps left by the last run. Same directory as
+    # app.METRICS_DIR; not imported from there, since importing the app in
+    # the master would preload it even without --preload.
+    metrics_dir = os.environ.get('METRICS_DIR', os.path.join(os.environ.get('DATA_DIR', 'data'), 'metrics'))
+    if metrics_dir:
+        metrics.clear(metrics_dir)
+
+
+def post_fork(server, worker):
+    # Background threads (replica follower, expiry sweeper) start in each
+    # worker, never in a --preload master; see app.start_background_threads.
+    import app
+    app.set_worker_counts(server.cfg.workers, server.cfg.threads)
+    app.start_background_threads()
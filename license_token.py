@@ -0,0 +1,72 @@
+# Signed offline license tokens.
+#
+# The server hands one out with a successful check (POST /api/license/token);
+# a client keeps it and calls verify() on launch instead of hitting
+# /api/license/check until the token expires. Standard library only, so
+# this file can be copied into client tools as-is.
+#
+#   token = <base64url(json claims)>.<base64url(hmac-sha256(claims))>
+#
+# Claims: k = license key, d = device_id, v = version, e = license expiry
+# (YYYY-MM-DD), i = issued at, x = token expires at (unix seconds).
+import hmac
+import json
+import time
+import base64
+import hashlib
+from datetime import datetime
+
+
+class InvalidToken(Exception):
+    pass
+
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode()
+
+def _b64decode(text):
+    return base64.urlsafe_b64decode(text + '=' * (-len(text) % 4))
+
+def _sign(secret, payload):
+    if isinstance(secret, str):
+        secret = secret.encode()
+    return hmac.new(secret, payload.encode(), hashlib.sha256).digest()
+
+
+def issue(secret, key, device_id, version, expiry, ttl, now=None, license_end=None):
+    now = int(time.time() if now is None else now)
+    # Never outlive the license itself: like the online check, it runs out
+    # at the start of its expiry day. The server passes license_end from
+    # the parsed expiry it already holds.
+    if license_end is None:
+        license_end = int(datetime.strptime(expiry, "%Y-%m-%d").timestamp())
+    claims = {'k': key, 'd': device_id, 'v': version, 'e': expiry, 'i': now, 'x': min(now + ttl, license_end)}
+    payload = _b64encode(json.dumps(claims, separators=(',', ':')).encode())
+    return payload + '.' + _b64encode(_sign(secret, payload)), claims['x']
+
+
+def verify(token, secret, device_id=None, version=None, now=None, revoked=None, leeway=0):
+    # Returns the claims dict or raises InvalidToken. Pass device_id/version
+    # to bind the token to this machine and build, and `revoked` (any
+    # container of keys, e.g. from GET /api/license/revoked) to honour
+    # revocations before the token runs out.
+    try:
+        payload, signature = token.split('.')
+        expected = _sign(secret, payload)
+        if not hmac.compare_digest(expected, _b64decode(signature)):
+            raise InvalidToken('bad signature')
+        claims = json.loads(_b64decode(payload))
+    except InvalidToken:
+        raise
+    except (ValueError, TypeError):
+        raise InvalidToken('malformed token')
+    now = time.time() if now is None else now
+    if claims['x'] + leeway < now:
+        raise InvalidToken('expired')
+    if device_id is not None and claims['d'] != device_id:
+        raise InvalidToken('device_mismatch')
+    if version is not None and claims['v'] != version:
+        raise InvalidToken('version_mismatch')
+    if revoked is not None and claims['k'] in revoked:
+        raise InvalidToken('revoked')
+    return claims
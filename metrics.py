@@ -0,0 +1,245 @@
+# Minimal Prometheus-style metrics: counters and histograms kept in process
+# memory and rendered in the text exposition format.
+#
+# Under gunicorn every worker has its own registry. Once share(dir) is
+# called (app.py does, with DATA_DIR/metrics), each process periodically
+# dumps its values to <dir>/<pid>.json and render() sums all the dumps, so
+# /metrics shows totals across workers whichever worker answers it. Dumps
+# of processes that have exited are folded into <dir>/exited.json, so
+# totals don't drop when gunicorn replaces a worker; the gunicorn master
+# clears the directory when it starts (gunicorn.conf.py).
+import os
+import json
+import time
+import fcntl
+import bisect
+import threading
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Registry:
+    def __init__(self, multiprocess_dir=None, flush_interval=1.0):
+        self.multiprocess_dir = multiprocess_dir
+        self.flush_interval = flush_interval
+        self.counters = {}     # name -> {labels: value}
+        self.histograms = {}   # name -> {labels: [bucket counts..., +Inf count, sum]}
+        self.buckets = {}
+        self.help = {}
+        self._lock = threading.Lock()
+        self._last_flush = 0.0
+        self._pending = None   # threading.Timer for a deferred flush
+        if multiprocess_dir:
+            self.share(multiprocess_dir)
+        # With gunicorn --preload, workers fork from a master that may have
+        # recorded values already; don't count those once per worker.
+        os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self):
+        self._lock = threading.Lock()
+        for series in list(self.counters.values()) + list(self.histograms.values()):
+            series.clear()
+        self._last_flush = 0.0
+        self._pending = None
+
+    def counter(self, name, help_text):
+        self.help[name] = ('counter', help_text)
+        self.counters.setdefault(name, {})
+
+    def histogram(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        self.help[name] = ('histogram', help_text)
+        self.histograms.setdefault(name, {})
+        self.buckets[name] = buckets
+
+    def inc(self, name, value=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self.counters[name]
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = tuple(sorted(labels.items()))
+        buckets = self.buckets[name]
+        with self._lock:
+            series = self.histograms[name]
+            values = series.get(key)
+            if values is None:
+                values = series[key] = [0] * (len(buckets) + 2)
+            values[bisect.bisect_left(buckets, value)] += 1
+            values[-1] += value
+
+    @contextmanager
+    def time(self, name, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    # --- multiprocess ---
+    def share(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        self.multiprocess_dir = directory
+
+    def _dump(self):
+        with self._lock:
+            return {
+                'counters': {n: [[list(k), v] for k, v in s.items()] for n, s in self.counters.items()},
+                'histograms': {n: [[list(k), v] for k, v in s.items()] for n, s in self.histograms.items()},
+            }
+
+    def flush(self, force=False):
+        if not self.multiprocess_dir:
+            return
+        now = time.monotonic()
+        if not force and now - self._last_flush < self.flush_interval:
+            # Too soon; write it when the interval is up, so the values of
+            # a worker that then goes idle aren't left out of the totals.
+            if self._pending is None:
+                self._pending = threading.Timer(self._last_flush + self.flush_interval - now, self.flush, (True,))
+                self._pending.daemon = True
+                self._pending.start()
+            return
+        self._last_flush = now
+        self._pending = None
+        path = os.path.join(self.multiprocess_dir, '%d.json' % os.getpid())
+        with open(path + '.tmp', 'w') as f:
+            json.dump(self._dump(), f)
+        os.replace(path + '.tmp', path)
+
+    def _collect(self):
+        if not self.multiprocess_dir:
+            return self._dump()
+        self.flush(force=True)
+        self._fold_exited()
+        merged = {'counters': {}, 'histograms': {}}
+        for fname in os.listdir(self.multiprocess_dir):
+            if fname.endswith('.json'):
+                _merge(merged, _load(os.path.join(self.multiprocess_dir, fname)))
+        return {kind: {n: list(s.items()) for n, s in merged[kind].items()} for kind in merged}
+
+    def _fold_exited(self):
+        # Moves the values of processes that have exited into exited.json,
+        # under a lock so that two workers rendering at once don't both
+        # count the same dump.
+        dead = [fname for fname in os.listdir(self.multiprocess_dir)
+                if fname[:-5].isdigit() and fname.endswith('.json') and not _alive(int(fname[:-5]))]
+        if not dead:
+            return
+        archive = os.path.join(self.multiprocess_dir, EXITED)
+        with open(os.path.join(self.multiprocess_dir, '.lock'), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            merged = {'counters': {}, 'histograms': {}}
+            _merge(merged, _load(archive))
+            folded = []
+            for fname in dead:
+                path = os.path.join(self.multiprocess_dir, fname)
+                dump = _load(path)
+                if dump is not None:
+                    _merge(merged, dump)
+                    folded.append(path)
+            if not folded:
+                return
+            with open(archive + '.tmp', 'w') as f:
+                json.dump({kind: {n: [[list(k), v] for k, v in s.items()] for n, s in merged[kind].items()}
+                           for kind in merged}, f)
+            os.replace(archive + '.tmp', archive)
+            for path in folded:
+                os.unlink(path)
+
+    # --- exposition ---
+    def render(self):
+        data = self._collect()
+        lines = []
+        for name, (kind, help_text) in sorted(self.help.items()):
+            lines.append('# HELP %s %s' % (name, help_text))
+            lines.append('# TYPE %s %s' % (name, kind))
+            if kind == 'counter':
+                for labels, value in data['counters'].get(name, ()):
+                    lines.append('%s%s %s' % (name, _labels(labels), _number(value)))
+                continue
+            buckets = self.buckets[name]
+            for labels, values in data['histograms'].get(name, ()):
+                labels = list(labels)
+                cumulative = 0
+                for bound, count in zip(buckets + (float('inf'),), values[:-1]):
+                    cumulative += count
+                    le = '+Inf' if bound == float('inf') else repr(bound)
+                    lines.append('%s_bucket%s %d' % (name, _labels(labels + [('le', le)]), cumulative))
+                lines.append('%s_sum%s %s' % (name, _labels(labels), _number(values[-1])))
+                lines.append('%s_count%s %d' % (name, _labels(labels), cumulative))
+        return '\n'.join(lines) + '\n'
+
+
+EXITED = 'exited.json'
+
+
+def clear(directory):
+    # Drops every dump in `directory`, for a server starting afresh.
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return
+    for fname in names:
+        if fname.endswith('.json'):
+            os.unlink(os.path.join(directory, fname))
+
+
+def _load(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _merge(merged, dump):
+    # Adds a _dump()-shaped dict into `merged` ({kind: {name: {labels: value}}}).
+    if dump is None:
+        return
+    for kind in ('counters', 'histograms'):
+        for name, series in dump[kind].items():
+            target = merged[kind].setdefault(name, {})
+            for labels, value in series:
+                key = tuple(tuple(pair) for pair in labels)
+                if kind == 'counters':
+                    target[key] = target.get(key, 0) + value
+                else:
+                    acc = target.setdefault(key, [0] * len(value))
+                    for i, v in enumerate(value):
+                        acc[i] += v
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _labels(pairs):
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return '{%s}' % ','.join('%s="%s"' % (k, v) for (k, _), v in zip(pairs, escaped))
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+# Process-wide registry shared by app.py and storage.py.
+REGISTRY = Registry()
+
+REGISTRY.counter('http_requests_total', 'HTTP requests by endpoint, method and status.')
+REGISTRY.histogram('http_request_duration_seconds', 'Time spent handling a request, by endpoint.')
+REGISTRY.histogram('http_request_queue_seconds', 'Time between the X-Request-Start header and handling.')
+REGISTRY.counter('license_checks_total', 'License check outcomes.')
+REGISTRY.counter('api_rejected_total', 'License API requests refused by rate limiting or load shedding, by reason.')
+REGISTRY.histogram('storage_load_seconds', 'Time spent reading data files or replaying the journal.')
+REGISTRY.counter('storage_load_bytes_total', 'Bytes read from data files and the journal.')
+REGISTRY.histogram('storage_save_seconds', 'Time spent committing writes (including fsync).')
+REGISTRY.counter('storage_save_bytes_total', 'Bytes written to data files and the journal.')
@@ -0,0 +1,144 @@
+# Admission control for the license API, shared by all gunicorn workers.
+#
+# Token buckets and per-worker in-flight counts live in one memory-mapped
+# file (DATA_DIR/ratelimit.bin), so every worker sees the same limits
+# without a server process. Each bucket slot is guarded by an fcntl byte-
+# range lock; the in-flight table by a lock over the whole table.
+#
+# Buckets are direct-mapped by a hash of their name: two names landing in
+# the same slot evict each other, which only ever resets a bucket to full
+# (fails open), so the table doesn't need to hold every key ever seen.
+import os
+import mmap
+import time
+import fcntl
+import struct
+import hashlib
+import threading
+
+BUCKET = struct.Struct('<Qdd')   # name hash, tokens, updated (unix time)
+WORKER = struct.Struct('<II')    # pid, requests in flight
+
+
+def parse_rate(text):
+    # "<requests>/<seconds>", e.g. "60/60"; (burst, tokens per second), or
+    # None for "0" / "" (no limit).
+    if not text or text.strip() == '0':
+        return None
+    count, _, seconds = text.partition('/')
+    count, seconds = int(count), float(seconds or 1)
+    return count, count / seconds
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class SharedLimiter:
+    def __init__(self, path, buckets=65536, workers=256):
+        self.buckets = buckets
+        self.workers = workers
+        self._table = workers * WORKER.size
+        size = self._table + buckets * BUCKET.size
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        if os.fstat(self._fd).st_size < size:
+            os.ftruncate(self._fd, size)
+        self._mm = mmap.mmap(self._fd, size)
+        self._slot = None   # (pid, index) of our in-flight counter
+        self._lock = threading.Lock()
+        os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        self._lock = threading.Lock()
+        self._slot = None
+
+    def _locked(self, offset, length):
+        return _RangeLock(self._fd, offset, length)
+
+    # --- token buckets ---
+    def take(self, name, rate, cost=1, now=None):
+        # Takes `cost` tokens from bucket `name` with `rate` = (burst,
+        # tokens per second). Returns 0 if allowed, else the seconds until
+        # it would be.
+        burst, per_second = rate
+        cost = min(cost, burst)
+        # Wall clock, since the file outlives processes (and reboots).
+        now = time.time() if now is None else now
+        h = int.from_bytes(hashlib.blake2b(name.encode(), digest_size=8).digest(), 'little')
+        offset = self._table + (h % self.buckets) * BUCKET.size
+        with self._lock, self._locked(offset, BUCKET.size):
+            stored, tokens, updated = BUCKET.unpack_from(self._mm, offset)
+            if stored != h:
+                tokens, updated = burst, now
+            tokens = min(burst, tokens + max(0.0, now - updated) * per_second)
+            if tokens >= cost:
+                tokens -= cost
+                wait = 0.0
+            else:
+                wait = (cost - tokens) / per_second
+            BUCKET.pack_into(self._mm, offset, h, tokens, now)
+        return wait
+
+    # --- concurrency ---
+    def enter(self, limit):
+        # Counts a request in flight unless `limit` requests (all workers)
+        # already are; False means shed it. limit 0 only counts.
+        pid = os.getpid()
+        with self._lock, self._locked(0, self._table):
+            counts = list(WORKER.iter_unpack(self._mm[:self._table]))
+            if limit and sum(n for _, n in counts) >= limit:
+                # Before refusing, drop counts left by workers that died
+                # mid-request.
+                for i, (other, n) in enumerate(counts):
+                    if n and other != pid and not _alive(other):
+                        counts[i] = (0, 0)
+                        WORKER.pack_into(self._mm, i * WORKER.size, 0, 0)
+                if sum(n for _, n in counts) >= limit:
+                    return False
+            i = self._own_slot(pid, counts)
+            WORKER.pack_into(self._mm, i * WORKER.size, pid, counts[i][1] + 1 if counts[i][0] == pid else 1)
+        return True
+
+    def leave(self):
+        pid = os.getpid()
+        with self._lock, self._locked(0, self._table):
+            i = self._slot[1]
+            other, n = WORKER.unpack_from(self._mm, i * WORKER.size)
+            if other == pid and n:
+                WORKER.pack_into(self._mm, i * WORKER.size, pid, n - 1)
+
+    def in_flight(self):
+        with self._lock, self._locked(0, self._table):
+            return sum(n for _, n in WORKER.iter_unpack(self._mm[:self._table]))
+
+    def _own_slot(self, pid, counts):
+        if self._slot and self._slot[0] == pid and counts[self._slot[1]][0] == pid:
+            return self._slot[1]
+        free = None
+        for i, (other, n) in enumerate(counts):
+            if other == pid:
+                free = i
+                break
+            if free is None and (other == 0 or not _alive(other)):
+                free = i
+        if free is None:
+            free = pid % self.workers  # table full; share a slot
+        self._slot = (pid, free)
+        return free
+
+
+class _RangeLock:
+    def __init__(self, fd, offset, length):
+        self.fd, self.offset, self.length = fd, offset, length
+
+    def __enter__(self):
+        fcntl.lockf(self.fd, fcntl.LOCK_EX, self.length, self.offset)
+
+    def __exit__(self, *exc):
+        fcntl.lockf(self.fd, fcntl.LOCK_UN, self.length, self.offset)
@@ -0,0 +1,124 @@
+# Compact in-memory license record.
+#
+# One dict per license (plus its date strings) costs several hundred bytes;
+# a slotted object with dates as day ordinals (date.toordinal()), interned
+# versions and an int bitfield for flags costs a fraction of that, and
+# status checks become integer compares.
+#
+# Records are immutable by convention: replace() returns a new one, so a
+# reader holding the old record never sees a half-applied change. They
+# read like the old dicts (lic['key'], lic.get('active', True)) so routes
+# and templates don't care, and to_dict() gives back the licenses.json
+# shape.
+import sys
+from datetime import date
+
+ACTIVE = 1
+
+FIELDS = ('key', 'device_id', 'version', 'expiry', 'active', 'created')
+
+
+def to_ordinal(value):
+    # 0 for missing or unparseable dates, which sort as long expired.
+    try:
+        return date.fromisoformat(value).toordinal()
+    except (TypeError, ValueError):
+        return 0
+
+
+def from_ordinal(n):
+    return date.fromordinal(n).isoformat() if n else None
+
+
+class License:
+    __slots__ = ('key', 'device_id', 'version', 'expiry_ord', 'created_ord', 'flags', 'extra')
+
+    def __init__(self, key, device_id, version, expiry_ord, created_ord=0, flags=ACTIVE, extra=None):
+        self.key = key
+        self.device_id = device_id
+        self.version = sys.intern(version) if isinstance(version, str) else version
+        self.expiry_ord = expiry_ord
+        self.created_ord = created_ord
+        self.flags = flags
+        # Anything else the record carried (unknown fields, unparseable
+        # dates as given), so to_dict() round-trips. None almost always.
+        self.extra = extra
+
+    @classmethod
+    def from_dict(cls, d):
+        extra = {k: v for k, v in d.items() if k not in FIELDS}
+        expiry_ord = to_ordinal(d.get('expiry'))
+        created_ord = to_ordinal(d.get('created'))
+        if not expiry_ord and d.get('expiry') is not None:
+            extra['expiry'] = d['expiry']
+        if not created_ord and d.get('created') is not None:
+            extra['created'] = d['created']
+        return cls(d['key'], d['device_id'], d['version'], expiry_ord, created_ord,
+                   ACTIVE if d.get('active', True) else 0, extra or None)
+
+    @classmethod
+    def coerce(cls, lic):
+        return lic if isinstance(lic, cls) else cls.from_dict(lic)
+
+    def to_dict(self):
+        d = {
+            'key': self.key,
+            'device_id': self.device_id,
+            'version': self.version,
+            'expiry': from_ordinal(self.expiry_ord),
+            'active': self.active,
+            'created': from_ordinal(self.created_ord),
+        }
+        if self.extra:
+            d.update(self.extra)
+        return d
+
+    def replace(self, **changes):
+        # Field names as in to_dict(); None drops an extra field.
+        d = self.to_dict()
+        d.update(changes)
+        return License.from_dict({k: v for k, v in d.items() if v is not None or k in FIELDS})
+
+    @property
+    def active(self):
+        return bool(self.flags & ACTIVE)
+
+    @property
+    def expiry(self):
+        if self.expiry_ord:
+            return from_ordinal(self.expiry_ord)
+        return (self.extra or {}).get('expiry', '')
+
+    @property
+    def created(self):
+        if self.created_ord:
+            return from_ordinal(self.created_ord)
+        return (self.extra or {}).get('created')
+
+    # --- dict-style access ---
+    def __getitem__(self, name):
+        if name in FIELDS:
+            return getattr(self, name)
+        if self.extra and name in self.extra:
+            return self.extra[name]
+        raise KeyError(name)
+
+    def get(self, name, default=None):
+        try:
+            return self[name]
+        except KeyError:
+            return default
+
+    def __contains__(self, name):
+        return name in FIELDS or bool(self.extra and name in self.extra)
+
+    def keys(self):
+        return list(FIELDS) + list(self.extra or ())
+
+    def __eq__(self, other):
+        if not isinstance(other, License):
+            return NotImplemented
+        return self.to_dict() == other.to_dict()
+
+    def __repr__(self):
+        return 'License(%r)' % self.to_dict()
@@ -0,0 +1,156 @@
+# Read replica: follows a primary's change feed into the local store.
+#
+# A node started with REPLICA_OF=<primary URL> serves license checks and
+# the tool API from its own DATA_DIR and refuses writes (see app.py). One
+# Follower per data directory long-polls GET /api/changes on the primary
+# and applies what comes back; whichever process holds .replica.lock does
+# the following, the rest stand by in case it goes away. The position is
+# kept in replica.seq, so a restart carries on where it stopped. When the
+# primary can't serve the changes since then (first start, compacted past
+# them, different data) the follower reloads everything from
+# /api/changes/snapshot.
+import os
+import json
+import time
+import fcntl
+import logging
+import threading
+import urllib.error
+import urllib.request
+
+log = logging.getLogger(__name__)
+
+
+class Follower:
+    def __init__(self, primary, store, data_dir, wait=25, limit=1000, batch=10000):
+        self.primary = primary.rstrip('/')
+        self.store = store
+        self.wait = wait
+        self.limit = limit
+        self.batch = batch
+        self.position_file = os.path.join(data_dir, 'replica.seq')
+        self.lock_file = os.path.join(data_dir, '.replica.lock')
+        self.seq = None
+        self.last_sync = None  # time.time() of the last successful poll
+        self._lock_fd = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+        os.register_at_fork(after_in_child=self._after_fork)
+
+    def start(self):
+        # Once per process, and only in processes that serve: not in a
+        # gunicorn --preload master, whose workers would fork while the
+        # thread might hold a store lock (see app.start_background_threads).
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+        threading.Thread(target=self._run, name='replica-follower', daemon=True).start()
+
+    def _after_fork(self):
+        self._lock_fd = None
+        self._start_lock = threading.Lock()
+
+    def _run(self):
+        while not self._elect():
+            time.sleep(5)
+        backoff = 1
+        while True:
+            try:
+                self.poll()
+                backoff = 1
+            except (OSError, ValueError, KeyError) as e:
+                log.warning('Replication from %s failed: %s', self.primary, e)
+                time.sleep(backoff)
+                backoff = min(backoff * 2, 30)
+
+    def _elect(self):
+        fd = os.open(self.lock_file, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        self._lock_fd = fd
+        return True
+
+    # --- following ---
+    def poll(self):
+        since = self.position()
+        if since is None:
+            # Never synced: position 0 would also be a primary with no
+            # writes yet, so it can't stand for "nothing loaded".
+            self.resync()
+            return
+        data = self._get_json('/api/changes?since=%d&wait=%d&limit=%d' % (since, self.wait, self.limit),
+                              timeout=self.wait + 10)
+        if data['reset']:
+            self.resync()
+            return
+        if data['changes']:
+            self.store.apply_changes(data['changes'])
+        self._save_position(data['seq'])
+
+    def resync(self):
+        # Streams the primary's full state in, `batch` changes per commit.
+        with urllib.request.urlopen(self.primary + '/api/changes/snapshot', timeout=60) as resp:
+            seq = json.loads(resp.readline())['seq']
+            batch = []
+            for line in resp:
+                batch.append(json.loads(line))
+                if len(batch) >= self.batch:
+                    self.store.apply_changes(batch)
+                    batch = []
+            if batch:
+                self.store.apply_changes(batch)
+        log.info('Replica reloaded from %s at change %d', self.primary, seq)
+        self._save_position(seq)
+
+    def position(self):
+        # None until the first resync has been saved.
+        if self.seq is None:
+            try:
+                with open(self.position_file) as f:
+                    self.seq = int(f.read().strip())
+            except (OSError, ValueError):
+                return None
+        return self.seq
+
+    def _save_position(self, seq):
+        if seq != self.seq or not os.path.exists(self.position_file):
+            with open(self.position_file + '.tmp', 'w') as f:
+                f.write('%d\n' % seq)
+            os.replace(self.position_file + '.tmp', self.position_file)
+            self.seq = seq
+        self.last_sync = time.time()
+
+    # --- writes ---
+    def claim(self, lic, device_id):
+        # Binding an unassigned license is a write, so the primary does it;
+        # until the change comes back through the feed we go by its answer.
+        try:
+            result = self._post_json('/api/license/check', {'key': lic.key, 'device_id': device_id, 'version': lic.version})
+        except (OSError, ValueError) as e:
+            log.warning('Could not forward claim of %s to %s: %s', lic.key, self.primary, e)
+            return lic
+        if result.get('status') in ('valid', 'expired'):
+            return lic.replace(device_id=device_id)
+        return lic
+
+    # --- HTTP ---
+    def _get_json(self, path, timeout):
+        with urllib.request.urlopen(self.primary + path, timeout=timeout) as resp:
+            return json.load(resp)
+
+    def _post_json(self, path, body):
+        req = urllib.request.Request(self.primary + path, data=json.dumps(body).encode(),
+                                     headers={'Content-Type': 'application/json'})
+        try:
+            with urllib.request.urlopen(req, timeout=10) as resp:
+                return json.load(resp)
+        except urllib.error.HTTPError as e:
+            # Check outcomes other than "valid" come back as 4xx.
+            with e:
+                return json.load(e)
@@ -0,0 +1,170 @@
+# Compact revocation list for clients that cache license state.
+#
+# GET /api/license/revocations returns every revoked key once, encoded,
+# with a version; a client that sends its version back (?since=N) gets
+# only the keys revoked or reinstated since then. Standard library only,
+# so clients can copy this file for decode() and apply().
+#
+#   encoded = base64(zlib(for each key in sorted order:
+#                         varint shared prefix length with the previous key,
+#                         varint suffix length, suffix bytes))
+#
+# On the server, RevocationList keeps the sorted keys in memory and
+# follows the store's change feed, so a revoke (in any worker) shows up
+# on the next request without rescanning the licenses.
+import zlib
+import base64
+import bisect
+import threading
+from collections import deque
+
+
+def _varint(n, out):
+    while n >= 0x80:
+        out.append(n & 0x7f | 0x80)
+        n >>= 7
+    out.append(n)
+
+def _read_varint(data, pos):
+    n = shift = 0
+    while True:
+        b = data[pos]
+        pos += 1
+        n |= (b & 0x7f) << shift
+        if b < 0x80:
+            return n, pos
+        shift += 7
+
+
+def encode(keys):
+    # `keys` sorted.
+    out = bytearray()
+    prev = b''
+    for key in keys:
+        key = key.encode()
+        shared = 0
+        limit = min(len(prev), len(key))
+        while shared < limit and prev[shared] == key[shared]:
+            shared += 1
+        _varint(shared, out)
+        _varint(len(key) - shared, out)
+        out += key[shared:]
+        prev = key
+    return base64.b64encode(zlib.compress(bytes(out), 9)).decode()
+
+
+def decode(text):
+    data = zlib.decompress(base64.b64decode(text))
+    keys, prev, pos = [], b'', 0
+    while pos < len(data):
+        shared, pos = _read_varint(data, pos)
+        length, pos = _read_varint(data, pos)
+        prev = prev[:shared] + data[pos:pos + length]
+        pos += length
+        keys.append(prev.decode())
+    return keys
+
+
+def apply(revoked, response):
+    # Client side: `revoked` is the set from the previous response (or
+    # empty); returns the updated set.
+    if response['full']:
+        return set(decode(response['keys']))
+    return (set(revoked) | set(response['added'])) - set(response['removed'])
+
+
+class RevocationList:
+    def __init__(self, store, max_deltas=100000):
+        self.store = store
+        self.version = None
+        self._keys = []          # sorted
+        self._revoked = set()
+        # (version, key, revoked) for the most recent changes, oldest first;
+        # deltas reach back to self._floor.
+        self._deltas = deque(maxlen=max_deltas)
+        self._floor = 0
+        self._changed = 0        # bumped whenever _keys changes
+        self._encoded = None     # (self._changed, encode(self._keys))
+        self._lock = threading.Lock()
+
+    def refresh(self):
+        with self._lock:
+            if self.version is None:
+                self._rebuild()
+            while True:
+                changes, seq, reset = self.store.changes(self.version, 5000)
+                if reset:
+                    if seq == self.version:
+                        return self  # nothing written yet
+                    self._rebuild()
+                    continue
+                for change in changes:
+                    if change['type'] == 'license':
+                        lic = change['license']
+                        self._set(change['seq'], lic['key'], not lic.get('active', True))
+                self.version = seq
+                if len(changes) < 5000:
+                    return self
+
+    def _rebuild(self):
+        # Startup, or the store can't say what changed since our version
+        # (JSON journal compacted past it). Read the revoked keys directly,
+        # then catch up from the version taken before the read.
+        _, seq, _ = self.store.changes(-1)  # always a reset: just the current seq
+        revoked = set(self.store.revoked_keys())
+        if self.version is None or seq < self.version:
+            # (Going backwards means different data: start over.)
+            self._deltas.clear()
+            self._revoked = revoked
+            self._keys = sorted(revoked)
+            self._floor = seq
+            self._changed += 1
+        else:
+            # Recorded as deltas, so clients' versions stay usable.
+            for key in sorted(self._revoked - revoked):
+                self._set(seq, key, False)
+            for key in sorted(revoked - self._revoked):
+                self._set(seq, key, True)
+        self.version = seq
+
+    def _set(self, version, key, revoked):
+        if revoked == (key in self._revoked):
+            return
+        if revoked:
+            self._revoked.add(key)
+            bisect.insort(self._keys, key)
+        else:
+            self._revoked.discard(key)
+            del self._keys[bisect.bisect_left(self._keys, key)]
+        self._changed += 1
+        if len(self._deltas) == self._deltas.maxlen:
+            self._floor = self._deltas[0][0]
+        self._deltas.append((version, key, revoked))
+
+    def keys(self):
+        return list(self.refresh()._keys)
+
+    def since(self, version=None):
+        # The response body for GET /api/license/revocations.
+        self.refresh()
+        with self._lock:
+            current = self.version
+            if version is None or not self._floor <= version <= current:
+                if self._encoded is None or self._encoded[0] != self._changed:
+                    self._encoded = (self._changed, encode(self._keys))
+                return {'version': current, 'full': True, 'count': len(self._keys), 'keys': self._encoded[1]}
+            latest, earliest = {}, {}
+            for seq, key, revoked in reversed(self._deltas):
+                if seq <= version:
+                    break
+                latest.setdefault(key, revoked)
+                earliest[key] = revoked
+        # Deltas alternate per key, so a key whose first and last change
+        # differ is back where the client's version had it.
+        changed = {k: revoked for k, revoked in latest.items() if earliest[k] == revoked}
+        return {
+            'version': current,
+            'full': False,
+            'added': sorted(k for k, revoked in changed.items() if revoked),
+            'removed': sorted(k for k, revoked in changed.items() if not revoked),
+        }
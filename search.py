@@ -0,0 +1,61 @@
+# Search helpers for the admin license/tool lists.
+import bisect
+from array import array
+
+
+class NgramIndex:
+    # Trigram postings over lower-cased text. Each posting is an array of
+    # integer ids in insertion order. Lookups only return candidates and the
+    # caller confirms the real substring match, so postings left behind by
+    # an edit are harmless.
+    N = 3
+
+    def __init__(self):
+        self.postings = {}
+
+    @classmethod
+    def grams(cls, text):
+        text = text.lower()
+        return {text[i:i + cls.N] for i in range(len(text) - cls.N + 1)}
+
+    def add(self, doc_id, *texts):
+        grams = set()
+        for text in texts:
+            grams |= self.grams(text)
+        for gram in grams:
+            posting = self.postings.get(gram)
+            if posting is None:
+                posting = self.postings[gram] = array('I')
+            posting.append(doc_id)
+
+    def candidates(self, q):
+        # Every id whose text could contain `q` (len(q) >= N): the shortest
+        # posting among q's trigrams.
+        postings = [self.postings.get(g) for g in self.grams(q)]
+        if not postings or any(p is None for p in postings):
+            return ()
+        return min(postings, key=len)
+
+
+def keyset_page(keys, match, after=None, before=None, limit=15):
+    # One page from the sorted list `keys`, keeping only keys for which
+    # match(key) is true, starting right after `after` (or ending right
+    # before `before`). Stops as soon as the page is full.
+    # Returns (page, has_prev, has_next).
+    page = []
+    if before is not None:
+        i = bisect.bisect_left(keys, before)
+        while i > 0 and len(page) <= limit:
+            i -= 1
+            if match(keys[i]):
+                page.append(keys[i])
+        has_prev = len(page) > limit
+        page = page[:limit]
+        page.reverse()
+        return page, has_prev, True
+    i = bisect.bisect_right(keys, after) if after is not None else 0
+    while i < len(keys) and len(page) <= limit:
+        if match(keys[i]):
+            page.append(keys[i])
+        i += 1
+    return page[:limit], after is not None, len(page) > limit
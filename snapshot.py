@@ -0,0 +1,193 @@
+# Memory-mapped license snapshot (licenses.snap) for the JSON backend.
+#
+# A read-only file every worker maps instead of parsing licenses.json into
+# its own objects: the pages live once in the OS page cache however many
+# gunicorn workers there are. Built when licenses.json changes (compaction,
+# or first start) and swapped in by atomic rename; a mapping keeps working
+# on the old file until its reader lets go.
+#
+# Layout, little-endian:
+#   header      HEADER
+#   records     count x RECORD, sorted by key
+#   heap        key, device_id and extra-JSON bytes the records point into
+#   key_hash    u32 slots: record index + 1 (0 = empty), crc32(key), linear probing
+#   dev_hash    same, keyed by device_id (a device may appear several times)
+#   exp_ords    u32 expiry ordinals of the active licenses, ascending
+#   exp_idx     u32 record indices matching exp_ords
+#   disabled    u32 record indices of revoked licenses, ascending (= key order)
+#   versions    JSON list; records hold an index into it
+import os
+import json
+import zlib
+import mmap
+import struct
+import bisect
+from array import array
+
+from records import License, ACTIVE
+
+MAGIC = b'LICSNAP1'
+HEADER = struct.Struct('<8sQqIIIIIIQQQQQQQQ')
+RECORD = struct.Struct('<QHHIIIHB5x')
+HAS_EXTRA = 1
+
+
+def _table_size(n):
+    size = 8
+    while size < 2 * n:
+        size *= 2
+    return size
+
+
+def _hash_insert(table, mask, data, i):
+    slot = zlib.crc32(data) & mask
+    while table[slot]:
+        slot = (slot + 1) & mask
+    table[slot] = i + 1
+
+
+def write(path, licenses, source_sig=(0, 0)):
+    # `source_sig` is the (size, mtime_ns) of the licenses.json this was
+    # built from, so a reader can tell whether the two still match.
+    licenses = sorted((License.coerce(lic) for lic in licenses), key=lambda lic: lic.key)
+    n = len(licenses)
+    versions, version_ids = [], {}
+    records = bytearray(n * RECORD.size)
+    heap = bytearray()
+    slots = _table_size(n)
+    key_hash, dev_hash = array('I', bytes(4 * slots)), array('I', bytes(4 * slots))
+    expiries, disabled = [], array('I')
+    flags = 0
+    for i, lic in enumerate(licenses):
+        key, device = lic.key.encode(), lic.device_id.encode()
+        extra = json.dumps(lic.extra, separators=(',', ':')).encode() if lic.extra else b''
+        if extra:
+            flags |= HAS_EXTRA
+        vid = version_ids.get(lic.version)
+        if vid is None:
+            vid = version_ids[lic.version] = len(versions)
+            versions.append(lic.version)
+        RECORD.pack_into(records, i * RECORD.size, len(heap), len(key), len(device), len(extra),
+                         lic.expiry_ord, lic.created_ord, vid, lic.flags)
+        heap += key + device + extra
+        _hash_insert(key_hash, slots - 1, key, i)
+        _hash_insert(dev_hash, slots - 1, device, i)
+        if lic.flags & ACTIVE:
+            expiries.append((lic.expiry_ord, i))
+        else:
+            disabled.append(i)
+    expiries.sort()
+    exp_ords = array('I', (o for o, _ in expiries))
+    exp_idx = array('I', (i for _, i in expiries))
+    versions_json = json.dumps(versions).encode()
+
+    sections = [bytes(records), bytes(heap), key_hash.tobytes(), dev_hash.tobytes(),
+                exp_ords.tobytes(), exp_idx.tobytes(), disabled.tobytes(), versions_json]
+    offsets, pos = [], HEADER.size
+    for data in sections:
+        offsets.append(pos)
+        pos += len(data)
+    header = HEADER.pack(MAGIC, source_sig[0], source_sig[1], n, len(exp_ords), len(disabled), slots,
+                         len(versions_json), flags, *offsets)
+    # Written in place; callers write to a temp name and rename it in.
+    with open(path, 'wb') as f:
+        f.write(header)
+        for data in sections:
+            f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+class Snapshot:
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else b''
+        if len(self._mm) < HEADER.size or self._mm[:8] != MAGIC:
+            raise ValueError('not a license snapshot: %s' % path)
+        (_, size, mtime_ns, self.count, n_active, n_disabled, self._slots, versions_len, self.flags,
+         self._records, self._heap, key_hash, dev_hash, exp_ords, exp_idx, disabled, versions) = \
+            HEADER.unpack_from(self._mm)
+        self.source_sig = (size, mtime_ns)
+        view = memoryview(self._mm)
+        self._key_hash = view[key_hash:key_hash + 4 * self._slots].cast('I')
+        self._dev_hash = view[dev_hash:dev_hash + 4 * self._slots].cast('I')
+        # Bisectable without copying anything out of the mapping.
+        self.exp_ords = view[exp_ords:exp_ords + 4 * n_active].cast('I')
+        self.exp_idx = view[exp_idx:exp_idx + 4 * n_active].cast('I')
+        self.disabled = view[disabled:disabled + 4 * n_disabled].cast('I')
+        self._versions = json.loads(bytes(view[versions:versions + versions_len]))
+        self.keys = KeyView(self, range(self.count))
+
+    def __len__(self):
+        return self.count
+
+    def key_at(self, i):
+        heap_off, key_len = RECORD.unpack_from(self._mm, self._records + i * RECORD.size)[:2]
+        start = self._heap + heap_off
+        return self._mm[start:start + key_len].decode()
+
+    def record(self, i):
+        heap_off, key_len, dev_len, extra_len, expiry_ord, created_ord, vid, flags = \
+            RECORD.unpack_from(self._mm, self._records + i * RECORD.size)
+        start = self._heap + heap_off
+        mm = self._mm
+        key = mm[start:start + key_len].decode()
+        device = mm[start + key_len:start + key_len + dev_len].decode()
+        extra = json.loads(mm[start + key_len + dev_len:start + key_len + dev_len + extra_len]) if extra_len else None
+        return License(key, device, self._versions[vid], expiry_ord, created_ord, flags, extra)
+
+    def _probe(self, table, data):
+        mask = self._slots - 1
+        slot = zlib.crc32(data) & mask
+        while True:
+            i = table[slot]
+            if not i:
+                return
+            yield i - 1
+            slot = (slot + 1) & mask
+
+    def index_of(self, key):
+        if not self.count or not isinstance(key, str):
+            return None
+        data = key.encode()
+        for i in self._probe(self._key_hash, data):
+            if self.key_at(i) == key:
+                return i
+        return None
+
+    def get(self, key):
+        i = self.index_of(key)
+        return None if i is None else self.record(i)
+
+    def for_device(self, device_id):
+        if not self.count:
+            return []
+        found = (self.record(i) for i in self._probe(self._dev_hash, device_id.encode()))
+        return [lic for lic in found if lic.device_id == device_id]
+
+    def expiring_range(self, start, end):
+        # Record indices of active licenses with start <= expiry <= end
+        # (ordinals), soonest first.
+        lo = bisect.bisect_left(self.exp_ords, start)
+        hi = bisect.bisect_right(self.exp_ords, end)
+        return self.exp_idx[lo:hi]
+
+    def __iter__(self):
+        for i in range(self.count):
+            yield self.record(i)
+
+
+class KeyView:
+    # Keys of the records at `indices` (ascending, so the keys are sorted):
+    # a sequence bisect and search.keyset_page can work on directly.
+    def __init__(self, snapshot, indices):
+        self.snapshot = snapshot
+        self.indices = indices
+
+    def __len__(self):
+        return len(self.indices)
+
+    def __getitem__(self, i):
+        return self.snapshot.key_at(self.indices[i])
@@ -0,0 +1,1674 @@
+import os
+import sys
+import json
+import fcntl
+import sqlite3
+import time
+import bisect
+import threading
+from array import array
+from collections import OrderedDict
+
+from search import NgramIndex, keyset_page
+from records import License, ACTIVE, to_ordinal
+import snapshot
+from metrics import REGISTRY as metrics
+
+
+# ====== JSON helpers ======
+def load_json(path):
+    if not os.path.exists(path):
+        return []
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def license_status(lic, today):
+    # Same rules as app.status_of, with `today` as a date ordinal.
+    if not lic.flags & ACTIVE:
+        return "Disabled"
+    if lic.expiry_ord < today:
+        return "Expired"
+    return "Active"
+
+
+# Set on tools whose download is hosted here (artifacts.py).
+ARTIFACT_FIELDS = ('sha256', 'size', 'filename')
+
+BULK_FILTERS = ('version', 'status', 'device_prefix', 'expiry_from', 'expiry_to')
+
+
+def license_filter(filters, today):
+    # Predicate for update_licenses: every criterion given must hold.
+    # expiry_from/expiry_to are inclusive YYYY-MM-DD bounds; `today` is a
+    # date ordinal, for status.
+    version = filters.get('version')
+    status = filters.get('status')
+    prefix = filters.get('device_prefix')
+    start = to_ordinal(filters['expiry_from']) if filters.get('expiry_from') else None
+    end = to_ordinal(filters['expiry_to']) if filters.get('expiry_to') else None
+
+    def match(lic):
+        return ((version is None or lic.version == version)
+                and (status is None or license_status(lic, today) == status)
+                and (prefix is None or lic.device_id.startswith(prefix))
+                and (start is None or lic.expiry_ord >= start)
+                and (end is None or lic.expiry_ord <= end))
+    return match
+
+
+def split_history(licenses):
+    # License records as the app builds them may carry a "history" list.
+    # Stores keep events apart from the record: returns the licenses as
+    # License records without it, plus the events as flat
+    # {"key", "event", "date"} entries.
+    stripped, entries = [], []
+    for lic in licenses:
+        lic = License.coerce(lic)
+        if lic.extra and 'history' in lic.extra:
+            entries.extend(dict(event, key=lic.key) for event in lic.extra['history'])
+            lic = lic.replace(history=None)
+        stripped.append(lic)
+    return stripped, entries
+
+
+# ====== Storage Interface ======
+# Every route talks to one of these instead of reading/writing the data
+# files directly. Licenses come back as records.License (dict-style access
+# still works) and are accepted as either that or a plain dict in the
+# licenses.json shape; tools are plain dicts. History isn't part of the
+# record: events live in a separate append-only log, see license_history().
+class Store:
+    def generation(self, kind):
+        # Opaque value that changes whenever 'licenses' or 'tools' change
+        # (only comparable within one process). Used to key caches.
+        raise NotImplementedError
+
+    # --- licenses ---
+    def get_license(self, key):
+        raise NotImplementedError
+
+    def get_licenses(self, keys):
+        # Bulk lookup: {key: license} for the keys that exist.
+        found = {}
+        for key in keys:
+            lic = self.get_license(key)
+            if lic:
+                found[key] = lic
+        return found
+
+    def licenses(self):
+        raise NotImplementedError
+
+    def licenses_for_device(self, device_id):
+        raise NotImplementedError
+
+    def revoked_keys(self):
+        raise NotImplementedError
+
+    def status_counts(self, today):
+        # {'Active': n, 'Expired': n, 'Disabled': n} as of `today` (a date).
+        raise NotImplementedError
+
+    def expiring(self, start, end):
+        # Non-revoked licenses with start <= expiry <= end, soonest first.
+        raise NotImplementedError
+
+    def search_licenses(self, q, status, today, after=None, before=None, limit=15):
+        # Keyset-paginated admin search ordered by key: licenses whose key or
+        # device_id contains `q` (case-insensitive) and whose status is
+        # `status` ('' for any). `after`/`before` are the last/first key of
+        # the neighbouring page. Returns (licenses, has_prev, has_next).
+        raise NotImplementedError
+
+    def add_license(self, lic):
+        self.add_licenses([lic])
+
+    def add_licenses(self, licenses):
+        # Inserts (or replaces) all of them in a single commit. A "history"
+        # list on a license is appended to the event log.
+        raise NotImplementedError
+
+    def update_license(self, key, changes, event=None):
+        # Apply `changes` to one license and append a history event.
+        # Returns the updated license, or None if the key is unknown.
+        raise NotImplementedError
+
+    def claim_license(self, key, device_id, event):
+        # Binds an unassigned (device_id '') active license to `device_id`,
+        # atomically, so only the first of several racing claims wins.
+        # Returns the license as stored afterwards (bound to whichever
+        # device won), or None if the key is unknown.
+        raise NotImplementedError
+
+    def update_licenses(self, filters, changes, event, today):
+        # Bulk update_license: `changes` and `event` applied in a single
+        # commit to every license matching `filters` (BULK_FILTERS, see
+        # license_filter; "keys" limits it to those keys). `today` is a
+        # date. Returns how many licenses were updated.
+        raise NotImplementedError
+
+    # --- history ---
+    def license_history(self, key, offset=0, limit=50):
+        # One page of a license's events, oldest first: (events, total).
+        raise NotImplementedError
+
+    def history_entries(self):
+        # Every event of every license in log order, as
+        # {"key", "event", "date"} dicts.
+        raise NotImplementedError
+
+    def add_history(self, entries):
+        raise NotImplementedError
+
+    # --- change feed ---
+    # Every license or tool change gets the next sequence number. Replicas
+    # (replica.py) follow changes() and load state() when told to reset.
+    def changes(self, since, limit=1000):
+        # (changes, next_since, reset): up to `limit` changes with seq >
+        # `since`, oldest first, each {"seq", "type": "license", "license"}
+        # or {"seq", "type": "tools", "tools"} holding the full new state.
+        # `since` is a seq the caller has everything up to, from state() or
+        # an earlier call; 0 is a valid one. reset is true when `since` is
+        # negative (no state yet), ahead of us, or older than what is
+        # retained; the caller should load state() instead.
+        raise NotImplementedError
+
+    def state(self):
+        # (seq, licenses, tools): everything as of change `seq`. `licenses`
+        # may be a lazy iterable.
+        raise NotImplementedError
+
+    def apply_changes(self, changes):
+        # Replays changes() output (or state() items) from another store.
+        licenses = [c['license'] for c in changes if c['type'] == 'license']
+        tools = [c['tools'] for c in changes if c['type'] == 'tools']
+        if licenses:
+            self.add_licenses(licenses)
+        if tools:
+            self.replace_tools(tools[-1])
+
+    # --- tools ---
+    def tools(self):
+        raise NotImplementedError
+
+    def get_tool(self, name):
+        # Case-insensitive lookup.
+        raise NotImplementedError
+
+    def search_tools(self, q):
+        # Tools whose name or version contains `q` (case-insensitive).
+        raise NotImplementedError
+
+    def add_tool(self, tool):
+        # Returns False if a tool with the same name (any case) exists.
+        raise NotImplementedError
+
+    def update_tool(self, name, changes):
+        # A None value in `changes` removes that field (the artifact ones).
+        raise NotImplementedError
+
+    def delete_tool(self, name):
+        raise NotImplementedError
+
+    def replace_tools(self, tools):
+        raise NotImplementedError
+
+
+# ====== JSON Store ======
+# licenses.json and tools.json are snapshots. Every mutation is appended to
+# journal.ndjson as one small record holding the full new state of the
+# license (or the tool list), so replaying a record twice is harmless.
+# Once the journal passes `compact_bytes`, a background thread writes fresh
+# snapshots and starts a new journal, all via atomic renames.
+class FileLock:
+    # flock() on a side file for other processes, plus a thread lock since
+    # threads sharing one descriptor don't exclude each other via flock.
+    def __init__(self, path):
+        self.path = path
+        self._thread_lock = threading.RLock()
+        self._depth = 0
+        self._fd = None
+        self._pid = None
+
+    def __enter__(self):
+        self._thread_lock.acquire()
+        if self._depth == 0:
+            if self._pid != os.getpid():
+                self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+                self._pid = os.getpid()
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+        self._depth += 1
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._depth -= 1
+        if self._depth == 0:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        self._thread_lock.release()
+
+
+class Journal:
+    # Appends happen under the store's FileLock; fsync happens outside it
+    # with group commit: whoever finds no fsync running becomes the leader
+    # and syncs everything written so far, the rest wait for it. A
+    # compaction swaps the file underneath, so each write's fd is kept
+    # with its ticket, and a replaced fd stays open until it is synced.
+    def __init__(self, path, fsync=True):
+        self.path = path
+        self.fsync = fsync
+        self._fd = None
+        self._pid = None
+        self._cond = threading.Condition()
+        self._written = 0
+        self._synced = 0
+        self._syncing = False
+        self._dirty = {}  # fd -> last ticket written through it, not yet synced
+        self._retired = []  # fds of replaced files, closed once synced
+
+    def stat(self):
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None, 0
+        return st.st_ino, st.st_size
+
+    def _open(self):
+        ino, _ = self.stat()
+        if self._fd is None or self._pid != os.getpid() or os.fstat(self._fd).st_ino != ino:
+            with self._cond:
+                if self._fd is not None and self._pid == os.getpid():
+                    self._retired.append(self._fd)
+                    self._close_retired()
+                elif self._pid != os.getpid():
+                    # The parent's fds and pending syncs are its own.
+                    self._dirty, self._retired = {}, []
+                self._fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+                self._pid = os.getpid()
+        return self._fd
+
+    def _close_retired(self):
+        # Under self._cond. Not while a leader may be syncing one of them.
+        if self._syncing:
+            return
+        for fd in self._retired:
+            if fd not in self._dirty:
+                os.close(fd)
+        self._retired = [fd for fd in self._retired if fd in self._dirty]
+
+    def append(self, records):
+        # Returns (ticket, inode, byte length of each record's line).
+        lines = [(json.dumps(r, separators=(',', ':')) + '\n').encode() for r in records]
+        fd = self._open()
+        os.write(fd, b''.join(lines))
+        with self._cond:
+            self._written += 1
+            ticket = self._written
+            if self.fsync:
+                self._dirty[fd] = ticket
+        return ticket, os.fstat(fd).st_ino, [len(line) for line in lines]
+
+    def wait_durable(self, ticket):
+        if not self.fsync:
+            return
+        with self._cond:
+            while self._synced < ticket:
+                if self._syncing:
+                    self._cond.wait()
+                    continue
+                self._syncing = True
+                target = self._written
+                fds, self._dirty = self._dirty, {}
+                self._cond.release()
+                synced = False
+                try:
+                    for fd in fds:
+                        os.fsync(fd)
+                    synced = True
+                finally:
+                    self._cond.acquire()
+                    self._syncing = False
+                    if synced:
+                        self._synced = max(self._synced, target)
+                    else:
+                        for fd, t in fds.items():
+                            self._dirty[fd] = max(t, self._dirty.get(fd, 0))
+                    self._close_retired()
+                    self._cond.notify_all()
+
+    def read(self, offset):
+        # ([(offset, record), ...], new offset). Only whole lines are
+        # returned; a half-written trailing record is left for the next read.
+        try:
+            with open(self.path, 'rb') as f:
+                f.seek(offset)
+                data = f.read()
+        except FileNotFoundError:
+            return [], offset
+        end = data.rfind(b'\n') + 1
+        entries = []
+        for line in data[:end].splitlines(keepends=True):
+            if line.strip():
+                entries.append((offset, json.loads(line)))
+            offset += len(line)
+        return entries, offset
+
+
+class HistoryLog:
+    # history.ndjson: one {"key", "event", "date"} line per event, appended
+    # under the store lock and never rewritten. Only the admin and the
+    # history API read it, so the key -> line offsets map is built on
+    # first use and extended from the tail after that.
+    def __init__(self, path, fsync=True):
+        self.path = path
+        self.journal = Journal(path, fsync)
+        self._offsets = None
+        self._end = 0
+        self._lock = threading.Lock()
+
+    def append(self, entries):
+        ticket, _, sizes = self.journal.append(entries)
+        metrics.inc('storage_save_bytes_total', sum(sizes), backend='json', op='history')
+        return ticket
+
+    def wait_durable(self, ticket):
+        self.journal.wait_durable(ticket)
+
+    def _lines(self, offset):
+        # (offset, raw line) for each complete line from `offset` on, read
+        # as we go: the log can be larger than memory.
+        try:
+            f = open(self.path, 'rb')
+        except FileNotFoundError:
+            return
+        with f:
+            f.seek(offset)
+            for line in f:
+                if not line.endswith(b'\n'):
+                    return
+                yield offset, line
+                offset += len(line)
+
+    def _catch_up(self):
+        if self._offsets is None:
+            self._offsets, self._end = {}, 0
+        if self.journal.stat()[1] <= self._end:
+            return
+        for offset, line in self._lines(self._end):
+            if line.strip():
+                key = json.loads(line)['key']
+                offsets = self._offsets.get(key)
+                if offsets is None:
+                    offsets = self._offsets[key] = array('Q')
+                offsets.append(offset)
+            self._end = offset + len(line)
+
+    def events(self, key, offset=0, limit=50):
+        with self._lock:
+            self._catch_up()
+            offsets = self._offsets.get(key, ())
+            page, total = offsets[offset:offset + limit], len(offsets)
+        events = []
+        with open(self.path, 'rb') as f:
+            for pos in page:
+                f.seek(pos)
+                event = json.loads(f.readline())
+                del event['key']
+                events.append(event)
+        return events, total
+
+    def entries(self):
+        for _, line in self._lines(0):
+            if line.strip():
+                yield json.loads(line)
+
+
+class LicenseIndex:
+    # Licenses by key plus a secondary map device_id -> key, or a set of
+    # keys for the few devices with more than one license. Records are
+    # replaced, never mutated in place, so a snapshot of the values is safe
+    # to serialize while writers carry on.
+    #
+    # `expiries` is a sorted list of (expiry ordinal, key) for licenses that
+    # aren't revoked. Status counts and "expiring soon" are bisections into
+    # it, so they stay correct across midnight without a rescan.
+    #
+    # The search structures (sorted keys, trigram postings) are only built
+    # the first time the admin searches.
+    def __init__(self):
+        self.by_key = {}
+        self.by_device = {}
+        self.expiries = []
+        self.disabled = set()
+        self._sorted_keys = None
+        self._ngrams = None
+        self._ids = {}
+        self._id_keys = []
+        self._search_cache = OrderedDict()
+        self.search_lock = threading.Lock()
+
+    def load(self, licenses):
+        # Takes licenses.json dicts (or License records).
+        by_key = self.by_key
+        for lic in licenses:
+            lic = License.coerce(lic)
+            by_key[lic.key] = lic
+            self._add_device(lic.device_id, lic.key)
+        self.expiries = sorted(_expiry_entry(lic) for lic in by_key.values() if lic.flags & ACTIVE)
+        self.disabled = {key for key, lic in by_key.items() if not lic.flags & ACTIVE}
+
+    def _add_device(self, device_id, key):
+        keys = self.by_device.get(device_id)
+        if keys is None or keys == key:
+            self.by_device[device_id] = key
+        elif isinstance(keys, set):
+            keys.add(key)
+        else:
+            self.by_device[device_id] = {keys, key}
+
+    def _remove_device(self, device_id, key):
+        keys = self.by_device.get(device_id)
+        if keys == key:
+            del self.by_device[device_id]
+        elif isinstance(keys, set):
+            keys.discard(key)
+            if len(keys) == 1:
+                self.by_device[device_id] = keys.pop()
+
+    def put(self, lic):
+        key = lic.key
+        old = self.by_key.get(key)
+        if old is not None:
+            if old.device_id != lic.device_id:
+                self._remove_device(old.device_id, key)
+            if old.flags & ACTIVE:
+                entry = _expiry_entry(old)
+                i = bisect.bisect_left(self.expiries, entry)
+                if i < len(self.expiries) and self.expiries[i] == entry:
+                    del self.expiries[i]
+        self.by_key[key] = lic
+        self._add_device(lic.device_id, key)
+        if lic.flags & ACTIVE:
+            bisect.insort(self.expiries, _expiry_entry(lic))
+            self.disabled.discard(key)
+        else:
+            self.disabled.add(key)
+        with self.search_lock:
+            if self._sorted_keys is not None:
+                if old is None:
+                    bisect.insort(self._sorted_keys, key)
+                    self._index_text(key, lic)
+                elif old.device_id != lic.device_id:
+                    self._ngrams.add(self._ids[key], lic.device_id)
+            self._search_cache.clear()
+
+    def get(self, key):
+        return self.by_key.get(key)
+
+    def get_many(self, keys):
+        by_key = self.by_key
+        return {k: by_key[k] for k in keys if k in by_key}
+
+    def for_device(self, device_id):
+        keys = self.by_device.get(device_id, ())
+        if isinstance(keys, str):
+            keys = (keys,)
+        return [self.by_key[k] for k in keys]
+
+    def all(self):
+        return list(self.by_key.values())
+
+    def frozen(self):
+        # Every license, safe to iterate after the store lock is released.
+        return list(self.by_key.values())
+
+    def revoked(self):
+        return list(self.disabled)
+
+    def legacy_history(self):
+        return [lic for lic in self.by_key.values() if lic.extra and 'history' in lic.extra]
+
+    def replace_records(self, licenses):
+        # Same licenses minus legacy fields: nothing indexed changes.
+        for lic in licenses:
+            self.by_key[lic.key] = lic
+
+    def status_counts(self, today):
+        expired = bisect.bisect_left(self.expiries, (today.toordinal(),))
+        return {
+            'Active': len(self.expiries) - expired,
+            'Expired': expired,
+            'Disabled': len(self.by_key) - len(self.expiries),
+        }
+
+    def expiring(self, start, end):
+        lo = bisect.bisect_left(self.expiries, (start.toordinal(),))
+        hi = bisect.bisect_left(self.expiries, (end.toordinal() + 1,))
+        return [self.by_key[key] for _, key in self.expiries[lo:hi]]
+
+    def _index_text(self, key, lic):
+        self._ids[key] = len(self._id_keys)
+        self._id_keys.append(key)
+        self._ngrams.add(self._ids[key], key, lic.device_id)
+
+    def _search_source(self, q, status, today):
+        # A sorted key list guaranteed to hold every match: trigram
+        # candidates for q, else the Disabled/Expired bucket, else all keys.
+        if self._sorted_keys is None:
+            self._ngrams = NgramIndex()
+            for key, lic in self.by_key.items():
+                self._index_text(key, lic)
+            self._sorted_keys = sorted(self.by_key)
+        if len(q) < NgramIndex.N and status not in ('Disabled', 'Expired'):
+            return self._sorted_keys
+        cache_key = (q, status, today)
+        keys = self._search_cache.get(cache_key)
+        if keys is None:
+            if len(q) >= NgramIndex.N:
+                keys = sorted({self._id_keys[i] for i in self._ngrams.candidates(q)})
+            elif status == 'Disabled':
+                keys = sorted(self.disabled)
+            else:
+                keys = sorted(key for _, key in self.expiries[:bisect.bisect_left(self.expiries, (today,))])
+            self._search_cache[cache_key] = keys
+            if len(self._search_cache) > 32:
+                self._search_cache.popitem(last=False)
+        return keys
+
+    def search(self, q, status, today, after=None, before=None, limit=15):
+        q = q.lower()
+        today = today.toordinal()
+        by_key = self.by_key
+
+        def match(key):
+            lic = by_key[key]
+            return ((not q or q in key.lower() or q in lic.device_id.lower())
+                    and (not status or license_status(lic, today) == status))
+
+        with self.search_lock:
+            keys, has_prev, has_next = keyset_page(self._search_source(q, status, today), match, after, before, limit)
+        return [by_key[k] for k in keys], has_prev, has_next
+
+
+def _expiry_entry(lic):
+    return (lic.expiry_ord, lic.key)
+
+
+class SnapshotIndex:
+    # The LicenseIndex interface over a mapped licenses.snap (shared by all
+    # workers through the page cache) plus a small in-memory LicenseIndex
+    # overlay holding what the journal changed since the snapshot. Overlay
+    # records shadow the snapshot's.
+    def __init__(self, base):
+        self.base = base
+        self.overlay = LicenseIndex()
+        self.search_lock = threading.Lock()
+        self._ngrams = None
+        self._sources = OrderedDict()
+        self._shadowed = None
+
+    def load(self, licenses):
+        self.overlay.load(licenses)
+        self._shadowed = None
+
+    def put(self, lic):
+        self.overlay.put(lic)
+        self._shadowed = None
+
+    def replace_records(self, licenses):
+        self.load(licenses)
+
+    def get(self, key):
+        lic = self.overlay.by_key.get(key)
+        return lic if lic is not None else self.base.get(key)
+
+    def get_many(self, keys):
+        found = {}
+        for key in keys:
+            lic = self.get(key)
+            if lic is not None:
+                found[key] = lic
+        return found
+
+    def for_device(self, device_id):
+        overlay = self.overlay.by_key
+        return [lic for lic in self.base.for_device(device_id) if lic.key not in overlay] + \
+            self.overlay.for_device(device_id)
+
+    def all(self):
+        return list(self.frozen())
+
+    def frozen(self):
+        return _merged_records(self.base, dict(self.overlay.by_key))
+
+    def revoked(self):
+        overlay = self.overlay.by_key
+        keys = [k for k in snapshot.KeyView(self.base, self.base.disabled) if k not in overlay]
+        return keys + list(self.overlay.disabled)
+
+    def legacy_history(self):
+        found = self.overlay.legacy_history()
+        if self.base.flags & snapshot.HAS_EXTRA:
+            overlay = self.overlay.by_key
+            found += [lic for lic in self.base
+                      if lic.extra and 'history' in lic.extra and lic.key not in overlay]
+        return found
+
+    def _shadowed_records(self):
+        # Snapshot versions of the licenses the overlay replaced.
+        if self._shadowed is None:
+            self._shadowed = [lic for lic in map(self.base.get, self.overlay.by_key) if lic is not None]
+        return self._shadowed
+
+    def status_counts(self, today):
+        t = today.toordinal()
+        expired = bisect.bisect_left(self.base.exp_ords, t)
+        counts = {
+            'Active': len(self.base.exp_ords) - expired,
+            'Expired': expired,
+            'Disabled': len(self.base.disabled),
+        }
+        for lic in self._shadowed_records():
+            counts[license_status(lic, t)] -= 1
+        for status, n in self.overlay.status_counts(today).items():
+            counts[status] += n
+        return counts
+
+    def expiring(self, start, end):
+        overlay = self.overlay.by_key
+        found = [lic for lic in map(self.base.record, self.base.expiring_range(start.toordinal(), end.toordinal()))
+                 if lic.key not in overlay]
+        found += self.overlay.expiring(start, end)
+        found.sort(key=_expiry_entry)
+        return found
+
+    def _base_source(self, q, status, today):
+        # Like LicenseIndex._search_source, as a sorted view of snapshot keys.
+        base = self.base
+        if len(q) < NgramIndex.N and status not in ('Disabled', 'Expired'):
+            return base.keys
+        if len(q) < NgramIndex.N and status == 'Disabled':
+            return snapshot.KeyView(base, base.disabled)
+        cache_key = (q, today) if len(q) < NgramIndex.N else (q,)
+        source = self._sources.get(cache_key)
+        if source is None:
+            if len(q) >= NgramIndex.N:
+                if self._ngrams is None:
+                    # Admin-only and built on first use, like LicenseIndex's.
+                    self._ngrams = NgramIndex()
+                    for i in range(len(base)):
+                        lic = base.record(i)
+                        self._ngrams.add(i, lic.key, lic.device_id)
+                indices = array('I', sorted(set(self._ngrams.candidates(q))))
+            else:
+                indices = array('I', sorted(base.exp_idx[:bisect.bisect_left(base.exp_ords, today)]))
+            source = self._sources[cache_key] = snapshot.KeyView(base, indices)
+            if len(self._sources) > 32:
+                self._sources.popitem(last=False)
+        return source
+
+    def search(self, q, status, today, after=None, before=None, limit=15):
+        # Pages the snapshot and the overlay separately and merges: each
+        # holds the first `limit` matches past the cursor on its side.
+        extra, extra_prev, extra_next = self.overlay.search(q, status, today, after, before, limit)
+        q = q.lower()
+        t = today.toordinal()
+        base, overlay = self.base, self.overlay.by_key
+
+        def match(key):
+            if key in overlay:
+                return False
+            lic = base.get(key)
+            return ((not q or q in key.lower() or q in lic.device_id.lower())
+                    and (not status or license_status(lic, t) == status))
+
+        with self.search_lock:
+            keys, has_prev, has_next = keyset_page(self._base_source(q, status, t), match, after, before, limit)
+        page = sorted([base.get(k) for k in keys] + extra, key=lambda lic: lic.key)
+        if before is not None:
+            return page[-limit:], has_prev or extra_prev or len(page) > limit, True
+        return page[:limit], after is not None, has_next or extra_next or len(page) > limit
+
+
+def _merged_records(base, overlay):
+    for lic in base:
+        if lic.key not in overlay:
+            yield lic
+    yield from overlay.values()
+
+
+class JsonStore(Store):
+    def __init__(self, data_dir, compact_bytes=8 * 1024 * 1024, fsync=True, snapshot=False):
+        self.data_dir = data_dir
+        self.licenses_file = os.path.join(data_dir, 'licenses.json')
+        # With `snapshot`, licenses are read from a mapped licenses.snap
+        # instead of being parsed into every process (see snapshot.py).
+        self.use_snapshot = snapshot
+        self.snapshot_file = os.path.join(data_dir, 'licenses.snap')
+        self.tools_file = os.path.join(data_dir, 'tools.json')
+        self.journal = Journal(os.path.join(data_dir, 'journal.ndjson'), fsync)
+        self.history = HistoryLog(os.path.join(data_dir, 'history.ndjson'), fsync)
+        self.lock = FileLock(os.path.join(data_dir, '.journal.lock'))
+        self.compact_bytes = compact_bytes
+        self.index = LicenseIndex()
+        self._tools = []
+        self._snapshot_sig = None
+        self._journal_ino = None
+        self._offset = 0
+        # Change feed: _seq is the last sequence number applied, _base_seq
+        # the one the snapshot files correspond to. Journal records after
+        # it are found through the parallel seq/offset arrays.
+        self._seq = 0
+        self._base_seq = 0
+        self._change_seqs = array('Q')
+        self._change_offsets = array('Q')
+        self._compacting = False
+        self.generations = {'licenses': 0, 'tools': 0}
+        self._tool_search = None
+        self.refresh()
+        self._migrate_history()
+
+    def _migrate_history(self):
+        # Data written before history moved out of the records: append the
+        # embedded lists to history.ndjson once, then compact so the
+        # snapshot no longer carries them.
+        with self.lock:
+            self._refresh_locked()
+            legacy = self.index.legacy_history()
+            if not legacy:
+                return
+            stripped, entries = split_history(legacy)
+            self.history.wait_durable(self.history.append(entries))
+            self.index.replace_records(stripped)
+            self.compact()
+
+    def _file_sig(self, path):
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return (st.st_ino, st.st_size, st.st_mtime_ns)
+
+    def _snapshot_signature(self):
+        return (self._file_sig(self.licenses_file), self._file_sig(self.tools_file))
+
+    def refresh(self):
+        if self._stale():
+            with self.lock:
+                self._refresh_locked()
+        return self
+
+    def _stale(self):
+        ino, size = self.journal.stat()
+        return (self._snapshot_signature() != self._snapshot_sig
+                or ino != self._journal_ino or size != self._offset)
+
+    def _refresh_locked(self):
+        ino, size = self.journal.stat()
+        if self._snapshot_signature() != self._snapshot_sig or ino != self._journal_ino or size < self._offset:
+            # New snapshot or new journal: start over from the files.
+            with metrics.time('storage_load_seconds', backend='json', source='snapshot'):
+                self._snapshot_sig = self._snapshot_signature()
+                if self.use_snapshot:
+                    self.index = SnapshotIndex(self._attach_snapshot())
+                else:
+                    self.index = LicenseIndex()
+                    self.index.load(load_json(self.licenses_file))
+                self._tools = load_json(self.tools_file)
+            metrics.inc('storage_load_bytes_total', sum(sig[1] for sig in self._snapshot_sig if sig),
+                        backend='json', source='snapshot')
+            self._journal_ino, self._offset = ino, 0
+            self._seq = self._base_seq = 0
+            self._change_seqs, self._change_offsets = array('Q'), array('Q')
+            self.generations['licenses'] += 1
+            self.generations['tools'] += 1
+        if size > self._offset:
+            start = self._offset
+            with metrics.time('storage_load_seconds', backend='json', source='journal'):
+                entries, self._offset = self.journal.read(self._offset)
+                for offset, record in entries:
+                    self._apply(record, offset)
+            metrics.inc('storage_load_bytes_total', self._offset - start, backend='json', source='journal')
+
+    def _attach_snapshot(self):
+        # Map licenses.snap, first (re)building it if it doesn't match
+        # licenses.json. Called under self.lock, so only one process builds.
+        sig = self._file_sig(self.licenses_file)
+        source = (sig[1], sig[2]) if sig else (0, 0)
+        try:
+            snap = snapshot.Snapshot(self.snapshot_file)
+            if snap.source_sig == source:
+                return snap
+        except (FileNotFoundError, ValueError):
+            pass
+        tmp = self.snapshot_file + '.%d.tmp' % os.getpid()
+        snapshot.write(tmp, load_json(self.licenses_file), source)
+        os.replace(tmp, self.snapshot_file)
+        return snapshot.Snapshot(self.snapshot_file)
+
+    def _apply(self, record, offset):
+        if record['op'] == 'seq':
+            # First record of a compacted journal.
+            self._base_seq = self._seq = record['seq']
+            return
+        if record['op'] == 'license':
+            self.index.put(License.from_dict(record['license']))
+            self.generations['licenses'] += 1
+        elif record['op'] == 'tools':
+            self._tools = record['tools']
+            self.generations['tools'] += 1
+        self._track_change(record, offset)
+
+    def _track_change(self, record, offset):
+        # Journals written before the change feed have no seq numbers.
+        seq = record.get('seq')
+        if seq is not None:
+            self._seq = seq
+            self._change_seqs.append(seq)
+            self._change_offsets.append(offset)
+
+    def _commit(self, records):
+        # Caller holds self.lock and has refreshed, so our offset is the
+        # journal's end and the append lands right after it.
+        for record in records:
+            self._seq += 1
+            record['seq'] = self._seq
+        with metrics.time('storage_save_seconds', backend='json', op='append'):
+            ticket, ino, sizes = self.journal.append(records)
+        metrics.inc('storage_save_bytes_total', sum(sizes), backend='json', op='append')
+        self._journal_ino = ino
+        for record, size in zip(records, sizes):
+            self._apply(record, self._offset)
+            self._offset += size
+        return ticket
+
+    def _finish(self, ticket):
+        with metrics.time('storage_save_seconds', backend='json', op='fsync'):
+            self.journal.wait_durable(ticket)
+        if self._offset >= self.compact_bytes and not self._compacting:
+            self._compacting = True
+            threading.Thread(target=self.compact, daemon=True).start()
+
+    def compact(self):
+        try:
+            with self.lock:
+                self._refresh_locked()
+                licenses = self.index.frozen()
+                tools = list(self._tools)
+                ino, start, seq = self._journal_ino, self._offset, self._seq
+            # Serializing the snapshot is the slow part; do it unlocked.
+            tmp = '.%d.tmp' % os.getpid()
+            with metrics.time('storage_save_seconds', backend='json', op='compact'):
+                licenses = list(licenses)
+                licenses_data = json.dumps([lic.to_dict() for lic in licenses], indent=2).encode()
+                tools_data = json.dumps(tools, indent=2).encode()
+                _write_durable(self.licenses_file + tmp, licenses_data)
+                _write_durable(self.tools_file + tmp, tools_data)
+                if self.use_snapshot:
+                    st = os.stat(self.licenses_file + tmp)
+                    snapshot.write(self.snapshot_file + tmp, licenses, (st.st_size, st.st_mtime_ns))
+            metrics.inc('storage_save_bytes_total', len(licenses_data) + len(tools_data), backend='json', op='compact')
+            with self.lock:
+                self._refresh_locked()
+                if self._journal_ino != ino:
+                    # Another process compacted first.
+                    os.unlink(self.licenses_file + tmp)
+                    os.unlink(self.tools_file + tmp)
+                    if self.use_snapshot:
+                        os.unlink(self.snapshot_file + tmp)
+                    return
+                # Carry over whatever was appended while we were writing,
+                # after a record saying which change the snapshot is at.
+                tail = (json.dumps({'op': 'seq', 'seq': seq}) + '\n').encode()
+                if ino is not None:
+                    with open(self.journal.path, 'rb') as f:
+                        f.seek(start)
+                        tail += f.read(self._offset - start)
+                _write_durable(self.journal.path + tmp, tail)
+                if self.use_snapshot:
+                    os.replace(self.snapshot_file + tmp, self.snapshot_file)
+                os.replace(self.tools_file + tmp, self.tools_file)
+                os.replace(self.licenses_file + tmp, self.licenses_file)
+                os.replace(self.journal.path + tmp, self.journal.path)
+                _fsync_dir(self.data_dir)
+                if self.use_snapshot:
+                    # Remapping is cheap and drops the overlay we folded in.
+                    self._snapshot_sig = None
+                    self._refresh_locked()
+                else:
+                    # Our records are current; only the change feed's
+                    # offsets need to point into the new journal.
+                    self._snapshot_sig = self._snapshot_signature()
+                    self._journal_ino, self._offset = self.journal.stat()
+                    self._base_seq = seq
+                    self._change_seqs, self._change_offsets = array('Q'), array('Q')
+                    for offset, record in self.journal.read(0)[0]:
+                        if record['op'] != 'seq':
+                            self._track_change(record, offset)
+        finally:
+            self._compacting = False
+
+    def generation(self, kind):
+        return self.refresh().generations[kind]
+
+    # --- licenses ---
+    def get_license(self, key):
+        return self.refresh().index.get(key)
+
+    def get_licenses(self, keys):
+        return self.refresh().index.get_many(keys)
+
+    def licenses(self):
+        return self.refresh().index.all()
+
+    def licenses_for_device(self, device_id):
+        return self.refresh().index.for_device(device_id)
+
+    def revoked_keys(self):
+        return self.refresh().index.revoked()
+
+    def status_counts(self, today):
+        return self.refresh().index.status_counts(today)
+
+    def expiring(self, start, end):
+        return self.refresh().index.expiring(start, end)
+
+    def search_licenses(self, q, status, today, after=None, before=None, limit=15):
+        return self.refresh().index.search(q, status, today, after, before, limit)
+
+    def add_licenses(self, licenses):
+        licenses, entries = split_history(licenses)
+        with self.lock:
+            self._refresh_locked()
+            # Events first: a crash in between leaves an event for a change
+            # that never landed, never a change without its event.
+            history_ticket = self.history.append(entries) if entries else None
+            ticket = self._commit([{'op': 'license', 'license': lic.to_dict()} for lic in licenses])
+        if history_ticket:
+            self.history.wait_durable(history_ticket)
+        self._finish(ticket)
+
+    def update_license(self, key, changes, event=None):
+        with self.lock:
+            self._refresh_locked()
+            lic = self.index.get(key)
+            if lic is None:
+                return None
+            lic = lic.replace(**changes)
+            history_ticket = self.history.append([dict(event, key=key)]) if event else None
+            ticket = self._commit([{'op': 'license', 'license': lic.to_dict()}])
+        if history_ticket:
+            self.history.wait_durable(history_ticket)
+        self._finish(ticket)
+        return lic
+
+    def claim_license(self, key, device_id, event):
+        with self.lock:
+            self._refresh_locked()
+            lic = self.index.get(key)
+            if lic is None or lic.device_id != '' or not lic.active:
+                return lic
+            lic = lic.replace(device_id=device_id)
+            history_ticket = self.history.append([dict(event, key=key)])
+            ticket = self._commit([{'op': 'license', 'license': lic.to_dict()}])
+        self.history.wait_durable(history_ticket)
+        self._finish(ticket)
+        return lic
+
+    def update_licenses(self, filters, changes, event, today):
+        match = license_filter(filters, today.toordinal())
+        with self.lock:
+            self._refresh_locked()
+            if filters.get('keys') is not None:
+                candidates = self.index.get_many(filters['keys']).values()
+            else:
+                candidates = self.index.frozen()
+            updated = [lic.replace(**changes) for lic in candidates if match(lic)]
+            if not updated:
+                return 0
+            history_ticket = self.history.append([dict(event, key=lic.key) for lic in updated]) if event else None
+            ticket = self._commit([{'op': 'license', 'license': lic.to_dict()} for lic in updated])
+        if history_ticket:
+            self.history.wait_durable(history_ticket)
+        self._finish(ticket)
+        return len(updated)
+
+    # --- history ---
+    def license_history(self, key, offset=0, limit=50):
+        return self.history.events(key, offset, limit)
+
+    def history_entries(self):
+        return self.history.entries()
+
+    def add_history(self, entries):
+        with self.lock:
+            ticket = self.history.append(entries)
+        self.history.wait_durable(ticket)
+
+    # --- change feed ---
+    def changes(self, since, limit=1000):
+        while True:
+            self.refresh()
+            seqs, offsets = self._change_seqs, self._change_offsets
+            ino, end, current = self._journal_ino, self._offset, self._seq
+            if since < 0 or since < self._base_seq or since > current:
+                return [], current, True
+            i = bisect.bisect_right(seqs, since)
+            if i == len(seqs):
+                return [], current, False
+            try:
+                with open(self.journal.path, 'rb') as f:
+                    if os.fstat(f.fileno()).st_ino == ino:
+                        f.seek(offsets[i])
+                        lines = f.read(end - offsets[i]).splitlines()
+                        break
+            except FileNotFoundError:
+                pass
+            # Compacted under us: look again in the new journal.
+        changes = []
+        for line in lines:
+            record = json.loads(line)
+            if record.get('seq') is None or record['op'] == 'seq':
+                continue
+            kind = record['op']
+            changes.append({'seq': record['seq'], 'type': kind, kind: record[kind]})
+            if len(changes) == limit:
+                return changes, changes[-1]['seq'], False
+        return changes, current, False
+
+    def state(self):
+        with self.lock:
+            self._refresh_locked()
+            return self._seq, self.index.frozen(), list(self._tools)
+
+    # --- tools ---
+    def tools(self):
+        return list(self.refresh()._tools)
+
+    def get_tool(self, name):
+        name = name.lower()
+        return next((t for t in self.tools() if t['name'].lower() == name), None)
+
+    def search_tools(self, q):
+        # The tool list is replaced (never mutated) on every change, so the
+        # trigram index is rebuilt whenever the list object differs.
+        tools = self.refresh()._tools
+        q = q.lower()
+        if not q:
+            return list(tools)
+        if len(q) >= NgramIndex.N:
+            cached = self._tool_search
+            if cached is None or cached[0] is not tools:
+                ngrams = NgramIndex()
+                for i, t in enumerate(tools):
+                    ngrams.add(i, t['name'], t['version'])
+                cached = self._tool_search = (tools, ngrams)
+            tools = [tools[i] for i in sorted(set(cached[1].candidates(q)))]
+        return [t for t in tools if q in t['name'].lower() or q in t['version'].lower()]
+
+    def _save_tools(self, tools):
+        ticket = self._commit([{'op': 'tools', 'tools': tools}])
+        self._finish(ticket)
+
+    def add_tool(self, tool):
+        with self.lock:
+            self._refresh_locked()
+            if any(t['name'].lower() == tool['name'].lower() for t in self._tools):
+                return False
+            self._save_tools(self._tools + [tool])
+        return True
+
+    def update_tool(self, name, changes):
+        with self.lock:
+            self._refresh_locked()
+            idx = next((i for i, t in enumerate(self._tools) if t['name'] == name), None)
+            if idx is None:
+                return False
+            tools = list(self._tools)
+            tools[idx] = {k: v for k, v in dict(tools[idx], **changes).items() if v is not None}
+            self._save_tools(tools)
+        return True
+
+    def delete_tool(self, name):
+        with self.lock:
+            self._refresh_locked()
+            tools = [t for t in self._tools if t['name'] != name]
+            if len(tools) == len(self._tools):
+                return False
+            self._save_tools(tools)
+        return True
+
+    def replace_tools(self, tools):
+        with self.lock:
+            self._refresh_locked()
+            self._save_tools(list(tools))
+
+
+def _write_durable(path, data):
+    with open(path, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+
+def _fsync_dir(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+# ====== SQLite Store ======
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS licenses (
+    key TEXT PRIMARY KEY,
+    device_id TEXT NOT NULL,
+    version TEXT NOT NULL,
+    expiry TEXT NOT NULL,
+    active INTEGER NOT NULL DEFAULT 1,
+    created TEXT,
+    seq INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS licenses_device ON licenses(device_id);
+CREATE INDEX IF NOT EXISTS licenses_expiry ON licenses(expiry);
+CREATE INDEX IF NOT EXISTS licenses_active ON licenses(active, expiry);
+CREATE TABLE IF NOT EXISTS tools (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT NOT NULL,
+    version TEXT NOT NULL,
+    download_url TEXT NOT NULL,
+    update_required INTEGER NOT NULL DEFAULT 0,
+    sha256 TEXT,
+    size INTEGER,
+    filename TEXT
+);
+CREATE INDEX IF NOT EXISTS tools_name ON tools(name COLLATE NOCASE);
+
+-- License history, append-only; id gives the order.
+CREATE TABLE IF NOT EXISTS license_events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    key TEXT NOT NULL,
+    event TEXT NOT NULL,
+    date TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS license_events_key ON license_events(key, id);
+
+-- Bumped by every write, see SqliteStore.generation(). 'seq' is the last
+-- change feed number handed out and 'tools_seq' the tools list's.
+CREATE TABLE IF NOT EXISTS generations (
+    name TEXT PRIMARY KEY,
+    n INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO generations (name, n) VALUES ('licenses', 0), ('tools', 0), ('seq', 0), ('tools_seq', 0);
+
+-- Licenses per (active, expiry), kept current by triggers. Status counts
+-- sum over distinct expiry dates instead of scanning licenses.
+CREATE TABLE IF NOT EXISTS license_counts (
+    active INTEGER NOT NULL,
+    expiry TEXT NOT NULL,
+    n INTEGER NOT NULL,
+    PRIMARY KEY (active, expiry)
+);
+CREATE TRIGGER IF NOT EXISTS licenses_count_insert AFTER INSERT ON licenses BEGIN
+    INSERT INTO license_counts (active, expiry, n) VALUES (NEW.active, NEW.expiry, 1)
+        ON CONFLICT (active, expiry) DO UPDATE SET n = n + 1;
+END;
+CREATE TRIGGER IF NOT EXISTS licenses_count_delete AFTER DELETE ON licenses BEGIN
+    UPDATE license_counts SET n = n - 1 WHERE active = OLD.active AND expiry = OLD.expiry;
+END;
+CREATE TRIGGER IF NOT EXISTS licenses_count_update AFTER UPDATE OF active, expiry ON licenses BEGIN
+    UPDATE license_counts SET n = n - 1 WHERE active = OLD.active AND expiry = OLD.expiry;
+    INSERT INTO license_counts (active, expiry, n) VALUES (NEW.active, NEW.expiry, 1)
+        ON CONFLICT (active, expiry) DO UPDATE SET n = n + 1;
+END;
+"""
+
+# Trigram full-text index over key/device_id for the admin search. Needs
+# SQLite's FTS5 (3.34+); without it search falls back to LIKE scans.
+SEARCH_SCHEMA = """
+CREATE VIRTUAL TABLE license_search USING fts5(
+    key, device_id, content='licenses', content_rowid='rowid', tokenize='trigram'
+);
+CREATE TRIGGER license_search_insert AFTER INSERT ON licenses BEGIN
+    INSERT INTO license_search (rowid, key, device_id) VALUES (NEW.rowid, NEW.key, NEW.device_id);
+END;
+CREATE TRIGGER license_search_delete AFTER DELETE ON licenses BEGIN
+    INSERT INTO license_search (license_search, rowid, key, device_id) VALUES ('delete', OLD.rowid, OLD.key, OLD.device_id);
+END;
+CREATE TRIGGER license_search_update AFTER UPDATE OF key, device_id ON licenses BEGIN
+    INSERT INTO license_search (license_search, rowid, key, device_id) VALUES ('delete', OLD.rowid, OLD.key, OLD.device_id);
+    INSERT INTO license_search (rowid, key, device_id) VALUES (NEW.rowid, NEW.key, NEW.device_id);
+END;
+INSERT INTO license_search (license_search) VALUES ('rebuild');
+"""
+
+LICENSE_COLUMNS = ('key', 'device_id', 'version', 'expiry', 'active', 'created')
+TOOL_COLUMNS = ('name', 'version', 'download_url', 'update_required') + ARTIFACT_FIELDS
+TOOL_PLACEHOLDERS = ','.join('?' * len(TOOL_COLUMNS))
+
+
+def _license_row(lic):
+    return (lic.key, lic.device_id, lic.version, lic.expiry, lic.flags & ACTIVE, lic.created)
+
+def _license_from_row(row):
+    return License.from_dict(dict(zip(LICENSE_COLUMNS, row)))
+
+def _like_pattern(q):
+    return '%' + q.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+
+def _tool_row(tool):
+    return (tool['name'], tool['version'], tool['download_url'], int(bool(tool.get('update_required')))) + \
+        tuple(tool.get(f) for f in ARTIFACT_FIELDS)
+
+def _tool_from_row(row):
+    tool = {k: v for k, v in zip(TOOL_COLUMNS, row) if v is not None or k not in ARTIFACT_FIELDS}
+    tool['update_required'] = bool(tool['update_required'])
+    return tool
+
+
+class SqliteStore(Store):
+    # One connection per thread (and per process, so forked gunicorn
+    # workers never share a handle). WAL lets readers run alongside the
+    # single writer, and every mutation touches only the rows involved.
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        fresh = not os.path.exists(path)
+        db = self._db()
+        had_counts = db.execute("SELECT 1 FROM sqlite_master WHERE name = 'license_counts'").fetchone()
+        db.executescript(SCHEMA)
+        if not had_counts:
+            # Databases created before the counters existed.
+            with self._write() as conn:
+                conn.execute('DELETE FROM license_counts')
+                conn.execute('INSERT INTO license_counts SELECT active, expiry, COUNT(*) FROM licenses GROUP BY active, expiry')
+        columns = {r[1] for r in db.execute('PRAGMA table_info(licenses)')}
+        if 'history' in columns:
+            self._migrate_history()
+        if 'seq' not in columns:
+            # Databases from before the change feed; their rows are only
+            # reachable through state() until they next change.
+            db.execute('ALTER TABLE licenses ADD COLUMN seq INTEGER NOT NULL DEFAULT 0')
+        db.execute('CREATE INDEX IF NOT EXISTS licenses_seq ON licenses(seq)')
+        tool_columns = {r[1] for r in db.execute('PRAGMA table_info(tools)')}
+        for column, kind in zip(ARTIFACT_FIELDS, ('TEXT', 'INTEGER', 'TEXT')):
+            if column not in tool_columns:
+                db.execute('ALTER TABLE tools ADD COLUMN %s %s' % (column, kind))
+        self.fts = bool(db.execute("SELECT 1 FROM sqlite_master WHERE name = 'license_search'").fetchone())
+        if not self.fts:
+            try:
+                db.executescript('BEGIN IMMEDIATE;' + SEARCH_SCHEMA + 'COMMIT;')
+                self.fts = True
+            except sqlite3.OperationalError:
+                if db.in_transaction:
+                    db.execute('ROLLBACK')
+        self.created = fresh
+
+    def _migrate_history(self):
+        # Databases from before license_events: move the JSON history column
+        # into it, then drop the column (SQLite 3.35+; older versions keep
+        # it, emptied).
+        with self._write() as conn:
+            conn.execute(
+                "INSERT INTO license_events (key, event, date) "
+                "SELECT l.key, json_extract(e.value, '$.event'), json_extract(e.value, '$.date') "
+                "FROM licenses l, json_each(l.history) e WHERE l.history != '[]' ORDER BY l.rowid, e.key")
+            conn.execute("UPDATE licenses SET history = '[]' WHERE history != '[]'")
+        try:
+            self._db().execute('ALTER TABLE licenses DROP COLUMN history')
+        except sqlite3.OperationalError:
+            pass
+
+    def _db(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _write(self, *bumps):
+        return _Transaction(self._db(), bumps)
+
+    def generation(self, kind):
+        return self._db().execute('SELECT n FROM generations WHERE name = ?', (kind,)).fetchone()[0]
+
+    # --- licenses ---
+    def get_license(self, key):
+        row = self._db().execute('SELECT %s FROM licenses WHERE key = ?' % ','.join(LICENSE_COLUMNS), (key,)).fetchone()
+        return _license_from_row(row) if row else None
+
+    def get_licenses(self, keys):
+        keys = list(set(k for k in keys if k is not None))
+        found = {}
+        for i in range(0, len(keys), 500):
+            chunk = keys[i:i + 500]
+            rows = self._db().execute('SELECT %s FROM licenses WHERE key IN (%s)' % (','.join(LICENSE_COLUMNS), ','.join('?' * len(chunk))), chunk).fetchall()
+            for row in rows:
+                found[row[0]] = _license_from_row(row)
+        return found
+
+    def licenses(self):
+        rows = self._db().execute('SELECT %s FROM licenses ORDER BY rowid' % ','.join(LICENSE_COLUMNS)).fetchall()
+        return [_license_from_row(r) for r in rows]
+
+    def licenses_for_device(self, device_id):
+        rows = self._db().execute('SELECT %s FROM licenses WHERE device_id = ?' % ','.join(LICENSE_COLUMNS), (device_id,)).fetchall()
+        return [_license_from_row(r) for r in rows]
+
+    def revoked_keys(self):
+        return [r[0] for r in self._db().execute('SELECT key FROM licenses WHERE active = 0')]
+
+    def status_counts(self, today):
+        rows = self._db().execute(
+            'SELECT active, expiry < ?, SUM(n) FROM license_counts GROUP BY 1, 2', (today.isoformat(),)).fetchall()
+        counts = {'Active': 0, 'Expired': 0, 'Disabled': 0}
+        for active, expired, n in rows:
+            counts['Disabled' if not active else 'Expired' if expired else 'Active'] += n
+        return counts
+
+    def expiring(self, start, end):
+        rows = self._db().execute(
+            'SELECT %s FROM licenses WHERE active = 1 AND expiry BETWEEN ? AND ? ORDER BY expiry, key' % ','.join(LICENSE_COLUMNS),
+            (start.isoformat(), end.isoformat())).fetchall()
+        return [_license_from_row(r) for r in rows]
+
+    def search_licenses(self, q, status, today, after=None, before=None, limit=15):
+        where, params = [], []
+        if q and self.fts and len(q) >= 3:
+            where.append('rowid IN (SELECT rowid FROM license_search WHERE license_search MATCH ?)')
+            params.append('"%s"' % q.replace('"', '""'))
+        elif q:
+            pattern = _like_pattern(q)
+            where.append("(key LIKE ? ESCAPE '\\' OR device_id LIKE ? ESCAPE '\\')")
+            params += [pattern, pattern]
+        if status == 'Disabled':
+            where.append('active = 0')
+        elif status == 'Expired':
+            where.append('active = 1 AND expiry < ?')
+            params.append(today.isoformat())
+        elif status == 'Active':
+            where.append('active = 1 AND expiry >= ?')
+            params.append(today.isoformat())
+        elif status:
+            return [], False, False
+        if before is not None:
+            where.append('key < ?')
+            params.append(before)
+            order = 'DESC'
+        else:
+            if after is not None:
+                where.append('key > ?')
+                params.append(after)
+            order = 'ASC'
+        rows = self._db().execute(
+            'SELECT %s FROM licenses WHERE %s ORDER BY key %s LIMIT ?'
+            % (','.join(LICENSE_COLUMNS), ' AND '.join(where) or '1', order), params + [limit + 1]).fetchall()
+        page = [_license_from_row(r) for r in rows[:limit]]
+        if before is not None:
+            page.reverse()
+            return page, len(rows) > limit, True
+        return page, after is not None, len(rows) > limit
+
+    def add_licenses(self, licenses):
+        # An upsert rather than INSERT OR REPLACE, so the count triggers see
+        # a replaced license as an update.
+        licenses, entries = split_history(licenses)
+        with self._write('licenses') as conn:
+            seq = _next_seq(conn, len(licenses))
+            conn.executemany(
+                'INSERT INTO licenses (%s, seq) VALUES (?,?,?,?,?,?,?) ON CONFLICT (key) DO UPDATE SET %s'
+                % (','.join(LICENSE_COLUMNS), ', '.join('%s = excluded.%s' % (c, c) for c in LICENSE_COLUMNS[1:] + ('seq',))),
+                (_license_row(l) + (seq + i,) for i, l in enumerate(licenses)))
+            _insert_events(conn, entries)
+
+    def update_license(self, key, changes, event=None):
+        with self._write('licenses') as conn:
+            row = conn.execute('SELECT %s FROM licenses WHERE key = ?' % ','.join(LICENSE_COLUMNS), (key,)).fetchone()
+            if not row:
+                return None
+            lic = _license_from_row(row).replace(**changes)
+            conn.execute('UPDATE licenses SET device_id=?, version=?, expiry=?, active=?, created=?, seq=? WHERE key=?',
+                         _license_row(lic)[1:] + (_next_seq(conn), key))
+            if event:
+                _insert_events(conn, [dict(event, key=key)])
+        return lic
+
+    def claim_license(self, key, device_id, event):
+        # Under BEGIN IMMEDIATE, so the check and the update are one step.
+        with self._write('licenses') as conn:
+            row = conn.execute('SELECT %s FROM licenses WHERE key = ?' % ','.join(LICENSE_COLUMNS), (key,)).fetchone()
+            if not row:
+                return None
+            lic = _license_from_row(row)
+            if lic.device_id != '' or not lic.active:
+                return lic
+            conn.execute("UPDATE licenses SET device_id = ?, seq = ? WHERE key = ? AND device_id = ''",
+                         (device_id, _next_seq(conn), key))
+            _insert_events(conn, [dict(event, key=key)])
+        return lic.replace(device_id=device_id)
+
+    def update_licenses(self, filters, changes, event, today):
+        where, params = [], []
+        if filters.get('keys') is not None:
+            where.append('key IN (SELECT value FROM json_each(?))')
+            params.append(json.dumps(list(filters['keys'])))
+        if filters.get('version') is not None:
+            where.append('version = ?')
+            params.append(filters['version'])
+        status = filters.get('status')
+        if status == 'Disabled':
+            where.append('active = 0')
+        elif status == 'Expired':
+            where.append('active = 1 AND expiry < ?')
+            params.append(today.isoformat())
+        elif status == 'Active':
+            where.append('active = 1 AND expiry >= ?')
+            params.append(today.isoformat())
+        elif status is not None:
+            return 0
+        if filters.get('device_prefix') is not None:
+            where.append('substr(device_id, 1, ?) = ?')
+            params += [len(filters['device_prefix']), filters['device_prefix']]
+        if filters.get('expiry_from'):
+            where.append('expiry >= ?')
+            params.append(filters['expiry_from'])
+        if filters.get('expiry_to'):
+            where.append('expiry <= ?')
+            params.append(filters['expiry_to'])
+        with self._write('licenses') as conn:
+            rows = conn.execute('SELECT %s FROM licenses WHERE %s' % (','.join(LICENSE_COLUMNS), ' AND '.join(where) or '1'),
+                                params).fetchall()
+            if not rows:
+                return 0
+            updated = [_license_from_row(row).replace(**changes) for row in rows]
+            seq = _next_seq(conn, len(updated))
+            conn.executemany('UPDATE licenses SET device_id=?, version=?, expiry=?, active=?, created=?, seq=? WHERE key=?',
+                             (_license_row(lic)[1:] + (seq + i, lic.key) for i, lic in enumerate(updated)))
+            if event:
+                _insert_events(conn, [dict(event, key=lic.key) for lic in updated])
+        return len(updated)
+
+    # --- history ---
+    def license_history(self, key, offset=0, limit=50):
+        db = self._db()
+        total = db.execute('SELECT COUNT(*) FROM license_events WHERE key = ?', (key,)).fetchone()[0]
+        rows = db.execute('SELECT event, date FROM license_events WHERE key = ? ORDER BY id LIMIT ? OFFSET ?',
+                          (key, limit, offset)).fetchall()
+        return [{'event': event, 'date': day} for event, day in rows], total
+
+    def history_entries(self):
+        for key, event, day in self._db().execute('SELECT key, event, date FROM license_events ORDER BY id'):
+            yield {'key': key, 'event': event, 'date': day}
+
+    def add_history(self, entries):
+        with self._write() as conn:
+            _insert_events(conn, entries)
+
+    # --- change feed ---
+    def changes(self, since, limit=1000):
+        db = self._db()
+        # One read transaction, so the rows and the counters agree.
+        db.execute('BEGIN')
+        try:
+            current, tools_seq = (db.execute("SELECT n FROM generations WHERE name = ?", (name,)).fetchone()[0]
+                                  for name in ('seq', 'tools_seq'))
+            if since < 0 or since > current:
+                return [], current, True
+            rows = db.execute('SELECT %s, seq FROM licenses WHERE seq > ? ORDER BY seq LIMIT ?'
+                              % ','.join(LICENSE_COLUMNS), (since, limit)).fetchall()
+            tools = self.tools() if tools_seq > since else None
+        finally:
+            db.execute('COMMIT')
+        changes = [{'seq': row[-1], 'type': 'license', 'license': _license_from_row(row[:-1]).to_dict()}
+                   for row in rows]
+        if tools is not None:
+            changes.append({'seq': tools_seq, 'type': 'tools', 'tools': tools})
+            changes.sort(key=lambda c: c['seq'])
+            del changes[limit:]
+        if len(changes) == limit:
+            return changes, changes[-1]['seq'], False
+        return changes, current, False
+
+    def state(self):
+        # A connection of its own: the caller streams the licenses after
+        # returning, and the read transaction has to stay open until then.
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.execute('BEGIN')
+        seq = conn.execute("SELECT n FROM generations WHERE name = 'seq'").fetchone()[0]
+        tools = [_tool_from_row(r) for r in conn.execute('SELECT %s FROM tools ORDER BY id' % ','.join(TOOL_COLUMNS))]
+
+        def licenses():
+            try:
+                for row in conn.execute('SELECT %s FROM licenses ORDER BY key' % ','.join(LICENSE_COLUMNS)):
+                    yield _license_from_row(row)
+            finally:
+                conn.close()
+        return seq, licenses(), tools
+
+    # --- tools ---
+    def tools(self):
+        rows = self._db().execute('SELECT %s FROM tools ORDER BY id' % ','.join(TOOL_COLUMNS)).fetchall()
+        return [_tool_from_row(r) for r in rows]
+
+    def get_tool(self, name):
+        row = self._db().execute('SELECT %s FROM tools WHERE name = ? COLLATE NOCASE ORDER BY id' % ','.join(TOOL_COLUMNS), (name,)).fetchone()
+        return _tool_from_row(row) if row else None
+
+    def search_tools(self, q):
+        if not q:
+            return self.tools()
+        pattern = _like_pattern(q)
+        rows = self._db().execute(
+            "SELECT %s FROM tools WHERE name LIKE ? ESCAPE '\\' OR version LIKE ? ESCAPE '\\' ORDER BY id"
+            % ','.join(TOOL_COLUMNS), (pattern, pattern)).fetchall()
+        return [_tool_from_row(r) for r in rows]
+
+    def add_tool(self, tool):
+        with self._write('tools') as conn:
+            if conn.execute('SELECT 1 FROM tools WHERE name = ? COLLATE NOCASE', (tool['name'],)).fetchone():
+                return False
+            conn.execute('INSERT INTO tools (%s) VALUES (%s)' % (','.join(TOOL_COLUMNS), TOOL_PLACEHOLDERS), _tool_row(tool))
+            _tools_changed(conn)
+        return True
+
+    def update_tool(self, name, changes):
+        with self._write('tools') as conn:
+            row = conn.execute('SELECT id, %s FROM tools WHERE name = ? ORDER BY id' % ','.join(TOOL_COLUMNS), (name,)).fetchone()
+            if not row:
+                return False
+            tool = _tool_from_row(row[1:])
+            tool.update(changes)
+            conn.execute('UPDATE tools SET %s WHERE id=?' % ', '.join('%s=?' % c for c in TOOL_COLUMNS),
+                         _tool_row(tool) + (row[0],))
+            _tools_changed(conn)
+        return True
+
+    def delete_tool(self, name):
+        with self._write('tools') as conn:
+            if not conn.execute('DELETE FROM tools WHERE name = ?', (name,)).rowcount:
+                return False
+            _tools_changed(conn)
+        return True
+
+    def replace_tools(self, tools):
+        with self._write('tools') as conn:
+            conn.execute('DELETE FROM tools')
+            conn.executemany('INSERT INTO tools (%s) VALUES (%s)' % (','.join(TOOL_COLUMNS), TOOL_PLACEHOLDERS),
+                             (_tool_row(t) for t in tools))
+            _tools_changed(conn)
+
+
+def _next_seq(conn, n=1):
+    # Reserves n change feed numbers inside a write transaction; returns
+    # the first.
+    conn.execute("UPDATE generations SET n = n + ? WHERE name = 'seq'", (n,))
+    return conn.execute("SELECT n FROM generations WHERE name = 'seq'").fetchone()[0] - n + 1
+
+def _tools_changed(conn):
+    conn.execute("UPDATE generations SET n = ? WHERE name = 'tools_seq'", (_next_seq(conn),))
+
+def _insert_events(conn, entries):
+    conn.executemany('INSERT INTO license_events (key, event, date) VALUES (?, ?, ?)',
+                     ((e['key'], e['event'], e['date']) for e in entries))
+
+
+class _Transaction:
+    # BEGIN IMMEDIATE takes the write lock up front, so a read-modify-write
+    # inside one `with` block can't interleave with another worker's write.
+    # `bumps` names the generation counters the write invalidates.
+    def __init__(self, conn, bumps=()):
+        self.conn = conn
+        self.bumps = bumps
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        self.conn.execute('BEGIN IMMEDIATE')
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type:
+            self.conn.execute('ROLLBACK')
+            return
+        for name in self.bumps:
+            self.conn.execute('UPDATE generations SET n = n + 1 WHERE name = ?', (name,))
+        self.conn.execute('COMMIT')
+        metrics.observe('storage_save_seconds', time.perf_counter() - self.start, backend='sqlite', op='commit')
+
+
+# ====== Migration ======
+def migrate_json_to_sqlite(data_dir, store):
+    # Goes through JsonStore so journaled changes are included.
+    source = JsonStore(data_dir)
+    licenses = source.licenses()
+    tools = source.tools()
+    store.add_licenses(licenses)
+    store.add_history(list(source.history_entries()))
+    for tool in tools:
+        store.add_tool(tool)
+    return len(licenses), len(tools)
+
+
+def open_store(backend, data_dir, **options):
+    os.makedirs(data_dir, exist_ok=True)
+    if backend == 'json':
+        return JsonStore(data_dir, **options)
+    if backend == 'sqlite':
+        store = SqliteStore(os.path.join(data_dir, 'licenses.db'))
+        # First start on SQLite: pull in whatever the JSON files hold.
+        if store.created:
+            migrate_json_to_sqlite(data_dir, store)
+        return store
+    raise ValueError(f"Unknown storage backend: {backend}")
+
+
+if __name__ == "__main__":
+    # python storage.py migrate [data_dir]
+    if len(sys.argv) < 2 or sys.argv[1] != 'migrate':
+        sys.exit("usage: python storage.py migrate [data_dir]")
+    data_dir = sys.argv[2] if len(sys.argv) > 2 else 'data'
+    store = SqliteStore(os.path.join(data_dir, 'licenses.db'))
+    n_lic, n_tools = migrate_json_to_sqlite(data_dir, store)
+    print(f"Migrated {n_lic} licenses and {n_tools} tools into {store.path}")
@@ -0,0 +1,127 @@
+import os
+import sys
+import time
+import threading
+from datetime import date
+
+import pytest
+from werkzeug.serving import make_server
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import expiry
+import storage
+import artifacts
+import ratelimit
+import revocations
+
+# The store options each backend is tested with; 'snapshot' is the JSON
+# store with LICENSE_SNAPSHOT=1.
+BACKENDS = {
+    'json': ('json', {'fsync': False}),
+    'snapshot': ('json', {'fsync': False, 'snapshot': True}),
+    'sqlite': ('sqlite', {}),
+}
+
+
+def open_store(backend, data_dir, **options):
+    kind, defaults = BACKENDS[backend]
+    return storage.open_store(kind, str(data_dir), **dict(defaults, **options))
+
+
+def make_license(key, device_id='dev', version='1', expiry='2030-01-01', active=True):
+    return {'key': key, 'device_id': device_id, 'version': version, 'expiry': expiry, 'active': active,
+            'created': '2025-01-01', 'history': [{'event': 'Created', 'date': '2025-01-01'}]}
+
+
+TOOL = {'name': 'tool', 'version': '1.0', 'download_url': 'https://example.com/tool-1.0.zip', 'update_required': False}
+
+
+def dump(store):
+    return sorted((lic.to_dict() for lic in store.licenses()), key=lambda d: d['key'])
+
+
+def at(day, hour=12, minute=0, second=0):
+    # Unix time of a local wall-clock moment, as app.Clock sees it.
+    return time.mktime((day.year, day.month, day.day, hour, minute, second, 0, 0, -1))
+
+
+@pytest.fixture(params=sorted(BACKENDS))
+def backend(request):
+    return request.param
+
+
+@pytest.fixture(params=['json', 'snapshot'])
+def json_backend(request):
+    return request.param
+
+
+@pytest.fixture
+def store(backend, tmp_path):
+    return open_store(backend, tmp_path / 'primary')
+
+
+@pytest.fixture(scope='session')
+def core(tmp_path_factory):
+    # app.py reads its configuration at import, so set it up first: no rate
+    # limits or load shedding, no background sweeper. Tests swap in their own store and clock.
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setenv('DATA_DIR', str(tmp_path_factory.mktemp('app')))
+        mp.setenv('STORAGE_BACKEND', 'json')
+        mp.setenv('JOURNAL_FSYNC', '0')
+        mp.setenv('EXPIRY_SWEEP_SECONDS', '0')
+        mp.setenv('API_CONCURRENCY_MAX', '0')
+        mp.setenv('TOKEN_SECRET', 'test-token-secret')
+        mp.delenv('REPLICA_OF', raising=False)
+        for name in ('RATE_LIMIT_KEY', 'RATE_LIMIT_DEVICE', 'RATE_LIMIT_CLIENT'):
+            mp.setenv(name, '0')
+        import app
+    return app
+
+
+class FakeTime:
+    def __init__(self, t):
+        self.t = t
+
+    def __call__(self):
+        return self.t
+
+
+def set_time(app_module, t):
+    app_module.clock.now.t = t
+
+
+@pytest.fixture
+def app_module(core, store, tmp_path, monkeypatch):
+    # Everything app.py builds on DATA_DIR or the store, built again on
+    # this test's: caches keyed by store generation would otherwise carry
+    # over from another test's store.
+    data_dir = str(tmp_path / 'app')
+    os.makedirs(data_dir)
+    clock = core.Clock(FakeTime(at(date(2025, 1, 15))))
+    monkeypatch.setattr(core, 'store', store)
+    monkeypatch.setattr(core, 'clock', clock)
+    monkeypatch.setattr(core, 'tool_catalog', core.ToolCatalog())
+    monkeypatch.setattr(core, 'fragment_cache', core.FragmentCache())
+    monkeypatch.setattr(core, 'revocation_list', revocations.RevocationList(store))
+    monkeypatch.setattr(core, 'limiter', ratelimit.SharedLimiter(os.path.join(data_dir, 'ratelimit.bin')))
+    monkeypatch.setattr(core, 'artifact_store', artifacts.ArtifactStore(os.path.join(data_dir, 'artifacts')))
+    monkeypatch.setattr(core, 'expiry_sweeper', expiry.ExpirySweeper(store, data_dir, clock))
+    return core
+
+
+@pytest.fixture
+def client(app_module):
+    return app_module.app.test_client()
+
+
+@pytest.fixture
+def server(app_module):
+    # The app on a real socket, for replica.Follower.
+    httpd = make_server('127.0.0.1', 0, app_module.app, threaded=True)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield 'http://127.0.0.1:%d' % httpd.server_port
+    httpd.shutdown()
+    thread.join()
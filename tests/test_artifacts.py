@@ -0,0 +1,124 @@
+import io
+import os
+import time
+import hashlib
+
+import pytest
+
+import artifacts
+
+DATA = bytes(range(256)) * 40
+SHA = hashlib.sha256(DATA).hexdigest()
+
+
+# ====== ArtifactStore ======
+def test_save_stores_by_content(tmp_path):
+    store = artifacts.ArtifactStore(str(tmp_path))
+    assert store.save(io.BytesIO(DATA)) == (SHA, len(DATA))
+    assert store.save(io.BytesIO(DATA)) == (SHA, len(DATA))
+    assert os.listdir(tmp_path) == [SHA]
+    assert open(store.path(SHA), 'rb').read() == DATA
+
+
+@pytest.mark.parametrize('name', ['0' * 64, SHA.upper(), SHA[:-1], '../' + SHA[3:], ''])
+def test_path_only_names_stored_hashes(tmp_path, name):
+    store = artifacts.ArtifactStore(str(tmp_path))
+    store.save(io.BytesIO(DATA))
+    assert store.path(name) is None
+
+
+def test_too_large_leaves_nothing(tmp_path, monkeypatch):
+    monkeypatch.setattr(artifacts, 'CHUNK', 1000)
+    store = artifacts.ArtifactStore(str(tmp_path), max_bytes=len(DATA) - 1)
+    with pytest.raises(artifacts.TooLarge):
+        store.save(io.BytesIO(DATA))
+    assert os.listdir(tmp_path) == []
+
+
+def test_prune_keeps_referenced_and_young_files(tmp_path):
+    store = artifacts.ArtifactStore(str(tmp_path))
+    kept, _ = store.save(io.BytesIO(b'kept'))
+    old, _ = store.save(io.BytesIO(b'old'))
+    young, _ = store.save(io.BytesIO(b'young'))
+    hour_ago = time.time() - 7200
+    for sha in (kept, old):
+        os.utime(store.path(sha), (hour_ago, hour_ago))
+    assert store.prune({kept}) == 1
+    assert store.path(kept) and store.path(young) and store.path(old) is None
+
+
+# ====== upload and download ======
+@pytest.fixture
+def uploaded(app_module, client, monkeypatch):
+    monkeypatch.setattr(app_module, 'ARTIFACT_BASE_URL', None)
+    client.post('/tools', data={'add_tool': '1', 'name': 'tool', 'version': '1.0', 'download_url': '',
+                                'artifact': (io.BytesIO(DATA), 'tool 1.0.zip')},
+                content_type='multipart/form-data')
+    return app_module.store.get_tool('tool')
+
+
+def test_upload_describes_the_tool(uploaded, client):
+    assert uploaded['sha256'] == SHA and uploaded['size'] == len(DATA) and uploaded['filename'] == 'tool_1.0.zip'
+    assert uploaded['download_url'] == 'http://localhost/downloads/%s/tool_1.0.zip' % SHA
+    body = client.get('/api/tool/tool').get_json()
+    assert (body['sha256'], body['size'], body['filename']) == (SHA, len(DATA), 'tool_1.0.zip')
+
+
+def test_download(uploaded, client):
+    resp = client.get(uploaded['download_url'])
+    assert resp.status_code == 200 and resp.data == DATA
+    assert resp.headers['ETag'] == '"%s"' % SHA
+    assert resp.headers['Accept-Ranges'] == 'bytes'
+    assert 'attachment' in resp.headers['Content-Disposition'] and 'tool_1.0.zip' in resp.headers['Content-Disposition']
+    cache_control = {d.strip() for d in resp.headers['Cache-Control'].split(',')}
+    assert {'public', 'immutable', 'max-age=31536000'} <= cache_control
+    assert client.get('/downloads/%s/x.zip' % ('0' * 64)).status_code == 404
+    assert client.get('/downloads/not-a-hash/x.zip').status_code == 404
+
+
+def test_download_range(uploaded, client):
+    resp = client.get(uploaded['download_url'], headers={'Range': 'bytes=100-199'})
+    assert resp.status_code == 206 and resp.data == DATA[100:200]
+    assert resp.headers['Content-Range'] == 'bytes 100-199/%d' % len(DATA)
+    resp = client.get(uploaded['download_url'], headers={'Range': 'bytes=-10'})
+    assert resp.status_code == 206 and resp.data == DATA[-10:]
+    resp = client.get(uploaded['download_url'], headers={'Range': 'bytes=%d-' % len(DATA)})
+    assert resp.status_code == 416
+
+
+def test_resume_only_from_the_same_file(uploaded, client):
+    headers = {'Range': 'bytes=10-', 'If-Range': '"%s"' % SHA}
+    resp = client.get(uploaded['download_url'], headers=headers)
+    assert resp.status_code == 206 and resp.data == DATA[10:]
+    headers['If-Range'] = '"%s"' % ('0' * 64)
+    resp = client.get(uploaded['download_url'], headers=headers)
+    assert resp.status_code == 200 and resp.data == DATA
+
+
+def test_not_modified(uploaded, client):
+    resp = client.get(uploaded['download_url'], headers={'If-None-Match': '"%s"' % SHA})
+    assert resp.status_code == 304 and resp.data == b''
+    resp = client.get(uploaded['download_url'], headers={'If-None-Match': '"other"'})
+    assert resp.status_code == 200
+
+
+def test_replacing_the_file_prunes_the_old_one(uploaded, app_module, client):
+    client.post('/tools', data={'edit_tool': '1', 'original_name': 'tool', 'name': 'tool', 'version': '1.1',
+                                'download_url': uploaded['download_url'],
+                                'artifact': (io.BytesIO(b'new build'), 'tool-1.1.zip')},
+                content_type='multipart/form-data')
+    tool = app_module.store.get_tool('tool')
+    assert tool['sha256'] == hashlib.sha256(b'new build').hexdigest() and tool['size'] == 9
+    # Too young to prune yet; an hour later it goes.
+    assert app_module.artifact_store.path(SHA)
+    assert app_module.artifact_store.prune({tool['sha256']}, min_age=0) == 1
+    assert client.get(uploaded['download_url']).status_code == 404
+
+
+def test_upload_too_large(app_module, client, monkeypatch):
+    monkeypatch.setattr(app_module.artifact_store, 'max_bytes', 10)
+    resp = client.post('/tools', data={'add_tool': '1', 'name': 'big', 'version': '1', 'download_url': '',
+                                       'artifact': (io.BytesIO(DATA), 'big.zip')},
+                       content_type='multipart/form-data', follow_redirects=True)
+    assert 'is larger than' in resp.get_data(as_text=True)
+    assert app_module.store.get_tool('big') is None
@@ -0,0 +1,133 @@
+import json
+import socket
+import asyncio
+import threading
+import http.client
+
+import pytest
+
+import ratelimit
+from conftest import TOOL, make_license
+
+
+@pytest.fixture
+def port(app_module):
+    # Imported here: it imports app, which must see the test configuration.
+    import async_server
+    loop = asyncio.new_event_loop()
+    listener = loop.run_until_complete(asyncio.start_server(
+        async_server.Server().handle, '127.0.0.1', 0, limit=async_server.MAX_HEADER_BYTES))
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    yield listener.sockets[0].getsockname()[1]
+
+    async def stop():
+        listener.close()
+        handlers = asyncio.all_tasks() - {asyncio.current_task()}
+        for task in handlers:
+            task.cancel()
+        await asyncio.gather(*handlers, return_exceptions=True)
+    asyncio.run_coroutine_threadsafe(stop(), loop).result(10)
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join()
+    loop.close()
+
+
+def fetch(port, method, path, body=None, headers=None):
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=10)
+    try:
+        conn.request(method, path, body, headers or {})
+        response = conn.getresponse()
+        return response.status, response.read(), response.headers
+    finally:
+        conn.close()
+
+
+def both(client, port, method, path, body=None, headers=None):
+    body = None if body is None else json.dumps(body)
+    headers = dict(headers or {}, **({'Content-Type': 'application/json'} if body else {}))
+    flask = client.open(path, method=method, data=body, headers=headers)
+    return (flask.status_code, flask.get_data(), flask.headers), fetch(port, method, path, body, headers)
+
+
+def test_checks_match_the_flask_app(app_module, client, port):
+    app_module.store.add_licenses([make_license('K', expiry='2025-01-20'), make_license('R', active=False),
+                                   make_license('OLD', expiry='2025-01-10')])
+    for body in ({'key': 'K', 'device_id': 'dev', 'version': '1'},
+                 {'key': 'missing', 'device_id': 'dev', 'version': '1'},
+                 {'key': 'R', 'device_id': 'dev', 'version': '1'},
+                 {'key': 'K', 'device_id': 'other', 'version': '1'},
+                 {'key': 'K', 'device_id': 'dev', 'version': '2'},
+                 {'key': 'OLD', 'device_id': 'dev', 'version': '1'}):
+        flask, ours = both(client, port, 'POST', '/api/license/check', body)
+        assert ours[:2] == flask[:2], body
+
+
+def test_claims_match_the_flask_app(app_module, port):
+    app_module.store.add_license(make_license('K', device_id='', expiry='2025-01-20'))
+    body = b'{"key": "K", "device_id": "first", "version": "1"}'
+    assert fetch(port, 'POST', '/api/license/check', body)[0] == 200
+    assert app_module.store.get_license('K').device_id == 'first'
+    assert [e['event'] for e in app_module.store.license_history('K')[0]] == ['Created', 'Bound to first']
+
+
+def test_rate_limit_matches_the_flask_app(app_module, client, port, monkeypatch):
+    monkeypatch.setattr(app_module, 'RATE_LIMIT_KEY', ratelimit.parse_rate('1/60'))
+    for key in ('A', 'B'):
+        body = {'key': key, 'device_id': 'dev', 'version': '1'}
+        # Spend the key's one token, then compare the refusals.
+        client.post('/api/license/check', json=body)
+        flask, ours = both(client, port, 'POST', '/api/license/check', body)
+        assert ours[:2] == flask[:2] and flask[0] == 429
+        assert ours[2]['Retry-After'] == flask[2]['Retry-After']
+
+
+def test_tools_match_the_flask_app(app_module, client, port):
+    app_module.store.replace_tools([TOOL, dict(TOOL, name='Other', version='2.0')])
+    for path in ('/api/tools', '/api/tool/tool', '/api/tool/OTHER', '/api/tool/missing'):
+        for headers in ({}, {'Accept-Encoding': 'gzip'}):
+            flask, ours = both(client, port, 'GET', path, headers=headers)
+            assert ours[:2] == flask[:2], (path, headers)
+            for name in ('ETag', 'Cache-Control', 'Content-Encoding', 'Vary'):
+                assert ours[2].get(name) == flask[2].get(name), (path, name)
+
+    etag = fetch(port, 'GET', '/api/tools')[2]['ETag']
+    flask, ours = both(client, port, 'GET', '/api/tools', headers={'If-None-Match': etag})
+    assert flask[0] == ours[0] == 304 and ours[1] == b''
+
+
+def test_negative_content_length_is_a_bad_request(port):
+    with socket.create_connection(('127.0.0.1', port), timeout=10) as sock:
+        sock.sendall(b'POST /api/license/check HTTP/1.1\r\nHost: x\r\nContent-Length: -5\r\n\r\n')
+        assert sock.recv(4096).startswith(b'HTTP/1.1 400 Bad Request\r\n')
+
+
+def test_other_methods_and_paths(port):
+    assert fetch(port, 'GET', '/api/license/check')[0] == 405
+    assert fetch(port, 'POST', '/api/tools', b'')[0] == 405
+    assert fetch(port, 'GET', '/nowhere')[0] == 404
+    assert fetch(port, 'POST', '/api/license/check', b'[1]')[0] == 400
+
+
+def test_a_blocked_check_does_not_stall_the_loop(app_module, port, monkeypatch):
+    app_module.store.replace_tools([TOOL])
+    release = threading.Event()
+    get_license = app_module.store.get_license
+
+    def slow_get_license(key):
+        release.wait(10)
+        return get_license(key)
+    monkeypatch.setattr(app_module.store, 'get_license', slow_get_license)
+
+    result = []
+    checking = threading.Thread(target=lambda: result.append(
+        fetch(port, 'POST', '/api/license/check', b'{"key": "K", "device_id": "d", "version": "1"}')))
+    checking.start()
+    try:
+        # Answered while the check waits on the "disk".
+        assert fetch(port, 'GET', '/api/tools')[0] == 200
+        assert not result
+    finally:
+        release.set()
+        checking.join()
+    assert result[0][0] == 404
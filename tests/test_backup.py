@@ -0,0 +1,99 @@
+import json
+
+import pytest
+
+import backup
+from conftest import BACKENDS, TOOL, dump, make_license, open_store
+
+ARTIFACT_TOOL = dict(TOOL, name='Packed', sha256='ab' * 32, size=1234, filename='packed-1.0.zip')
+
+
+def history(store):
+    return sorted((e['key'], e['event'], e['date']) for e in store.history_entries())
+
+
+@pytest.fixture
+def source(store):
+    store.add_licenses([make_license('K%03d' % i, device_id='' if i % 3 else 'dev-%d' % i, active=i % 4 != 0)
+                        for i in range(25)])
+    store.update_license('K001', {'expiry': '2031-01-01'}, {'event': 'Extended', 'date': '2025-02-01'})
+    store.replace_tools([TOOL, ARTIFACT_TOOL])
+    return store
+
+
+@pytest.mark.parametrize('target', sorted(BACKENDS))
+def test_round_trip(source, target, tmp_path):
+    lines = list(backup.export_lines(source, history=True, now=0))
+    header = json.loads(lines[0])
+    assert header['type'] == 'export' and header['history'] and header['seq'] == source.state()[0]
+
+    copy = open_store(target, tmp_path / 'copy')
+    stats = backup.import_lines(copy, lines, chunk=4)
+    assert (stats['licenses'], stats['tools'], stats['events'], stats['skipped']) == (25, 2, 26, 0)
+    assert dump(copy) == dump(source)
+    assert copy.tools() == source.tools()
+    assert history(copy) == history(source)
+    assert list(backup.export_lines(copy, history=True, now=0))[1:] == lines[1:]
+
+
+def test_export_without_history(source):
+    kinds = [json.loads(line)['type'] for line in backup.export_lines(source)]
+    assert kinds.count('license') == 25 and kinds.count('tool') == 2 and 'event' not in kinds
+
+
+def test_import_upserts(source, tmp_path):
+    copy = open_store('json', tmp_path / 'copy')
+    copy.add_license(make_license('K000', expiry='2020-01-01'))
+    copy.add_tool(dict(TOOL, version='0.9'))
+    backup.import_lines(copy, backup.export_lines(source))
+    assert dump(copy) == dump(source)
+    assert copy.get_tool('tool')['version'] == TOOL['version']
+
+
+def test_bad_lines_are_skipped(store):
+    ok = {k: v for k, v in make_license('OK').items() if k != 'history'}
+    lines = [
+        '{"type":"export","seq":1}',
+        '',
+        json.dumps({'type': 'license', 'license': ok}),
+        'not json',
+        '{"type":"license","license":{"key":"X","device_id":"","version":"1","expiry":"31/12/2030"}}',
+        '{"type":"license","license":{"key":"","device_id":"","version":"1","expiry":"2030-12-31"}}',
+        '{"type":"tool","tool":{"name":"t","version":"1"}}',
+        '{"type":"event","key":"OK","event":"Created"}',
+        '{"type":"mystery"}',
+        b'{"type":"event","key":"OK","event":"Note","date":"2025-01-02"}',
+    ]
+    stats = backup.import_lines(store, lines)
+    assert (stats['licenses'], stats['events'], stats['skipped']) == (1, 1, 6)
+    assert [e['line'] for e in stats['errors']] == [4, 5, 6, 7, 8, 9]
+    assert 'expiry' in stats['errors'][1]['error']
+    assert [lic.key for lic in store.licenses()] == ['OK']
+
+
+def test_api_round_trip(app_module, client, source, backend, tmp_path, monkeypatch):
+    resp = client.get('/api/export?history=1')
+    assert resp.mimetype == 'application/x-ndjson'
+    assert resp.headers['Content-Disposition'] == 'attachment; filename="licenses-2025-01-15.ndjson"'
+    body = resp.get_data()
+
+    copy = open_store(backend, tmp_path / 'copy')
+    monkeypatch.setattr(app_module, 'store', copy)
+    resp = client.post('/api/import', data=body)
+    assert resp.status_code == 200 and resp.get_json()['licenses'] == 25
+    assert dump(copy) == dump(source) and history(copy) == history(source)
+    assert client.post('/api/import', data=b'nope\n').status_code == 207
+
+
+def test_cli(source, backend, tmp_path, monkeypatch, capsys):
+    kind, _ = BACKENDS[backend]
+    monkeypatch.setenv('STORAGE_BACKEND', kind)
+    monkeypatch.setenv('DATA_DIR', str(tmp_path / 'primary'))
+    out = tmp_path / 'backup.ndjson'
+    assert backup.main(['export', '--history', '--out', str(out)]) == 0
+    assert json.loads(capsys.readouterr().err)['lines'] == 1 + 2 + 25 + 26
+
+    monkeypatch.setenv('DATA_DIR', str(tmp_path / 'copy'))
+    assert backup.main(['import', str(out), '--chunk', '7']) == 0
+    assert json.loads(capsys.readouterr().err)['licenses'] == 25
+    assert dump(open_store(backend, tmp_path / 'copy')) == dump(source)
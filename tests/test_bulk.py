@@ -0,0 +1,94 @@
+from datetime import date
+
+import pytest
+
+from conftest import make_license
+
+TODAY = date(2025, 1, 15)
+
+
+@pytest.fixture
+def licenses(app_module):
+    app_module.store.add_licenses([
+        make_license('A1', device_id='acme-1', version='1', expiry='2025-03-01'),
+        make_license('A2', device_id='acme-2', version='2', expiry='2025-06-01'),
+        make_license('B1', device_id='beta-1', version='1', expiry='2025-01-10'),
+        make_license('B2', device_id='beta-2', version='1', expiry='2025-02-01', active=False),
+    ])
+    return app_module.store
+
+
+def revoked(store):
+    return sorted(lic.key for lic in store.licenses() if not lic.active)
+
+
+@pytest.mark.parametrize('selection, keys', [
+    ({'filter': {'version': '1'}}, ['A1', 'B1', 'B2']),
+    ({'filter': {'status': 'expired'}}, ['B1']),
+    ({'filter': {'status': 'Active'}}, ['A1', 'A2']),
+    ({'filter': {'device_prefix': 'acme-'}}, ['A1', 'A2']),
+    ({'filter': {'expiry_from': '2025-02-01', 'expiry_to': '2025-03-01'}}, ['A1', 'B2']),
+    ({'filter': {'version': '1', 'device_prefix': 'acme'}}, ['A1']),
+    ({'keys': ['A2', 'B1', 'missing']}, ['A2', 'B1']),
+    ({'keys': ['A1', 'A2'], 'filter': {'version': '2'}}, ['A2']),
+])
+def test_bulk_extend_selects(licenses, client, selection, keys):
+    response = client.post('/api/license/extend-bulk', json=dict(selection, expiry='2030-01-01'))
+    assert response.get_json() == {'status': 'extended', 'count': len(keys)}
+    assert sorted(lic.key for lic in licenses.licenses() if lic.expiry == '2030-01-01') == keys
+    for key in keys:
+        events = licenses.license_history(key)[0]
+        assert events[-1] == {'event': 'Extended by API to 2030-01-01 (bulk)', 'date': TODAY.isoformat()}
+
+
+def test_bulk_revoke(app_module, licenses, client):
+    response = client.post('/api/license/revoke-bulk', json={'filter': {'device_prefix': 'acme-'}})
+    assert response.get_json() == {'status': 'revoked', 'count': 2}
+    assert revoked(licenses) == ['A1', 'A2', 'B2']
+    assert {'A1', 'A2'} <= set(client.get('/api/license/revoked').get_json()['keys'])
+    assert client.post('/api/license/revoke-bulk', json={'keys': ['missing']}).get_json()['count'] == 0
+
+
+@pytest.mark.parametrize('body, error', [
+    ({}, 'Give a list of keys or at least one filter'),
+    ({'keys': 'A1'}, 'keys must be a list of strings'),
+    ({'filter': ['version']}, 'filter must be an object'),
+    ({'filter': {'version': 1}}, 'version must be a string'),
+    ({'filter': {'status': 'gone'}}, 'status must be Active, Expired or Disabled'),
+    ({'filter': {'expiry_to': 'soon'}}, 'Invalid expiry_to date'),
+])
+def test_bulk_rejects_bad_selections(licenses, client, body, error):
+    response = client.post('/api/license/revoke-bulk', json=body)
+    assert (response.status_code, response.get_json()) == (400, {'error': error})
+    assert revoked(licenses) == ['B2']
+
+
+def test_bulk_extend_needs_a_date(licenses, client):
+    response = client.post('/api/license/extend-bulk', json={'keys': ['A1'], 'expiry': 'garbage'})
+    assert response.status_code == 400
+    assert licenses.get_license('A1').expiry == '2025-03-01'
+
+
+def test_admin_bulk_form(licenses, client):
+    client.post('/licenses', data={'bulk': 'Extend', 'keys': 'A1, B1', 'new_expiry': '2030-01-01'})
+    assert [licenses.get_license(k).expiry for k in ('A1', 'B1')] == ['2030-01-01', '2030-01-01']
+    client.post('/licenses', data={'bulk': 'Revoke', 'version': '2'})
+    assert revoked(licenses) == ['A2', 'B2']
+
+
+# ====== single license admin forms ======
+def test_admin_extend_validates_the_date(licenses, client):
+    response = client.post('/licenses/extend/A1', data={'expiry': 'garbage'}, follow_redirects=True)
+    assert b'Invalid expiry date' in response.data
+    assert licenses.get_license('A1').expiry == '2025-03-01'
+    assert licenses.license_history('A1')[1] == 1
+
+    client.post('/licenses/extend/A1', data={'expiry': '2030-01-01'})
+    assert licenses.get_license('A1').expiry == '2030-01-01'
+
+
+def test_admin_generate_validates_the_date(app_module, client):
+    response = client.post('/licenses', data={'generate': '1', 'device_id': 'd', 'version': '1', 'expiry': 'never'},
+                           follow_redirects=True)
+    assert b'Invalid expiry date' in response.data
+    assert list(app_module.store.licenses()) == []
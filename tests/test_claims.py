@@ -0,0 +1,94 @@
+import threading
+from datetime import date
+
+from conftest import make_license, open_store
+
+EXPIRY = date(2025, 1, 20)
+EVENT = {'event': 'Bound', 'date': '2025-01-02'}
+
+
+def check(client, key='K', device_id='dev', version='1'):
+    response = client.post('/api/license/check', json={'key': key, 'device_id': device_id, 'version': version})
+    return response.status_code, response.get_json()
+
+
+# ====== store ======
+def test_claim_binds_once(store):
+    store.add_license(make_license('A', device_id=''))
+    assert store.claim_license('A', 'first', EVENT).device_id == 'first'
+    assert store.claim_license('A', 'second', EVENT).device_id == 'first'
+    assert store.license_history('A')[1] == 2
+    assert store.claim_license('missing', 'first', EVENT) is None
+
+
+def test_claim_skips_revoked(store):
+    store.add_license(make_license('A', device_id='', active=False))
+    assert store.claim_license('A', 'dev', EVENT).device_id == ''
+
+
+def test_concurrent_claims_have_one_winner(backend, tmp_path):
+    # Each thread has its own store, as gunicorn workers do.
+    open_store(backend, tmp_path).add_license(make_license('A', device_id=''))
+    stores = [open_store(backend, tmp_path) for _ in range(8)]
+    barrier = threading.Barrier(len(stores))
+    results = [None] * len(stores)
+
+    def claim(i):
+        barrier.wait()
+        results[i] = stores[i].claim_license('A', 'dev-%d' % i, EVENT).device_id
+
+    threads = [threading.Thread(target=claim, args=(i,)) for i in range(len(stores))]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    winner = open_store(backend, tmp_path).get_license('A').device_id
+    assert winner.startswith('dev-')
+    assert results == [winner] * len(stores)
+    assert open_store(backend, tmp_path).license_history('A')[1] == 2
+
+
+# ====== first check ======
+def test_first_check_binds_unassigned_license(app_module, client):
+    app_module.store.add_license(make_license('K', device_id='', expiry=EXPIRY.isoformat()))
+    assert check(client, device_id='first')[0] == 200
+    assert app_module.store.get_license('K').device_id == 'first'
+    assert check(client, device_id='second') == (403, {'status': 'device_mismatch'})
+    events, total = app_module.store.license_history('K')
+    assert [e['event'] for e in events] == ['Created', 'Bound to first']
+
+
+def test_revoked_license_is_not_bound(app_module, client):
+    app_module.store.add_license(make_license('K', device_id='', active=False))
+    assert check(client, device_id='first') == (403, {'status': 'revoked'})
+    assert app_module.store.get_license('K').device_id == ''
+
+
+def test_batch_binds_to_the_first_item(app_module, client):
+    app_module.store.add_license(make_license('K', device_id='', expiry=EXPIRY.isoformat()))
+    items = [{'key': 'K', 'device_id': 'first', 'version': '1'},
+             {'key': 'K', 'device_id': 'second', 'version': '1'}]
+    results = client.post('/api/license/check-batch', json={'items': items}).get_json()['results']
+    assert [r['status'] for r in results] == ['valid', 'device_mismatch']
+    assert app_module.store.get_license('K').device_id == 'first'
+
+
+def test_concurrent_first_checks_have_one_winner(app_module):
+    app_module.store.add_license(make_license('K', device_id='', expiry=EXPIRY.isoformat()))
+    barrier = threading.Barrier(8)
+    outcomes = {}
+
+    def run(i):
+        client = app_module.app.test_client()
+        barrier.wait()
+        outcomes['dev-%d' % i] = check(client, device_id='dev-%d' % i)[1]['status']
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    winner = app_module.store.get_license('K').device_id
+    assert outcomes.pop(winner) == 'valid'
+    assert set(outcomes.values()) == {'device_mismatch'}
+    assert app_module.store.license_history('K')[1] == 2
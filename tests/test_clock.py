@@ -0,0 +1,64 @@
+from datetime import date, timedelta
+
+from conftest import make_license, at, set_time
+
+EXPIRY = date(2025, 1, 20)
+
+
+def check(client, key='K', device_id='dev', version='1'):
+    response = client.post('/api/license/check', json={'key': key, 'device_id': device_id, 'version': version})
+    return response.status_code, response.get_json()
+
+
+def test_days_left_counts_down_to_expiry(app_module, client):
+    app_module.store.add_license(make_license('K', expiry=EXPIRY.isoformat()))
+    for days_before, days_left in ((5, 4), (2, 1), (1, 0)):
+        set_time(app_module, at(EXPIRY - timedelta(days=days_before)))
+        assert check(client) == (200, {'status': 'valid', 'days_left': days_left, 'expiry': '2025-01-20'})
+
+
+def test_license_expires_at_midnight(app_module, client):
+    app_module.store.add_license(make_license('K', expiry=EXPIRY.isoformat()))
+    lic = app_module.store.get_license('K')
+    day_before = EXPIRY - timedelta(days=1)
+
+    set_time(app_module, at(day_before, 23, 59, 59))
+    assert check(client)[1]['status'] == 'valid'
+    assert app_module.status_of(lic) == 'Active' and app_module.days_left(lic) == 1
+
+    # Same clock object across the rollover: its cached day must move on.
+    set_time(app_module, at(EXPIRY, 0, 0, 0))
+    assert app_module.clock.today() == EXPIRY
+    assert check(client) == (403, {'status': 'expired'})
+    # The admin pages, as before the clock, count the expiry day itself as
+    # the last Active one.
+    assert app_module.status_of(lic) == 'Active' and app_module.days_left(lic) == 0
+
+    set_time(app_module, at(EXPIRY + timedelta(days=1), 0, 0, 1))
+    assert app_module.status_of(lic) == 'Expired' and app_module.days_left(lic) == -1
+
+
+def test_clock_day_boundaries(core):
+    clock = core.Clock(lambda: at(EXPIRY, 23, 59, 59))
+    assert clock.today_ord() == EXPIRY.toordinal()
+    assert clock.today_iso() == '2025-01-20'
+    assert clock.day_start(EXPIRY.toordinal()) == at(EXPIRY, 0)
+    assert clock.day_start(EXPIRY.toordinal() + 1) == at(EXPIRY + timedelta(days=1), 0)
+
+
+def test_check_outcomes(app_module, client):
+    app_module.store.add_licenses([make_license('K', expiry=EXPIRY.isoformat()),
+                                   make_license('R', active=False)])
+    assert check(client, key='missing') == (404, {'status': 'not_found'})
+    assert check(client, key='R') == (403, {'status': 'revoked'})
+    assert check(client, device_id='other') == (403, {'status': 'device_mismatch'})
+    assert check(client, version='2') == (426, {'status': 'version_mismatch'})
+
+
+def test_history_events_use_the_clock(app_module, client):
+    set_time(app_module, at(date(2025, 3, 1)))
+    key = client.post('/api/license/generate',
+                      json={'device_id': 'dev', 'version': '1', 'expiry': '2026-01-01'}).get_json()['key']
+    lic = app_module.store.get_license(key)
+    assert lic.created == '2025-03-01'
+    assert app_module.store.license_history(key)[0] == [{'event': 'Created', 'date': '2025-03-01'}]
@@ -0,0 +1,150 @@
+from datetime import date
+
+import pytest
+
+import expiry
+from conftest import at, make_license, set_time
+
+
+def expired_events(store, key):
+    events, _ = store.license_history(key)
+    return [e['date'] for e in events if e['event'] == 'Expired']
+
+
+@pytest.fixture
+def sweeper(app_module):
+    return app_module.expiry_sweeper
+
+
+# ====== "Expired" events ======
+def test_first_sweep_starts_today(app_module, sweeper):
+    app_module.store.add_licenses([make_license('OLD', expiry='2025-01-10'),
+                                   make_license('TODAY', expiry='2025-01-15'),
+                                   make_license('LATER', expiry='2025-01-16')])
+    assert sweeper.sweep()['expired'] == 1
+    assert expired_events(app_module.store, 'OLD') == []
+    assert expired_events(app_module.store, 'LATER') == []
+
+
+def test_event_dated_the_day_the_check_says_expired(app_module, sweeper, client):
+    app_module.store.add_license(make_license('A', expiry='2025-01-17'))
+    sweeper.sweep()
+    set_time(app_module, at(date(2025, 1, 16), 23, 59, 59))
+    sweeper.sweep()
+    assert expired_events(app_module.store, 'A') == []
+    set_time(app_module, at(date(2025, 1, 17), 0, 0, 0))
+    resp = client.post('/api/license/check', json={'key': 'A', 'device_id': 'dev', 'version': '1'})
+    assert resp.get_json()['status'] == 'expired'
+    assert sweeper.sweep()['expired'] == 1
+    assert expired_events(app_module.store, 'A') == ['2025-01-17']
+
+
+def test_catches_up_over_missed_days(app_module, sweeper):
+    app_module.store.add_licenses([make_license('A', expiry='2025-01-16'), make_license('B', expiry='2025-01-18'),
+                                   make_license('R', expiry='2025-01-17', active=False)])
+    sweeper.sweep()
+    set_time(app_module, at(date(2025, 1, 20)))
+    assert sweeper.sweep()['expired'] == 2
+    assert sweeper.sweep()['expired'] == 0
+    assert expired_events(app_module.store, 'A') == ['2025-01-16']
+    assert expired_events(app_module.store, 'B') == ['2025-01-18']
+    assert expired_events(app_module.store, 'R') == []
+
+
+def test_sweep_resumes_after_a_crash(app_module, sweeper, monkeypatch):
+    # Chunks of 2: the first goes through, the store takes the second and
+    # the process dies before expiry.db hears about it.
+    keys = ['K%d' % i for i in range(5)]
+    app_module.store.add_licenses([make_license(k, expiry='2025-01-16') for k in keys])
+    sweeper.sweep()
+    monkeypatch.setattr(expiry, 'CHUNK', 2)
+    add_history = app_module.store.add_history
+    calls = []
+
+    def dies_after_second(entries):
+        calls.append(len(entries))
+        add_history(entries)
+        if len(calls) == 2:
+            raise OSError('killed')
+    monkeypatch.setattr(app_module.store, 'add_history', dies_after_second)
+    set_time(app_module, at(date(2025, 1, 16)))
+    with pytest.raises(OSError):
+        sweeper.sweep()
+    monkeypatch.setattr(app_module.store, 'add_history', add_history)
+    assert sweeper.sweep()['expired'] == 1
+    for key in keys:
+        assert expired_events(app_module.store, key) == ['2025-01-16']
+
+
+def test_sweep_writes_a_chunk_the_store_never_took(app_module, sweeper, monkeypatch):
+    app_module.store.add_licenses([make_license('A', expiry='2025-01-16'), make_license('B', expiry='2025-01-16')])
+    sweeper.sweep()
+    add_history = app_module.store.add_history
+
+    def dies(entries):
+        raise OSError('killed')
+    monkeypatch.setattr(app_module.store, 'add_history', dies)
+    set_time(app_module, at(date(2025, 1, 16)))
+    with pytest.raises(OSError):
+        sweeper.sweep()
+    monkeypatch.setattr(app_module.store, 'add_history', add_history)
+    assert sweeper.sweep()['expired'] == 2
+    assert expired_events(app_module.store, 'A') == ['2025-01-16']
+
+
+# ====== notices ======
+def test_notices_queued_once_per_threshold(app_module, sweeper):
+    app_module.store.add_licenses([make_license('A', expiry='2025-02-10'), make_license('B', expiry='2025-01-20'),
+                                   make_license('C', expiry='2025-01-16'), make_license('D', expiry='2025-01-15'),
+                                   make_license('R', expiry='2025-01-20', active=False)])
+    assert sweeper.sweep()['queued'] == 1 + 2 + 3
+    assert sweeper.sweep()['queued'] == 0
+    notices = sweeper.notices(30)
+    assert [(n['key'], n['notice'], n['days_left']) for n in notices] == [
+        ('C', 30, 0), ('C', 7, 0), ('C', 1, 0), ('B', 30, 4), ('B', 7, 4), ('A', 30, 25)]
+    assert [lic.key for lic in sweeper.licenses(7)] == ['C', 'B']
+
+
+def test_days_left_matches_the_check(app_module, sweeper, client):
+    app_module.store.add_license(make_license('A', expiry='2025-01-20'))
+    sweeper.sweep()
+    resp = client.post('/api/license/check', json={'key': 'A', 'device_id': 'dev', 'version': '1'})
+    assert {n['days_left'] for n in sweeper.notices(30)} == {resp.get_json()['days_left']}
+
+
+def test_notices_drop_revoked_and_extended(app_module, sweeper):
+    app_module.store.add_licenses([make_license('A', expiry='2025-01-20'), make_license('B', expiry='2025-01-20')])
+    sweeper.sweep()
+    app_module.store.update_license('A', {'active': False})
+    app_module.store.update_license('B', {'expiry': '2026-01-20'})
+    assert sweeper.notices(30) == []
+
+
+def test_mark_sent(app_module, sweeper):
+    app_module.store.add_license(make_license('A', expiry='2025-01-20'))
+    sweeper.sweep()
+    ids = [n['id'] for n in sweeper.notices(30)]
+    assert sweeper.mark_sent(ids[:1]) == 1
+    assert sweeper.mark_sent(ids[:1]) == 0
+    assert [n['id'] for n in sweeper.notices(30, unsent_only=True)] == ids[1:]
+
+
+def test_notices_end_on_the_expiry_day(app_module, sweeper):
+    app_module.store.add_license(make_license('A', expiry='2025-01-16'))
+    sweeper.sweep()
+    set_time(app_module, at(date(2025, 1, 16)))
+    assert sweeper.notices(30) == []
+
+
+# ====== API ======
+def test_expiring_api(app_module, sweeper, client):
+    app_module.store.add_licenses([make_license('A', expiry='2025-02-10'), make_license('B', expiry='2025-01-20')])
+    sweeper.sweep()
+    body = client.get('/api/license/expiring?within=7').get_json()
+    assert body['within'] == 7 and [(n['key'], n['notice']) for n in body['notices']] == [('B', 30), ('B', 7)]
+    assert client.get('/api/license/expiring?within=90').get_json()['within'] == 30
+
+    ids = [n['id'] for n in body['notices']]
+    assert client.post('/api/license/expiring/sent', json={'ids': ids}).get_json() == {'marked': 2}
+    assert client.get('/api/license/expiring?within=7&pending=1').get_json()['notices'] == []
+    assert client.post('/api/license/expiring/sent', json={'ids': 'x'}).status_code == 400
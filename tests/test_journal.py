@@ -0,0 +1,130 @@
+import os
+import json
+import time
+import threading
+
+import storage
+
+from conftest import TOOL, make_license, open_store, dump
+
+
+def test_journal_replays_on_reopen(json_backend, tmp_path):
+    store = open_store(json_backend, tmp_path)
+    store.add_licenses([make_license('A'), make_license('B', device_id='')])
+    store.update_license('A', {'active': False}, {'event': 'Revoked', 'date': '2025-01-02'})
+    store.update_license('B', {'device_id': 'dev-b'})
+    store.replace_tools([TOOL])
+
+    reopened = open_store(json_backend, tmp_path)
+    assert dump(reopened) == dump(store)
+    assert not reopened.get_license('A').active
+    assert reopened.get_license('B').device_id == 'dev-b'
+    assert reopened.tools() == [TOOL]
+    events, total = reopened.license_history('A')
+    assert total == 2 and events[-1]['event'] == 'Revoked'
+
+
+def test_other_process_writes_are_replayed(json_backend, tmp_path):
+    reader = open_store(json_backend, tmp_path)
+    writer = open_store(json_backend, tmp_path)
+    writer.add_license(make_license('A'))
+    writer.update_license('A', {'expiry': '2031-01-01'})
+    assert reader.get_license('A').expiry == '2031-01-01'
+
+
+def test_compaction_keeps_state_and_tail(json_backend, tmp_path):
+    store = open_store(json_backend, tmp_path)
+    store.add_licenses([make_license('K%d' % i) for i in range(20)])
+    store.update_license('K0', {'active': False})
+    store.compact()
+
+    with open(tmp_path / 'journal.ndjson') as f:
+        assert [json.loads(line) for line in f] == [{'op': 'seq', 'seq': 21}]
+    with open(tmp_path / 'licenses.json') as f:
+        assert len(json.load(f)) == 20
+
+    store.update_license('K1', {'device_id': 'moved'})
+    reopened = open_store(json_backend, tmp_path)
+    assert dump(reopened) == dump(store)
+    assert reopened.get_license('K1').device_id == 'moved'
+    assert not reopened.get_license('K0').active
+    assert reopened.state()[0] == 22
+
+
+def test_compaction_is_seen_by_other_instances(json_backend, tmp_path):
+    store = open_store(json_backend, tmp_path)
+    other = open_store(json_backend, tmp_path)
+    store.add_licenses([make_license('A'), make_license('B')])
+    assert other.get_license('A')
+    store.compact()
+    store.update_license('B', {'version': '2'})
+    assert dump(other) == dump(store)
+    assert other.get_license('B').version == '2'
+
+
+def test_journal_past_compact_bytes_compacts(json_backend, tmp_path):
+    store = open_store(json_backend, tmp_path, compact_bytes=1)
+    store.add_license(make_license('A'))
+    # The write starts a background compaction.
+    deadline = time.monotonic() + 10
+    while open(tmp_path / 'journal.ndjson').read() != '{"op": "seq", "seq": 1}\n':
+        assert time.monotonic() < deadline, 'journal was not compacted'
+        time.sleep(0.01)
+    assert open_store(json_backend, tmp_path).get_license('A')
+    assert store.changes(0)[2] and not store.changes(1)[2]
+
+
+# ====== group commit ======
+def test_fsync_reaches_the_file_each_write_went_to(tmp_path, monkeypatch):
+    # A leader is fsyncing the old journal when a compaction swaps the file
+    # and the next write opens the new one: the old fd must stay open until
+    # that fsync is done, and the next leader must sync the new file.
+    journal = storage.Journal(str(tmp_path / 'journal.ndjson'))
+    synced, entered, release = [], threading.Event(), threading.Event()
+    fsync = os.fsync
+
+    def slow_fsync(fd):
+        synced.append(os.fstat(fd).st_ino)
+        if len(synced) == 1:
+            entered.set()
+            release.wait(5)
+        fsync(fd)
+    monkeypatch.setattr(os, 'fsync', slow_fsync)
+
+    first, old_ino, _ = journal.append([{'op': 'a'}])
+    old_fd = journal._fd
+    leader = threading.Thread(target=journal.wait_durable, args=(first,))
+    leader.start()
+    assert entered.wait(5)
+    with open(tmp_path / 'tail', 'w') as f:
+        f.write('{"op": "seq"}\n')
+    os.replace(tmp_path / 'tail', tmp_path / 'journal.ndjson')
+    second, new_ino, _ = journal.append([{'op': 'b'}])
+    assert new_ino != old_ino
+    os.fstat(old_fd)  # still open under the leader
+    release.set()
+    leader.join()
+    journal.wait_durable(second)
+    assert synced == [old_ino, new_ino]
+    assert journal._retired == [] and journal._dirty == {}
+
+
+def test_concurrent_writes_across_compactions_are_durable(tmp_path):
+    store = open_store('json', tmp_path, fsync=True)
+    errors = []
+
+    def write(n):
+        try:
+            for i in range(20):
+                store.add_license(make_license('T%d-%d' % (n, i)))
+        except Exception as e:
+            errors.append(e)
+    threads = [threading.Thread(target=write, args=(n,)) for n in range(4)]
+    for t in threads:
+        t.start()
+    for _ in range(5):
+        store.compact()
+    for t in threads:
+        t.join()
+    assert errors == []
+    assert len(dump(open_store('json', tmp_path))) == 80
@@ -0,0 +1,100 @@
+import os
+import json
+import time
+import subprocess
+
+import pytest
+
+import metrics
+
+
+@pytest.fixture
+def registry(tmp_path):
+    registry = metrics.Registry(str(tmp_path))
+    registry.counter('hits_total', 'Hits.')
+    registry.histogram('latency_seconds', 'Latency.', buckets=(0.1, 1.0))
+    return registry
+
+
+def dump_for(pid, directory, hits):
+    with open(os.path.join(directory, '%d.json' % pid), 'w') as f:
+        json.dump({'counters': {'hits_total': [[[['path', '/']], hits]]},
+                   'histograms': {'latency_seconds': [[[], [1, 0, 0, 0.05]]]}}, f)
+
+
+def exited_pid():
+    process = subprocess.Popen(['true'])
+    process.wait()
+    return process.pid
+
+
+def test_render_without_sharing():
+    registry = metrics.Registry()
+    registry.counter('hits_total', 'Hits.')
+    registry.inc('hits_total', path='/')
+    registry.inc('hits_total', 2, path='/')
+    assert registry.render() == '# HELP hits_total Hits.\n# TYPE hits_total counter\nhits_total{path="/"} 3\n'
+
+
+def test_histogram_buckets(registry):
+    for value in (0.05, 0.5, 5):
+        registry.observe('latency_seconds', value)
+    text = registry.render()
+    assert 'latency_seconds_bucket{le="0.1"} 1\n' in text
+    assert 'latency_seconds_bucket{le="1.0"} 2\n' in text
+    assert 'latency_seconds_bucket{le="+Inf"} 3\n' in text
+    assert 'latency_seconds_count 3\n' in text and 'latency_seconds_sum 5.55\n' in text
+
+
+def test_totals_across_processes(registry, tmp_path):
+    registry.inc('hits_total', path='/')
+    dump_for(os.getppid(), tmp_path, 10)
+    text = registry.render()
+    assert 'hits_total{path="/"} 11\n' in text
+    assert 'latency_seconds_count 1\n' in text
+
+
+def test_exited_processes_are_folded(registry, tmp_path):
+    registry.inc('hits_total', path='/')
+    first, second = exited_pid(), exited_pid()
+    dump_for(first, tmp_path, 10)
+    dump_for(second, tmp_path, 5)
+    assert 'hits_total{path="/"} 16\n' in registry.render()
+    assert sorted(os.listdir(tmp_path)) == ['.lock', '%d.json' % os.getpid(), 'exited.json']
+    # Folded once, not again on the next render.
+    dump_for(exited_pid(), tmp_path, 1)
+    assert 'hits_total{path="/"} 17\n' in registry.render()
+    assert 'hits_total{path="/"} 17\n' in registry.render()
+
+
+def test_clear(registry, tmp_path):
+    registry.inc('hits_total', path='/')
+    dump_for(exited_pid(), tmp_path, 10)
+    registry.render()
+    metrics.clear(str(tmp_path))
+    assert [f for f in os.listdir(tmp_path) if f.endswith('.json')] == []
+    metrics.clear(str(tmp_path / 'missing'))
+    assert 'hits_total{path="/"} 1\n' in registry.render(), "a live process's own values come back"
+
+
+def test_app_shares_through_data_dir(core, client):
+    assert core.metrics.multiprocess_dir == os.path.join(core.DATA_DIR, 'metrics')
+    client.get('/api/tools')
+    text = client.get('/metrics').get_data(as_text=True)
+    assert 'http_requests_total{endpoint="api_get_tools",method="GET",status="200"}' in text
+    assert os.path.exists(os.path.join(core.DATA_DIR, 'metrics', '%d.json' % os.getpid()))
+
+
+def test_skipped_flush_is_written_later(tmp_path):
+    registry = metrics.Registry(str(tmp_path), flush_interval=0.2)
+    registry.counter('hits_total', 'Hits.')
+    registry.inc('hits_total')
+    registry.flush()
+    registry.inc('hits_total')
+    registry.flush()   # too soon: deferred
+    path = tmp_path / ('%d.json' % os.getpid())
+    assert json.loads(path.read_text())['counters']['hits_total'] == [[[], 1]]
+    deadline = time.monotonic() + 5
+    while json.loads(path.read_text())['counters']['hits_total'] != [[[], 2]]:
+        assert time.monotonic() < deadline, 'deferred flush never ran'
+        time.sleep(0.05)
@@ -0,0 +1,126 @@
+import time
+import subprocess
+
+import pytest
+
+import ratelimit
+from conftest import make_license
+
+
+@pytest.fixture
+def limiter(tmp_path):
+    return ratelimit.SharedLimiter(str(tmp_path / 'ratelimit.bin'))
+
+
+@pytest.fixture
+def limited(app_module, monkeypatch):
+    monkeypatch.setattr(app_module, 'RATE_LIMIT_KEY', ratelimit.parse_rate('2/60'))
+    return app_module
+
+
+def check(client, key='K', headers=None):
+    return client.post('/api/license/check', json={'key': key, 'device_id': 'dev', 'version': '1'}, headers=headers)
+
+
+# ====== limiter ======
+def test_parse_rate():
+    assert ratelimit.parse_rate('60/60') == (60, 1.0)
+    assert ratelimit.parse_rate('10') == (10, 10.0)
+    assert ratelimit.parse_rate('0') is None and ratelimit.parse_rate('') is None
+
+
+def test_bucket_refills(limiter):
+    rate = (2, 1.0)
+    assert limiter.take('a', rate, now=100) == 0
+    assert limiter.take('a', rate, now=100) == 0
+    assert limiter.take('a', rate, now=100) == 1.0
+    assert limiter.take('b', rate, now=100) == 0, 'buckets are per name'
+    assert limiter.take('a', rate, now=100.5) == 0.5
+    assert limiter.take('a', rate, now=101.5) == 0
+
+
+def test_buckets_are_shared_through_the_file(tmp_path):
+    path = str(tmp_path / 'ratelimit.bin')
+    first, second = ratelimit.SharedLimiter(path), ratelimit.SharedLimiter(path)
+    assert first.take('a', (1, 1.0), now=100) == 0
+    assert second.take('a', (1, 1.0), now=100) == 1.0
+
+
+def test_in_flight_limit(limiter):
+    assert limiter.enter(2) and limiter.enter(2)
+    assert not limiter.enter(2)
+    assert limiter.in_flight() == 2
+    limiter.leave()
+    assert limiter.enter(2)
+    assert limiter.enter(0), 'limit 0 only counts'
+    assert limiter.in_flight() == 3
+
+
+def test_counts_of_dead_workers_are_dropped(limiter):
+    worker = subprocess.Popen(['true'])
+    worker.wait()
+    ratelimit.WORKER.pack_into(limiter._mm, 0, worker.pid, 5)
+    assert limiter.enter(1)
+    assert limiter.in_flight() == 1
+
+
+# ====== license API ======
+def test_rate_limit_answers_429(limited):
+    limited.store.add_license(make_license('K'))
+    client = limited.app.test_client()
+    assert check(client).status_code == 200
+    assert check(client).status_code == 200
+    response = check(client)
+    assert response.status_code == 429
+    assert response.get_json() == {'error': 'Rate limit exceeded', 'retry_after': 30}
+    assert response.headers['Retry-After'] == '30'
+    assert check(client, key='other').status_code == 404, 'other keys have their own bucket'
+    assert 'api_rejected_total{endpoint="api_check_license",reason="rate_limit"}' in limited.metrics.render()
+
+
+def test_batch_costs_one_token_per_item(limited, monkeypatch):
+    monkeypatch.setattr(limited, 'RATE_LIMIT_CLIENT', ratelimit.parse_rate('3/60'))
+    client = limited.app.test_client()
+    items = [{'key': 'K', 'device_id': 'dev', 'version': '1'}] * 2
+    assert client.post('/api/license/check-batch', json={'items': items}).status_code == 200
+    assert client.post('/api/license/check-batch', json={'items': items}).status_code == 429
+
+
+def test_overload_answers_503(limited, monkeypatch):
+    monkeypatch.setattr(limited, 'API_CONCURRENCY_MAX', 1)
+    limited.store.add_license(make_license('K'))
+    client = limited.app.test_client()
+    # Another request in flight (as another worker would count it).
+    limited.limiter.enter(0)
+    response = check(client)
+    assert response.status_code == 503 and response.headers['Retry-After'] == '1'
+    limited.limiter.leave()
+    assert check(client).status_code == 200
+    assert limited.limiter.in_flight() == 0, 'finished requests leave'
+    assert client.get('/licenses').status_code == 200, 'admin pages are not counted'
+
+
+def test_queued_too_long_answers_503(limited, monkeypatch):
+    monkeypatch.setattr(limited, 'API_MAX_QUEUE_MS', 100)
+    limited.store.add_license(make_license('K'))
+    client = limited.app.test_client()
+    assert check(client, headers={'X-Request-Start': 't=%.3f' % (time.time() - 1)}).status_code == 503
+    assert check(client, headers={'X-Request-Start': 't=%d' % (time.time() * 1e6)}).status_code == 200
+
+
+def test_concurrency_default_follows_worker_threads(core, monkeypatch):
+    monkeypatch.setattr(core, 'API_CONCURRENCY_MAX', core.API_CONCURRENCY_MAX)
+    monkeypatch.setattr(core, 'API_CONCURRENCY_MAX_ENV', None)
+    monkeypatch.setattr(core, 'API_RESERVED_THREADS_ENV', None)
+    core.set_worker_counts(4, 8)
+    assert core.API_CONCURRENCY_MAX == 24
+    core.set_worker_counts(4, 1)
+    assert core.API_CONCURRENCY_MAX == 3
+    core.set_worker_counts(1, 1)
+    assert core.API_CONCURRENCY_MAX == 0, 'nothing to shed for with a single thread'
+    monkeypatch.setattr(core, 'API_RESERVED_THREADS_ENV', '2')
+    core.set_worker_counts(4, 8)
+    assert core.API_CONCURRENCY_MAX == 30
+    monkeypatch.setattr(core, 'API_CONCURRENCY_MAX_ENV', '5')
+    core.set_worker_counts(4, 8)
+    assert core.API_CONCURRENCY_MAX == 5
@@ -0,0 +1,128 @@
+import os
+
+import pytest
+
+import replica
+from conftest import TOOL, make_license, open_store, dump
+
+
+# ====== change feed ======
+def test_changes_from_an_empty_store(store):
+    # Seq 0 is a real position: a replica synced while the primary was
+    # empty must not be told to reset.
+    assert store.changes(0) == ([], 0, False)
+    assert store.changes(-1) == ([], 0, True)
+    assert store.state()[0] == 0
+
+
+def test_changes_follow_writes(store):
+    store.add_licenses([make_license('A'), make_license('B')])
+    store.add_license(make_license('C'))
+    changes, seq, reset = store.changes(0)
+    assert not reset and seq == 3
+    assert [(c['seq'], c['license']['key']) for c in changes] == [(1, 'A'), (2, 'B'), (3, 'C')]
+    assert store.changes(0, limit=2)[:2] == (changes[:2], 2)
+    assert store.changes(3) == ([], 3, False)
+
+    store.update_license('A', {'active': False})
+    changes, seq, reset = store.changes(3)
+    assert [(c['seq'], c['license']['key'], c['license']['active']) for c in changes] == [(4, 'A', False)]
+    assert store.changes(5)[2], 'a position ahead of the store resets'
+
+
+def test_changes_before_compaction_reset(json_backend, tmp_path):
+    store = open_store(json_backend, tmp_path)
+    store.add_licenses([make_license('A'), make_license('B')])
+    store.compact()
+    store.add_license(make_license('C'))
+    assert store.changes(1)[2]
+    changes, seq, reset = store.changes(2)
+    assert not reset and seq == 3 and [c['license']['key'] for c in changes] == ['C']
+
+
+def test_apply_changes_replicates(store, backend, tmp_path):
+    store.add_licenses([make_license('A'), make_license('B', device_id='')])
+    store.replace_tools([TOOL])
+    replica = open_store(backend, tmp_path / 'replica')
+
+    seq, licenses, tools = store.state()
+    replica.apply_changes([{'type': 'tools', 'tools': tools}]
+                          + [{'type': 'license', 'license': lic.to_dict()} for lic in licenses])
+    store.update_license('B', {'device_id': 'dev-b'})
+    changes, seq, reset = store.changes(seq)
+    assert not reset
+    replica.apply_changes(changes)
+    assert dump(replica) == dump(store)
+    assert replica.tools() == store.tools()
+
+
+# ====== follower ======
+@pytest.fixture
+def follower(server, backend, tmp_path, monkeypatch):
+    data_dir = tmp_path / 'replica'
+    follower = replica.Follower(server, open_store(backend, data_dir), str(data_dir), wait=0)
+    follower.resyncs = 0
+    resync = follower.resync
+
+    def counted():
+        follower.resyncs += 1
+        resync()
+    monkeypatch.setattr(follower, 'resync', counted)
+    return follower
+
+
+def test_first_poll_loads_everything(app_module, follower):
+    app_module.store.add_licenses([make_license('A'), make_license('B', device_id='')])
+    follower.poll()
+    assert follower.resyncs == 1 and follower.position() == 2
+    assert dump(follower.store) == dump(app_module.store)
+
+
+def test_empty_primary_does_not_resync_again(app_module, follower):
+    # Synced at seq 0 is still synced.
+    follower.poll()
+    follower.poll()
+    assert follower.resyncs == 1 and follower.position() == 0
+    app_module.store.add_license(make_license('A'))
+    follower.poll()
+    assert follower.resyncs == 1 and follower.position() == 1
+    assert follower.store.get_license('A')
+
+
+def test_polls_apply_new_changes(app_module, follower):
+    app_module.store.add_license(make_license('A', device_id=''))
+    follower.poll()
+    app_module.store.update_license('A', {'device_id': 'dev'})
+    app_module.store.add_license(make_license('B'))
+    follower.poll()
+    assert follower.resyncs == 1 and follower.position() == 3
+    assert dump(follower.store) == dump(app_module.store)
+
+
+def test_position_survives_restart(app_module, follower, server):
+    app_module.store.add_license(make_license('A'))
+    follower.poll()
+    app_module.store.add_license(make_license('B'))
+    restarted = replica.Follower(server, follower.store, os.path.dirname(follower.position_file), wait=0)
+    assert restarted.position() == 1
+    restarted.poll()
+    assert restarted.position() == 2 and follower.store.get_license('B')
+
+
+@pytest.mark.parametrize('backend', ['json', 'snapshot'])
+def test_resync_after_primary_compacts(app_module, follower):
+    app_module.store.add_license(make_license('A'))
+    follower.poll()
+    app_module.store.add_licenses([make_license('B'), make_license('C')])
+    app_module.store.compact()
+    follower.poll()
+    assert follower.resyncs == 2 and follower.position() == 3
+    assert dump(follower.store) == dump(app_module.store)
+
+
+def test_resync_when_ahead_of_primary(app_module, follower):
+    # e.g. the primary was restored from an older backup.
+    app_module.store.add_license(make_license('A'))
+    follower._save_position(5)
+    follower.poll()
+    assert follower.resyncs == 1 and follower.position() == 1
@@ -0,0 +1,88 @@
+import revocations
+from conftest import make_license, open_store
+
+
+def revoked_set(store):
+    return {lic.key for lic in store.licenses() if not lic.active}
+
+
+def test_encode_round_trips():
+    keys = sorted(['', 'A', 'AB', 'ABC', 'ABD', 'B' * 300, 'KEY-ü', 'KEY-üx'])
+    assert revocations.decode(revocations.encode(keys)) == keys
+    assert revocations.decode(revocations.encode([])) == []
+
+
+def test_first_call_is_full(store):
+    store.add_licenses([make_license('A', active=False), make_license('B'), make_license('C', active=False)])
+    body = revocations.RevocationList(store).since()
+    assert body['full'] and body['count'] == 2 and body['version'] == 3
+    assert revocations.decode(body['keys']) == ['A', 'C']
+
+
+def test_deltas_since_a_version(store):
+    store.add_licenses([make_license('A', active=False), make_license('B'), make_license('C')])
+    revocations_list = revocations.RevocationList(store)
+    first = revocations_list.since()
+    client = revocations.apply(set(), first)
+
+    store.update_license('B', {'active': False})
+    store.update_license('A', {'active': True})
+    store.update_license('C', {'active': False})
+    store.update_license('C', {'active': True})
+    store.update_license('B', {'expiry': '2031-01-01'})
+    delta = revocations_list.since(first['version'])
+    assert delta == {'version': first['version'] + 5, 'full': False, 'added': ['B'], 'removed': ['A']}
+    client = revocations.apply(client, delta)
+    assert client == revoked_set(store) == {'B'}
+    assert revocations_list.since(delta['version']) == {'version': delta['version'], 'full': False,
+                                                        'added': [], 'removed': []}
+
+
+def test_unknown_or_too_old_versions_get_everything(store):
+    store.add_licenses([make_license('K%d' % i) for i in range(5)])
+    revocations_list = revocations.RevocationList(store, max_deltas=2)
+    start = revocations_list.since()['version']
+    for i in range(3):
+        store.update_license('K%d' % i, {'active': False})
+    assert revocations_list.since(start)['full'], 'deltas no longer reach back'
+    assert not revocations_list.since(start + 1)['full']
+    assert revocations_list.since(start + 100)['full'], 'a version from another server'
+
+
+def test_changes_from_another_worker(backend, tmp_path):
+    ours = open_store(backend, tmp_path)
+    other = open_store(backend, tmp_path)
+    ours.add_licenses([make_license('A'), make_license('B')])
+    revocations_list = revocations.RevocationList(ours)
+    version = revocations_list.since()['version']
+    other.update_license('A', {'active': False})
+    assert revocations_list.since(version)['added'] == ['A']
+    assert revocations_list.keys() == ['A']
+
+
+def test_compaction_keeps_client_versions(json_backend, tmp_path):
+    # The change feed can't reach back across a compaction, so the list
+    # rebuilds from the store and records the difference as deltas.
+    store = open_store(json_backend, tmp_path)
+    store.add_licenses([make_license('A', active=False), make_license('B'), make_license('C')])
+    revocations_list = revocations.RevocationList(store)
+    first = revocations_list.since()
+    client = revocations.apply(set(), first)
+    other = open_store(json_backend, tmp_path)
+    other.update_license('B', {'active': False})
+    other.update_license('A', {'active': True})
+    other.compact()
+    other.update_license('C', {'active': False})
+    delta = revocations_list.since(first['version'])
+    assert not delta['full']
+    assert revocations.apply(client, delta) == revoked_set(store) == {'B', 'C'}
+
+
+def test_api(app_module, client):
+    app_module.store.add_licenses([make_license('A'), make_license('B', active=False)])
+    body = client.get('/api/license/revocations').get_json()
+    assert body['full'] and revocations.decode(body['keys']) == ['B']
+    client.post('/api/license/revoke', json={'key': 'A'})
+    delta = client.get('/api/license/revocations?since=%d' % body['version']).get_json()
+    assert delta['added'] == ['A'] and delta['removed'] == []
+    assert client.get('/api/license/revoked').get_json() == {'keys': ['A', 'B']}
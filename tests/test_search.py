@@ -0,0 +1,95 @@
+import re
+import random
+from datetime import date
+
+import pytest
+
+from conftest import make_license, open_store
+
+TODAY = date(2025, 1, 15)
+STATUSES = ['', 'Active', 'Expired', 'Disabled']
+
+
+def status(lic):
+    if not lic.active:
+        return 'Disabled'
+    return 'Expired' if lic.expiry < TODAY.isoformat() else 'Active'
+
+
+def expected(store, q, wanted):
+    q = q.lower()
+    return sorted(lic.key for lic in store.licenses()
+                  if (q in lic.key.lower() or q in lic.device_id.lower()) and wanted in ('', status(lic)))
+
+
+def walk(store, q, wanted, limit=7):
+    # Every page forward by `after`, then back again by `before`.
+    forward, after, pages = [], None, []
+    while True:
+        page, has_prev, has_next = store.search_licenses(q, wanted, TODAY, after=after, limit=limit)
+        assert has_prev == (after is not None)
+        pages.append([lic.key for lic in page])
+        forward += pages[-1]
+        if not has_next:
+            break
+        after = page[-1].key
+    backward = pages[-1]
+    for prev in reversed(pages[:-1]):
+        page, has_prev, has_next = store.search_licenses(q, wanted, TODAY, before=backward[0], limit=limit)
+        assert [lic.key for lic in page] == prev and has_next
+        backward = prev
+    return forward
+
+
+@pytest.fixture
+def populated(store, backend, tmp_path):
+    # For the JSON backends part of the data is compacted (for 'snapshot',
+    # into licenses.snap) and the rest, plus changes to compacted licenses,
+    # sit in the journal overlay.
+    rng = random.Random(8)
+
+    def batch(prefix, n):
+        return [make_license('%s%04dX%s' % (prefix, i, rng.choice('abc')), device_id=rng.choice(['', 'dev-%d' % i]),
+                             expiry=rng.choice(['2024-12-01', '2025-01-14', '2025-01-15', '2026-06-01']),
+                             active=rng.random() > 0.2) for i in range(n)]
+    store.add_licenses(batch('BASE', 60))
+    if backend != 'sqlite':
+        store.compact()
+    store.add_licenses(batch('OVER', 30))
+    for i in range(0, 60, 6):
+        key = next(lic.key for lic in store.licenses() if lic.key.startswith('BASE%04d' % i))
+        store.update_license(key, {'active': i % 12 != 0, 'expiry': '2024-01-01', 'device_id': 'moved-%d' % i})
+    return open_store(backend, tmp_path / 'primary') if backend != 'sqlite' else store
+
+
+@pytest.mark.parametrize('q', ['', 'base00', 'over', 'xb', 'dev-1', 'moved', 'nothing'])
+@pytest.mark.parametrize('wanted', STATUSES)
+def test_search_pages_match_a_scan(populated, q, wanted):
+    assert walk(populated, q, wanted) == expected(populated, q, wanted)
+
+
+def test_search_before_the_first_key(populated):
+    first = expected(populated, '', '')[0]
+    assert populated.search_licenses('', '', TODAY, before=first) == ([], False, True)
+
+
+def test_admin_pages_by_key(app_module, client):
+    app_module.store.add_licenses([make_license('K%02d' % i) for i in range(20)])
+    html = client.get('/licenses').get_data(as_text=True)
+    assert 'K00' in html and 'K14' in html and 'K15' not in html
+    assert 'after=K14' in html and 'before=' not in html
+    html = client.get('/licenses?after=K14').get_data(as_text=True)
+    assert 'K15' in html and 'K19' in html and 'K14' not in html
+    assert 'before=K15' in html and 'after=' not in html
+
+
+def test_tool_pages_show_a_window(app_module, client):
+    app_module.store.replace_tools([{'name': 'tool%03d' % i, 'version': '1', 'download_url': 'https://x/%d' % i,
+                                     'update_required': False} for i in range(200)])
+    html = client.get('/tools?page=10').get_data(as_text=True)
+    links = {int(p) for p in re.findall(r'page=(\d+)', html)}
+    assert links == {1, 8, 9, 11, 12, 20}, 'prev/next, neighbours, first and last'
+    assert '<span class="current">10</span>' in html
+    assert 'tool090' in html and 'tool100' not in html
+    html = client.get('/tools?page=999').get_data(as_text=True)
+    assert '<span class="current">20</span>' in html and 'Next' not in html
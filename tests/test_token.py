@@ -0,0 +1,74 @@
+from datetime import date, timedelta
+
+import pytest
+
+import license_token
+from conftest import make_license, at, set_time
+
+EXPIRY = date(2025, 1, 20)
+
+
+def token(client, key='K'):
+    response = client.post('/api/license/token', json={'key': key, 'device_id': 'dev', 'version': '1'})
+    return response.status_code, response.get_json()
+
+
+def test_token_lasts_its_ttl(app_module, client, monkeypatch):
+    monkeypatch.setattr(app_module, 'TOKEN_TTL', 3600)
+    app_module.store.add_license(make_license('K', expiry=EXPIRY.isoformat()))
+    now = at(EXPIRY - timedelta(days=3))
+    set_time(app_module, now)
+    code, body = token(client)
+    assert code == 200 and body['token_expires'] == now + 3600
+    claims = license_token.verify(body['token'], app_module.TOKEN_SECRET, device_id='dev', version='1', now=now)
+    assert (claims['k'], claims['e'], claims['x']) == ('K', '2025-01-20', now + 3600)
+    with pytest.raises(license_token.InvalidToken, match='expired'):
+        license_token.verify(body['token'], app_module.TOKEN_SECRET, now=now + 3601)
+
+
+def test_token_ends_with_the_license(app_module, client, monkeypatch):
+    monkeypatch.setattr(app_module, 'TOKEN_TTL', 86400)
+    app_module.store.add_license(make_license('K', expiry=EXPIRY.isoformat()))
+    midnight = at(EXPIRY, 0)
+    set_time(app_module, at(EXPIRY - timedelta(days=1), 20))
+    code, body = token(client)
+    assert code == 200 and body['token_expires'] == midnight
+    license_token.verify(body['token'], app_module.TOKEN_SECRET, now=midnight)
+    with pytest.raises(license_token.InvalidToken, match='expired'):
+        license_token.verify(body['token'], app_module.TOKEN_SECRET, now=midnight + 1)
+
+    set_time(app_module, midnight)
+    assert token(client) == (403, {'status': 'expired'})
+
+
+def test_no_token_for_a_failed_check(app_module, client):
+    app_module.store.add_license(make_license('K', active=False))
+    assert token(client) == (403, {'status': 'revoked'})
+    assert token(client, key='missing') == (404, {'status': 'not_found'})
+
+
+def test_token_without_license_end_uses_expiry_date():
+    # What a client computes from the expiry string matches the server's cap.
+    _, expires = license_token.issue('secret', 'K', 'dev', '1', EXPIRY.isoformat(), 10 ** 9, now=at(EXPIRY, 0) - 60)
+    assert expires == at(EXPIRY, 0)
+
+
+def test_token_verify_rejects_tampering():
+    token, _ = license_token.issue('secret', 'K', 'dev', '1', '2030-01-01', 3600, now=1000)
+    with pytest.raises(license_token.InvalidToken, match='bad signature'):
+        license_token.verify(token, 'other', now=1000)
+    with pytest.raises(license_token.InvalidToken, match='device_mismatch'):
+        license_token.verify(token, 'secret', device_id='other', now=1000)
+    with pytest.raises(license_token.InvalidToken, match='version_mismatch'):
+        license_token.verify(token, 'secret', version='2', now=1000)
+    with pytest.raises(license_token.InvalidToken, match='revoked'):
+        license_token.verify(token, 'secret', revoked={'K'}, now=1000)
+    with pytest.raises(license_token.InvalidToken, match='malformed'):
+        license_token.verify('not-a-token', 'secret', now=1000)
+
+
+def test_token_endpoint_off_without_its_own_secret(app_module, client, monkeypatch):
+    app_module.store.add_license(make_license('K', expiry=EXPIRY.isoformat()))
+    monkeypatch.setattr(app_module, 'TOKEN_SECRET', None)
+    status, body = token(client)
+    assert status == 404 and 'token' not in body
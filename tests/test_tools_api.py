@@ -0,0 +1,56 @@
+import gzip
+import json
+
+from conftest import TOOL
+
+OTHER = dict(TOOL, name='Other', version='2.0-bêta')
+
+
+def test_cached_body_is_what_jsonify_sends(app_module):
+    import async_server
+    obj = {'tools': [OTHER, TOOL]}
+    with app_module.app.test_request_context():
+        assert app_module.CachedBody(obj).body == app_module.jsonify(obj).get_data()
+    assert app_module.CachedBody(obj).body == async_server._json(obj)
+
+
+def test_tools_bodies(app_module, client):
+    app_module.store.replace_tools([TOOL, OTHER])
+    resp = client.get('/api/tools')
+    assert resp.status_code == 200 and resp.mimetype == 'application/json'
+    assert json.loads(resp.data) == {'tools': [TOOL, OTHER]}
+    assert b', ' not in resp.data and b': ' not in resp.data
+    assert client.get('/api/tool/other').get_json() == OTHER
+    assert client.get('/api/tool/missing').status_code == 404
+
+
+def test_etag_and_not_modified(app_module, client):
+    app_module.store.replace_tools([TOOL])
+    resp = client.get('/api/tools')
+    etag = resp.headers['ETag']
+    assert resp.headers['Cache-Control'] == 'public, max-age=%d' % app_module.TOOLS_MAX_AGE
+    assert resp.headers['Vary'] == 'Accept-Encoding'
+    cached = client.get('/api/tools', headers={'If-None-Match': etag})
+    assert cached.status_code == 304 and cached.data == b'' and cached.headers['ETag'] == etag
+
+    app_module.store.replace_tools([TOOL, OTHER])
+    changed = client.get('/api/tools', headers={'If-None-Match': etag})
+    assert changed.status_code == 200 and changed.headers['ETag'] != etag
+
+
+def test_gzip_is_its_own_representation(app_module, client, monkeypatch):
+    monkeypatch.setattr(app_module, 'TOOLS_GZIP', True)
+    app_module.store.replace_tools([TOOL])
+    plain = client.get('/api/tools')
+    zipped = client.get('/api/tools', headers={'Accept-Encoding': 'gzip, deflate'})
+    assert zipped.headers['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(zipped.data) == plain.data
+    assert zipped.headers['ETag'] != plain.headers['ETag']
+    assert client.get('/api/tools', headers={'Accept-Encoding': 'gzip',
+                                             'If-None-Match': zipped.headers['ETag']}).status_code == 304
+    # The plain ETag doesn't validate the gzipped body.
+    assert client.get('/api/tools', headers={'Accept-Encoding': 'gzip',
+                                             'If-None-Match': plain.headers['ETag']}).status_code == 200
+
+    monkeypatch.setattr(app_module, 'TOOLS_GZIP', False)
+    assert 'Content-Encoding' not in client.get('/api/tools', headers={'Accept-Encoding': 'gzip'}).headers
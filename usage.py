@@ -0,0 +1,211 @@
+# License usage analytics: last seen, check counts and active devices.
+#
+# Checks are recorded into an in-process buffer (a few dict updates, no
+# I/O) and a background thread flushes it every few seconds in one SQLite
+# transaction to <DATA_DIR>/usage.db, shared by all workers and separate
+# from the license data so analytics never touch the license journal.
+#
+# Aggregates are fixed-size: per license only last_seen and a check count;
+# per hour (a ring of HOURS slots, reused a week later) the checks, checks
+# per tool version and a HyperLogLog sketch of the distinct devices, so
+# active devices per hour or per day come from at most HOURS small rows.
+import os
+import math
+import time
+import atexit
+import sqlite3
+import hashlib
+import logging
+import threading
+from contextlib import closing
+
+log = logging.getLogger(__name__)
+
+HOURS = 168
+HLL_BITS = 10                  # 1024 one-byte registers, ~3% error
+HLL_SIZE = 1 << HLL_BITS
+VERSION_MAX_LEN = 64
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS license_usage (
+    key TEXT PRIMARY KEY,
+    last_seen INTEGER NOT NULL,
+    checks INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS license_usage_seen ON license_usage(last_seen);
+-- Ring buffers: slot = hour % 168; a slot holding an older hour is reset
+-- when that hour comes round again.
+CREATE TABLE IF NOT EXISTS usage_hours (
+    slot INTEGER PRIMARY KEY,
+    hour INTEGER NOT NULL,
+    checks INTEGER NOT NULL,
+    devices BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS version_hours (
+    version TEXT NOT NULL,
+    slot INTEGER NOT NULL,
+    hour INTEGER NOT NULL,
+    checks INTEGER NOT NULL,
+    PRIMARY KEY (version, slot)
+);
+"""
+
+
+# ====== HyperLogLog ======
+def hll_add(registers, item):
+    h = int.from_bytes(hashlib.blake2b(item.encode(), digest_size=8).digest(), 'big')
+    rest = h & ((1 << (64 - HLL_BITS)) - 1)
+    rank = 64 - HLL_BITS - rest.bit_length() + 1
+    i = h >> (64 - HLL_BITS)
+    if rank > registers[i]:
+        registers[i] = rank
+
+def hll_merge(a, b):
+    return bytearray(max(x, y) for x, y in zip(a, b))
+
+def hll_count(registers):
+    m = len(registers)
+    estimate = 0.7213 / (1 + 1.079 / m) * m * m / sum(2.0 ** -r for r in registers)
+    zeros = registers.count(0)
+    if estimate <= 2.5 * m and zeros:
+        estimate = m * math.log(m / zeros)
+    return round(estimate)
+
+
+class UsageTracker:
+    def __init__(self, path, flush_interval=5.0):
+        self.path = path
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._pid = None
+        self._reset()
+        with closing(self._connect()) as conn:
+            conn.executescript(SCHEMA)
+        atexit.register(self.flush)
+
+    def _reset(self):
+        self._seen = {}        # key -> [last_seen, checks]
+        self._hours = {}       # hour -> [checks, HLL registers]
+        self._versions = {}    # (version, hour) -> checks
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        return conn
+
+    def record(self, key, device_id, version, now=None):
+        now = int(time.time() if now is None else now)
+        hour = now // 3600
+        if not isinstance(version, str):
+            version = ''
+        with self._lock:
+            if self._pid != os.getpid():
+                # First check in this process (forked workers included).
+                self._pid = os.getpid()
+                self._reset()
+                threading.Thread(target=self._run, name='usage-flush', daemon=True).start()
+            seen = self._seen.get(key)
+            if seen is None:
+                self._seen[key] = [now, 1]
+            else:
+                seen[0] = max(seen[0], now)
+                seen[1] += 1
+            slot = self._hours.get(hour)
+            if slot is None:
+                slot = self._hours[hour] = [0, bytearray(HLL_SIZE)]
+            slot[0] += 1
+            if device_id and isinstance(device_id, str):
+                hll_add(slot[1], device_id)
+            vkey = (version[:VERSION_MAX_LEN], hour)
+            self._versions[vkey] = self._versions.get(vkey, 0) + 1
+
+    def _run(self):
+        pid = os.getpid()
+        while self._pid == pid:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except sqlite3.Error as e:
+                log.warning('Usage flush failed: %s', e)
+
+    def flush(self):
+        with self._lock:
+            seen, hours, versions = self._seen, self._hours, self._versions
+            self._reset()
+        if not (seen or hours):
+            return
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.executemany(
+                'INSERT INTO license_usage (key, last_seen, checks) VALUES (?, ?, ?) ON CONFLICT (key) DO UPDATE '
+                'SET last_seen = MAX(last_seen, excluded.last_seen), checks = checks + excluded.checks',
+                ((key, s[0], s[1]) for key, s in seen.items()))
+            for hour, (checks, registers) in hours.items():
+                row = conn.execute('SELECT hour, checks, devices FROM usage_hours WHERE slot = ?',
+                                   (hour % HOURS,)).fetchone()
+                if row and row[0] == hour:
+                    checks += row[1]
+                    registers = hll_merge(registers, row[2])
+                elif row and row[0] > hour:
+                    continue  # a late flush for an hour already overwritten
+                conn.execute('INSERT OR REPLACE INTO usage_hours (slot, hour, checks, devices) VALUES (?, ?, ?, ?)',
+                             (hour % HOURS, hour, checks, bytes(registers)))
+            conn.executemany(
+                'INSERT INTO version_hours (version, slot, hour, checks) VALUES (?, ?, ?, ?) '
+                'ON CONFLICT (version, slot) DO UPDATE SET '
+                'checks = CASE WHEN hour = excluded.hour THEN checks + excluded.checks ELSE excluded.checks END, '
+                'hour = excluded.hour WHERE hour <= excluded.hour',
+                ((version, hour % HOURS, hour, n) for (version, hour), n in versions.items()))
+            conn.execute('COMMIT')
+        except BaseException:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
+
+    # --- reads ---
+    def license_usage(self, key):
+        # (last_seen unix time, checks) or None if never checked.
+        with closing(self._connect()) as conn:
+            return conn.execute('SELECT last_seen, checks FROM license_usage WHERE key = ?', (key,)).fetchone()
+
+    def seen_since(self, since):
+        with closing(self._connect()) as conn:
+            return conn.execute('SELECT COUNT(*) FROM license_usage WHERE last_seen >= ?', (int(since),)).fetchone()[0]
+
+    def hourly(self, now=None):
+        # The last HOURS hours, oldest first: [{"hour", "checks", "devices"}].
+        now = int(time.time() if now is None else now)
+        current = now // 3600
+        with closing(self._connect()) as conn:
+            rows = conn.execute('SELECT hour, checks, devices FROM usage_hours WHERE hour > ?',
+                                (current - HOURS,)).fetchall()
+        found = {hour: (checks, devices) for hour, checks, devices in rows}
+        series = []
+        for hour in range(current - HOURS + 1, current + 1):
+            checks, devices = found.get(hour, (0, None))
+            series.append({'hour': hour, 'checks': checks, 'devices': hll_count(devices) if devices else 0})
+        return series
+
+    def daily_devices(self, days=7, now=None):
+        # Distinct devices per UTC day (union of that day's hourly sketches),
+        # oldest first: [(day start unix time, devices)].
+        now = int(time.time() if now is None else now)
+        first = now // 86400 - days + 1
+        with closing(self._connect()) as conn:
+            rows = conn.execute('SELECT hour, devices FROM usage_hours WHERE hour >= ?', (first * 24,)).fetchall()
+        sketches = {}
+        for hour, devices in rows:
+            day = hour // 24
+            sketches[day] = hll_merge(sketches[day], devices) if day in sketches else bytearray(devices)
+        return [(day * 86400, hll_count(sketches[day]) if day in sketches else 0)
+                for day in range(first, first + days)]
+
+    def versions(self, now=None):
+        # Checks per tool version over the last HOURS hours, most first.
+        now = int(time.time() if now is None else now)
+        with closing(self._connect()) as conn:
+            return conn.execute('SELECT version, SUM(checks) FROM version_hours WHERE hour > ? '
+                                'GROUP BY version ORDER BY 2 DESC', (now // 3600 - HOURS,)).fetchall()